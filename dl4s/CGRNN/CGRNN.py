@@ -5,8 +5,10 @@ Descriptions: the file contains the model description of CGRNN.
               ----2017.11.15
 #########################################################################"""
 from .utility import configCGRNN, CGCell
-from dl4s.cores.tools import BernoulliNLL
+from dl4s.SeqVAE.utility import stepCell
+from dl4s.cores.tools import BernoulliNLL, MaskedMean, feedable_state
 from dl4s.cores.model import _model
+from dl4s.cores.evaluation import shardedLogZ
 import tensorflow as tf
 import numpy as np
 
@@ -29,12 +31,26 @@ class _CGRNN(_model, object):
 
         super().__init__(config)
         with self._graph.as_default():
-            # <scalar> the steps of Gibbs sampling.
-            self._gibbs = config.Gibbs
+            # <tensor scalar> the steps of Gibbs sampling, which could be fed at run time.
+            self.gibbs = tf.placeholder_with_default(config.Gibbs, shape=(), name='gibbs')
+            # <list> the inverse temperatures of parallel tempering (None for plain Gibbs sampling).
+            self._tempering = config.Tempering
             # <scalar> the number of samples of AIS.
             self._aisRun = config.aisRun
             # <scalar> the number of intermediate proposal distributions of AIS.
             self._aisLevel = config.aisLevel
+            # <scalar> the number of AIS runs annealed at a time (None for all at once).
+            self._aisChunk = config.aisChunk
+            # <string> the annealing schedule of AIS.
+            self._aisSchedule = config.aisSchedule
+            # <scalar> the target fraction of effective runs of the adaptive schedule.
+            self._aisTargetESS = config.aisTargetESS
+            # <scalar> the number of processes that share the AIS runs.
+            self._numThreads = config.numThreads
+            # <dict/None> the pool of processes of the sharded AIS (started on the first use).
+            self._aisPool = None
+            # <bool> whether to import the VAE into the graph of the model for NVIL.
+            self._fuseVAE = config.fuseVAE
             # <scalar> dimensions of input frame.
             self._dimInput = config.dimIN
             # <scalar> dimensions of stochastic states.
@@ -66,10 +82,12 @@ class binCGRNN(_CGRNN, object):
         super().__init__(config)
         """build the graph"""
         with self._graph.as_default():
-            self.Cell = CGCell(config, inputType='binary')
-            state = self.Cell.zero_state(tf.shape(self.x)[0], dtype=tf.float32)
-            (self.newV, self.newH, self.newS, self.muV, self.muH, self.muS, bvt, bht), _ = \
-                tf.nn.dynamic_rnn(self.Cell, self.x, initial_state=state)
+            self.Cell = CGCell(config, inputType='binary', gibbs=self.gibbs)
+            self._initState = feedable_state(self.Cell.zero_state(tf.shape(self.x)[0], dtype=tf.float32))
+            # the input MLP could run over the whole sequence outside the recurrence.
+            cell, input = (stepCell(self.Cell), self.Cell.prepare(self.x)) if config.hoistMLP else (self.Cell, self.x)
+            (self.newV, self.newH, self.newS, self.muV, self.muH, self.muS, bvt, bht), self._finalState = \
+                tf.nn.dynamic_rnn(cell, input, sequence_length=self.seqLen, initial_state=self._initState)
             # update the RBM's bias with bvt & bht.
             self.Cell.RBM._bh = bht
             self.Cell.RBM._bv = bvt
@@ -80,41 +98,58 @@ class binCGRNN(_CGRNN, object):
             self._feature = muH0
             self._sparse_feature = muH0 * muS0
             # the training loss is per bits.
-            Loss = self.Cell.RBM.ComputeLoss(V=self.x, samplesteps=config.Gibbs)
-            self._loss = BernoulliNLL(self.x, self.muV)
+            Loss = self.Cell.RBM.ComputeLoss(V=self.x, samplesteps=self.gibbs, mask=self._mask,
+                                             tempering=self._tempering)
+            self._loss = BernoulliNLL(self.x, self.muV, self._mask)
             self._params = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES)
-            self._train_step = self._optimizer.minimize(Loss)
+            self._lazy('train', lambda: self._minimize(Loss))
             # Define the components to evaluate the partition function by whether NVIL or AIS.
-            if VAE is None:
-                self._logZ = self.Cell.RBM.AIS(self._aisRun, self._aisLevel,
-                                           tf.shape(self.x)[0], tf.shape(self.x)[1])
-                self._nll = tf.reduce_mean(self.Cell.RBM.FreeEnergy(self.x) + self._logZ)
-                #self._nll = self._logZ
-                #self._nll = self.Cell.RBM.FreeEnergy(self.x)
-                self.VAE = VAE
-            else:
-                self._logZ = self._NVIL_VAE(VAE)  # X, logPz_X, logPx_Z, logPz, VAE.x
-                self.xx = tf.placeholder(dtype='float32', shape=[None, None, None, config.dimIN])
-                self.FEofSample = self.Cell.RBM.FreeEnergy(self.xx)
-                self.FEofInput = self.Cell.RBM.FreeEnergy(self.x)
-                self.VAE = VAE
+            self.VAE = VAE
+            # the components to compute the AIS/NVIL are built on the first use.
+            def build_ais():
+                if VAE is None:
+                    self._logZ = self.Cell.RBM.AIS(self._aisRun, self._aisLevel,
+                                               tf.shape(self.x)[0], tf.shape(self.x)[1], chunk=self._aisChunk,
+                                               schedule=self._aisSchedule, targetESS=self._aisTargetESS)
+                    self._nll = MaskedMean(self.Cell.RBM.FreeEnergy(self.x) + self._logZ, self._mask)
+                    # the moments of the AIS weights and the effective sample size.
+                    self._aisMoments = self.Cell.RBM.aisMoments
+                    self._ess = self.Cell.RBM.aisESS
+                    #self._nll = self._logZ
+                    #self._nll = self.Cell.RBM.FreeEnergy(self.x)
+                elif self._fuseVAE:
+                    # The VAE is frozen into this graph so that NVIL runs in one session call.
+                    self._logZ = self._fusedNVIL(VAE, self._NVIL_VAE(VAE)[0:-1],
+                                                 self.Cell.RBM.FreeEnergy, runs=self._aisRun, scale=1000.)
+                    self._nll = tf.reduce_mean(self.Cell.RBM.FreeEnergy(self.x) + self._logZ)
+                else:
+                    self._logZ = self._NVIL_VAE(VAE)  # X, logPz_X, logPx_Z, logPz, VAE.x
+                    self.xx = tf.placeholder(dtype='float32', shape=[None, None, None, config.dimIN])
+                    self.FEofSample = self.Cell.RBM.FreeEnergy(self.xx)
+                    self.FEofInput = self.Cell.RBM.FreeEnergy(self.x)
+            self._lazy('ais', build_ais)
             """define the process to generate samples."""
-            state = self.Cell.zero_state(1, dtype=tf.float32)
-            x_ = tf.zeros((1, self._dimInput), dtype='float32')
-            # TensorArray to save the output of the generating.
-            gen_operator = tf.TensorArray(tf.float32, self.sampleLen)
-            # condition and body of while loop (input: i-iteration, xx-RNN input, ss-RNN state)
-            i = tf.constant(0)
-            cond = lambda i, xx, ss, array: tf.less(i, self.sampleLen)
-            #
-            def body(i, xx, ss, array):
-                ii = i + 1
-                (new_xx, _, _, _, _, _, _, _), new_ss = self.Cell(xx, ss, gibbs=1)
-                new_array = array.write(i, new_xx)
-                return ii, new_xx, new_ss, new_array
+            def build_gen():
+                # the state and the first input are fed to continue a primed prefix.
+                state = feedable_state(self.Cell.zero_state(self.sampleNum, dtype=tf.float32))
+                x_ = tf.placeholder_with_default(tf.zeros((self.sampleNum, self._dimInput), dtype='float32'),
+                                                 shape=[None, self._dimInput])
+                self._genSeed = (x_, state)
+                # TensorArray to save the output of the generating.
+                gen_operator = tf.TensorArray(tf.float32, self.sampleLen)
+                # condition and body of while loop (input: i-iteration, xx-RNN input, ss-RNN state)
+                i = tf.constant(0)
+                cond = lambda i, xx, ss, array: tf.less(i, self.sampleLen)
+                #
+                def body(i, xx, ss, array):
+                    ii = i + 1
+                    (new_xx, _, _, _, _, _, _, _), new_ss = self.Cell(xx, ss, gibbs=1)
+                    new_array = array.write(i, new_xx)
+                    return ii, new_xx, new_ss, new_array
 
-            gen_operator = tf.while_loop(cond, body, [i, x_, state, gen_operator])[-1]
-            self._gen_operator = gen_operator.concat()
+                gen_operator = tf.while_loop(cond, body, [i, x_, state, gen_operator])[-1]
+                return tf.transpose(gen_operator.stack(), [1, 0, 2])
+            self._lazy('gen', self.Cell.RBM.preserve(build_gen))
             #
             self._runSession()
 
@@ -147,11 +182,26 @@ class binCGRNN(_CGRNN, object):
     ais_function: compute the approximated negative log-likelihood with partition
                   function computed by annealed importance sampling.
     input: input - numerical input.
-    output: the negative log-likelihood value.
+           seqLen - the valid length of each sequence (AIS only).
+           ess - if True, also return the effective sample size of AIS.
+    output: the negative log-likelihood value (and the ESS with shape
+            [batch, steps], None for NVIL).
     #########################################################################"""
-    def ais_function(self, input):
+    def ais_function(self, input, seqLen=None, ess=False):
         with self._graph.as_default():
+            self._build('ais')
+            ess_value = None
             if self.VAE is None:
+                feed = {self.x: input}
+                if seqLen is not None:
+                    feed[self.seqLen] = seqLen
+                if self._numThreads > 1:
+                    # the AIS runs are shared by several processes.
+                    feed[self._logZ], ess_value = shardedLogZ(self, input, seqLen, self._numThreads, scale=1000.)
+                    loss_value = self._sess.run(self._nll, feed_dict=feed)
+                else:
+                    loss_value, ess_value = self._sess.run([self._nll, self._ess], feed_dict=feed)
+            elif self._fuseVAE:
                 loss_value = self._sess.run(self._nll, feed_dict={self.x: input})
             else:
                 loss_value = []
@@ -179,7 +229,7 @@ class binCGRNN(_CGRNN, object):
                 FEofInput = np.cast[np.float64](FEofInput)
                 loss_value.append(np.mean(FEofInput + logZ * 1000))#self._dimInput))
                 loss_value = np.asarray(loss_value).mean()
-        return loss_value
+        return (loss_value, ess_value) if ess else loss_value
 
 # TODO"
 """#########################################################################
@@ -201,10 +251,13 @@ class gaussCGRNN(_CGRNN, object):
         super().__init__(config)
         """build the graph"""
         with self._graph.as_default():
-            self.Cell = CGCell(config, inputType='continuous')
-            state = self.Cell.zero_state(tf.shape(self.x)[0], dtype=tf.float32)
+            self.Cell = CGCell(config, inputType='continuous', gibbs=self.gibbs)
+            self._initState = feedable_state(self.Cell.zero_state(tf.shape(self.x)[0], dtype=tf.float32))
+            # the input MLP could run over the whole sequence outside the recurrence.
+            cell, input = (stepCell(self.Cell), self.Cell.prepare(self.x)) if config.hoistMLP else (self.Cell, self.x)
             (self.newV, self.newH, self.newS, self.muV, self.muH, self.muS,
-             self.bvt, self.bht, self.gamma), _ = tf.nn.dynamic_rnn(self.Cell, self.x, initial_state=state)
+             self.bvt, self.bht, self.gamma), self._finalState = \
+                tf.nn.dynamic_rnn(cell, input, sequence_length=self.seqLen, initial_state=self._initState)
             # update the RBM's bias with bvt & bht, gamma.
             self.Cell.RBM._bh = self.bht
             self.Cell.RBM._bv = self.bvt
@@ -216,51 +269,70 @@ class gaussCGRNN(_CGRNN, object):
             self._feature = muH0
             self._sparse_feature = muH0 * muS0
             # the training loss is per frame.
-            Loss = self.Cell.RBM.ComputeLoss(V=self.x, samplesteps=config.Gibbs)
+            Loss = self.Cell.RBM.ComputeLoss(V=self.x, samplesteps=self.gibbs, mask=self._mask,
+                                             tempering=self._tempering)
             # define the monitor.
             monitor = tf.reduce_sum((self.x - self.muV) ** 2, axis=-1)
-            self._loss = tf.sqrt(tf.reduce_mean(monitor))
+            self._loss = tf.sqrt(MaskedMean(monitor, self._mask))
             self._params = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES)
-            self._train_step = self._optimizer.minimize(Loss)
+            self._lazy('train', lambda: self._minimize(Loss))
             # add the computation of precision and covariance matrix of ssRBM.
-            newH = tf.expand_dims(self.newH, axis=2)
-            W = tf.expand_dims(tf.expand_dims(self.Cell.RBM._W, axis=0), axis=0)
-            term1 = newH * W / (self.Cell.RBM._alpha + 1e-8)
-            term1 = tf.tensordot(term1, self.Cell.RBM._W, [[-1], [-1]])
-            Cv_sh = 1 / (tf.expand_dims(self.Cell.RBM._gamma, axis=2) + tf.tensordot(newH, self.Cell.RBM._phi, [[-1], [0]]) + 1e-8)
-            term2 = Cv_sh * tf.eye(self._dimInput, batch_shape=[1, 1])
-            self.PreV_h = term2 + term1
-            self.CovV_h = tf.matrix_inverse(self.PreV_h)
+            def build_cov():
+                newH = tf.expand_dims(self.newH, axis=2)
+                W = tf.expand_dims(tf.expand_dims(self.Cell.RBM._W, axis=0), axis=0)
+                term1 = newH * W / (self.Cell.RBM._alpha + 1e-8)
+                term1 = tf.tensordot(term1, self.Cell.RBM._W, [[-1], [-1]])
+                Cv_sh = 1 / (tf.expand_dims(self.gamma, axis=2) + tf.tensordot(newH, self.Cell.RBM._phi, [[-1], [0]]) + 1e-8)
+                term2 = Cv_sh * tf.eye(self._dimInput, batch_shape=[1, 1])
+                PreV_h = term2 + term1
+                return PreV_h, tf.matrix_inverse(PreV_h)
+            self._lazy('cov', build_cov)
             #
-            if VAE is None:
-                self._logZ = self.Cell.RBM.AIS(self._aisRun, self._aisLevel,
-                                           tf.shape(self.x)[0], tf.shape(self.x)[1])
-                self._nll = tf.reduce_mean(self.Cell.RBM.FreeEnergy(self.x) + self._logZ)
-                self.VAE = VAE
-            else:
-                self._logZ = self._NVIL_VAE(VAE)  # X, logPz_X, logPx_Z, logPz, VAE.x
-                self.xx = tf.placeholder(dtype='float32', shape=[None, None, None, config.dimIN])
-                self.FEofSample = self.Cell.RBM.FreeEnergy(self.xx)
-                self.FEofInput = self.Cell.RBM.FreeEnergy(self.x)
-                self.VAE = VAE
+            self.VAE = VAE
+            # the components to compute the AIS/NVIL are built on the first use.
+            def build_ais():
+                if VAE is None:
+                    self._logZ = self.Cell.RBM.AIS(self._aisRun, self._aisLevel,
+                                               tf.shape(self.x)[0], tf.shape(self.x)[1], chunk=self._aisChunk,
+                                               schedule=self._aisSchedule, targetESS=self._aisTargetESS)
+                    self._nll = MaskedMean(self.Cell.RBM.FreeEnergy(self.x) + self._logZ, self._mask)
+                    # the moments of the AIS weights and the effective sample size.
+                    self._aisMoments = self.Cell.RBM.aisMoments
+                    self._ess = self.Cell.RBM.aisESS
+                elif self._fuseVAE:
+                    # The VAE is frozen into this graph so that NVIL runs in one session call.
+                    self._logZ = self._fusedNVIL(VAE, self._NVIL_VAE(VAE)[0:-1],
+                                                 self.Cell.RBM.FreeEnergy, runs=self._aisRun, scale=1000.)
+                    self._nll = tf.reduce_mean(self.Cell.RBM.FreeEnergy(self.x) + self._logZ)
+                else:
+                    self._logZ = self._NVIL_VAE(VAE)  # X, logPz_X, logPx_Z, logPz, VAE.x
+                    self.xx = tf.placeholder(dtype='float32', shape=[None, None, None, config.dimIN])
+                    self.FEofSample = self.Cell.RBM.FreeEnergy(self.xx)
+                    self.FEofInput = self.Cell.RBM.FreeEnergy(self.x)
+            self._lazy('ais', build_ais)
             """define the process to generate samples."""
-            state = self.Cell.zero_state(1, dtype=tf.float32)
-            x_ = tf.zeros((1, self._dimInput), dtype='float32')
-            # TensorArray to save the output of the generating.
-            gen_operator = tf.TensorArray(tf.float32, self.sampleLen)
-            # condition and body of while loop (input: i-iteration, xx-RNN input, ss-RNN state)
-            i = tf.constant(0)
-            cond = lambda i, xx, ss, array: tf.less(i, self.sampleLen)
+            def build_gen():
+                # the state and the first input are fed to continue a primed prefix.
+                state = feedable_state(self.Cell.zero_state(self.sampleNum, dtype=tf.float32))
+                x_ = tf.placeholder_with_default(tf.zeros((self.sampleNum, self._dimInput), dtype='float32'),
+                                                 shape=[None, self._dimInput])
+                self._genSeed = (x_, state)
+                # TensorArray to save the output of the generating.
+                gen_operator = tf.TensorArray(tf.float32, self.sampleLen)
+                # condition and body of while loop (input: i-iteration, xx-RNN input, ss-RNN state)
+                i = tf.constant(0)
+                cond = lambda i, xx, ss, array: tf.less(i, self.sampleLen)
 
-            #
-            def body(i, xx, ss, array):
-                ii = i + 1
-                (new_xx, _, _, _, _, _, _, _, _), new_ss = self.Cell(xx, ss, gibbs=1)
-                new_array = array.write(i, new_xx)
-                return ii, new_xx, new_ss, new_array
+                #
+                def body(i, xx, ss, array):
+                    ii = i + 1
+                    (new_xx, _, _, _, _, _, _, _, _), new_ss = self.Cell(xx, ss, gibbs=1)
+                    new_array = array.write(i, new_xx)
+                    return ii, new_xx, new_ss, new_array
 
-            gen_operator = tf.while_loop(cond, body, [i, x_, state, gen_operator])[-1]
-            self._gen_operator = gen_operator.concat()
+                gen_operator = tf.while_loop(cond, body, [i, x_, state, gen_operator])[-1]
+                return tf.transpose(gen_operator.stack(), [1, 0, 2])
+            self._lazy('gen', self.Cell.RBM.preserve(build_gen))
             #
             self._runSession()
 
@@ -268,11 +340,26 @@ class gaussCGRNN(_CGRNN, object):
     ais_function: compute the approximated negative log-likelihood with partition
                   function computed by annealed importance sampling.
     input: input - numerical input.
-    output: the negative log-likelihood value.
+           seqLen - the valid length of each sequence (AIS only).
+           ess - if True, also return the effective sample size of AIS.
+    output: the negative log-likelihood value (and the ESS with shape
+            [batch, steps], None for NVIL).
     #########################################################################"""
-    def ais_function(self, input):
+    def ais_function(self, input, seqLen=None, ess=False):
         with self._graph.as_default():
+            self._build('ais')
+            ess_value = None
             if self.VAE is None:
+                feed = {self.x: input}
+                if seqLen is not None:
+                    feed[self.seqLen] = seqLen
+                if self._numThreads > 1:
+                    # the AIS runs are shared by several processes.
+                    feed[self._logZ], ess_value = shardedLogZ(self, input, seqLen, self._numThreads, scale=1000.)
+                    loss_value = self._sess.run(self._nll, feed_dict=feed)
+                else:
+                    loss_value, ess_value = self._sess.run([self._nll, self._ess], feed_dict=feed)
+            elif self._fuseVAE:
                 loss_value = self._sess.run(self._nll, feed_dict={self.x: input})
             else:
                 loss_value = []
@@ -301,7 +388,7 @@ class gaussCGRNN(_CGRNN, object):
                 FEofInput = np.cast[np.float64](FEofInput)
                 loss_value.append(np.mean(FEofInput + logZ * 1000))  # self._dimInput))
                 loss_value = np.asarray(loss_value).mean()
-        return loss_value
+        return (loss_value, ess_value) if ess else loss_value
 
     """#########################################################################
     _NVIL_VAE: generate the graph to compute the NVIL upper bound of log Partition
@@ -331,7 +418,7 @@ class gaussCGRNN(_CGRNN, object):
     #########################################################################"""
     def cov_function(self, input):
         with self._graph.as_default():
-            return self._sess.run(self.CovV_h, feed_dict={self.x: input})
+            return self._sess.run(self._build('cov')[1], feed_dict={self.x: input})
 
     """#########################################################################
     pre_function: compute the precision matrix Cv_h^{-1}.
@@ -340,4 +427,4 @@ class gaussCGRNN(_CGRNN, object):
     #########################################################################"""
     def pre_function(self, input):
         with self._graph.as_default():
-            return self._sess.run(self.PreV_h, feed_dict={self.x: input})
+            return self._sess.run(self._build('cov')[0], feed_dict={self.x: input})
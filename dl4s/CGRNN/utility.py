@@ -5,7 +5,7 @@ Descriptions: Tools to build an Chain Graph RNN.
               ----2017.12.18
 #########################################################################"""
 import tensorflow as tf
-from dl4s.SeqVAE.utility import buildRec, MLP
+from dl4s.SeqVAE.utility import buildRec, MLP, stepCell
 from dl4s.TRBM.RBM import bin_ssRBM, mu_ssRBM
 from dl4s.TRBM.utility import configssRNNRBM
 
@@ -14,6 +14,7 @@ Class: configCGRNN - Basic setting of the CGRNN models.
 #########################################################################"""
 class configCGRNN(configssRNNRBM):
     mode = 'full'       # <string> indicate the mode of feedback. (D/S/full)
+    hoistMLP = False    # <bool> whether to compute the input MLP outside the recurrence in training.
 
 """#########################################################################
 Class: CGCell - Basic step of the CGRNN models. 
@@ -22,12 +23,14 @@ class CGCell(tf.contrib.rnn.RNNCell):
     """
     __init__: the initialization function.
     input: configSTORN - configuration class in ./utility.
+           gibbs - the steps of Gibbs sampling, could be a scalar tensor
+                   (config.Gibbs in default).
     output: None.
     """
-    def __init__(self, config, inputType='binary'):
+    def __init__(self, config, inputType='binary', gibbs=None):
         self._config = config
         self._mode = config.mode
-        self._gibbs = config.Gibbs
+        self._gibbs = gibbs if gibbs is not None else config.Gibbs
         self._dimRec = config.dimRec
         self._dimInput = config.dimIN
         self._dimState = config.dimState
@@ -85,6 +88,39 @@ class CGCell(tf.contrib.rnn.RNNCell):
     output: 
     """
     def __call__(self, x, state, scope=None, gibbs=None):
+        return self._step(x, state, gibbs)
+
+    """
+    prepare: compute the input MLP for the whole sequence in one batched op,
+             which does not depend on the state in the training mode.
+    input: x - the input with shape (batch, steps, frame).
+    output: the input concatenated with its features (batch, steps, ...).
+    """
+    def prepare(self, x):
+        if self._mode == 'S':
+            return x
+        with tf.variable_scope('CGcell'):
+            return tf.concat([x, self.mlp(x)], axis=-1)
+
+    """
+    step: the recurrent step over the input prepared by prepare (training only).
+    input: x - the prepared input with size (batch, ...).
+           state - the previous state of the cells.
+    output: the same as __call__.
+    """
+    def step(self, x, state):
+        feature = None if self._mode == 'S' else x[:, self._dimInput:]
+        return self._step(x[:, 0:self._dimInput], state, feature=feature)
+
+    """
+    _step: the step of the cell.
+    input: x - the current input with size (batch, frame).
+           state - the previous state of the cells.
+           gibbs - the steps of Gibbs sampling (self._gibbs in default).
+           feature - the features of the input by the MLP (computed if None).
+    output: the same as __call__.
+    """
+    def _step(self, x, state, gibbs=None, feature=None):
         k = gibbs if gibbs is not None else self._gibbs
         with tf.variable_scope('CGcell'):
             hidden = state[0]
@@ -95,13 +131,15 @@ class CGCell(tf.contrib.rnn.RNNCell):
                 # run the RBM to generate necessary variable.
                 newV, newH, newS, muV, muH, muS = self.RBM(xt=x, bvt=bvt, bht=bht, k=k)
                 xx = x if self._train else newV
+                if feature is None and self._mode != 'S':
+                    feature = self.mlp(xx)
                 # Define how to compute the transition.
                 if self._mode == 'D':
-                    hidden, newState = self.rnnCell(self.mlp(xx), rnnstate)
+                    hidden, newState = self.rnnCell(feature, rnnstate)
                 elif self._mode == 'S':
                     hidden, newState = self.rnnCell(newS*newH, rnnstate)
                 else:
-                    hidden, newState = self.rnnCell(tf.concat([self.mlp(xx), newS*newH], axis=1), rnnstate)
+                    hidden, newState = self.rnnCell(tf.concat([feature, newS*newH], axis=1), rnnstate)
                 return (newV, newH, newS, muV, muH, muS, bvt, bht), (hidden,) + newState
 
             elif self._inputType == 'continuous':
@@ -112,13 +150,15 @@ class CGCell(tf.contrib.rnn.RNNCell):
                 # run the RBM to generate necessary variable.
                 newV, newH, newS, muV, muH, muS = self.RBM(xt=x, bvt=bvt, bht=bht, gammat=gammat, k=k)
                 xx = x if self._train else newV
+                if feature is None and self._mode != 'S':
+                    feature = self.mlp(xx)
                 # Define how to compute the transition.
                 if self._mode == 'D':
-                    hidden, newState = self.rnnCell(self.mlp(xx), rnnstate)
+                    hidden, newState = self.rnnCell(feature, rnnstate)
                 elif self._mode == 'S':
                     hidden, newState = self.rnnCell(newS*newH, rnnstate)
                 else:
-                    hidden, newState = self.rnnCell(tf.concat([self.mlp(xx), newS*newH], axis=1), rnnstate)
+                    hidden, newState = self.rnnCell(tf.concat([feature, newS*newH], axis=1), rnnstate)
                 return (newV, newH, newS, muV, muH, muS, bvt, bht, gammat), (hidden,) + newState
             else:
                 raise ValueError("The input type should be either binary or continuous!!")
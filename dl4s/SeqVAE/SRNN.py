@@ -4,7 +4,7 @@ Institute: Stony Brook University
 Descriptions: the file contains the model description of SRNN.
               ----2017.11.15
 #########################################################################"""
-from dl4s.cores.tools import GaussKL, BernoulliNLL, GaussNLL
+from dl4s.cores.tools import GaussKL, BernoulliNLL, GaussNLL, BernoulliLL, GaussLL
 from dl4s.cores.model import _model
 from dl4s.SeqVAE import configSRNN
 from dl4s.SeqVAE.utility import buildSRNN
@@ -41,9 +41,10 @@ class _SRNN(_model, object):
             self._dimRecA = config.dimRecA
             # components of the SRNN.
             self._prior_mu, self._prior_sig, self._pos_mu, self._pos_sig, self._hidden_dec, \
-            [self._forwardCell, self._SSM, self._MLPx], self._Z = buildSRNN(self.x, self._graph, config)
+            [self._forwardCell, self._SSM, self._MLPx], self._Z, self._initState, self._finalState = \
+                buildSRNN(self.x, self._graph, config, self.seqLen)
             # the loss functions.
-            self._loss = GaussKL(self._pos_mu, self._pos_sig ** 2, self._prior_mu, self._prior_sig ** 2)
+            self._loss = GaussKL(self._pos_mu, self._pos_sig ** 2, self._prior_mu, self._prior_sig ** 2, self._mask)
             self._kl_divergence = self._loss
             # the prior P(Z).
             self._prior = [self._prior_mu, self._prior_sig]
@@ -54,6 +55,16 @@ class _SRNN(_model, object):
             # <pass> compute the posterior P(X|Z)
             self._dec = []
 
+    """#########################################################################
+    _logWeight: compute the log importance weight of each step, i.e.
+                log P(X|Z) + log P(Z) - log P(Z|X) with Z ~ P(Z|X).
+    input: logPx - the log-likelihood log P(X|Z) with shape [batch, steps].
+    output: the log weights with shape [batch, steps].
+    #########################################################################"""
+    def _logWeight(self, logPx):
+        return logPx + GaussLL(self._Z, self._prior_mu, self._prior_sig ** 2) - \
+               GaussLL(self._Z, self._pos_mu, self._pos_sig ** 2)
+
     """#########################################################################
     encoder: return the mean and std of P(Z|X).
     input: input - numerical input.
@@ -85,36 +96,41 @@ class binSRNN(_SRNN, object):
                 bdec = tf.get_variable('bdec', shape=config.dimIN, initializer=tf.zeros_initializer)
                 self._dec = tf.nn.sigmoid(tf.tensordot(self._hidden_dec, Wdec, [[-1], [0]]) + bdec)
                 self._outputs = self._dec
-                self._loss += BernoulliNLL(self.x, self._dec)
+                self._loss += BernoulliNLL(self.x, self._dec, self._mask)
                 self._params = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES)
-                self._train_step = self._optimizer.minimize(tf.cast(tf.shape(self.x), tf.float32)[-1] * self._loss)
+                Loss = tf.cast(tf.shape(self.x), tf.float32)[-1] * self._loss
+                self._lazy('train', lambda: self._minimize(Loss))
+                # the importance-weighted bound of the log-likelihood.
+                self._lazy('iwae', lambda: self._iwae(self._logWeight(BernoulliLL(self.x, self._dec)), self._mask))
                 """define the process to generate samples."""
-                # the initial state and initial input of the RNN.
-                state0 = self._forwardCell.zero_state(1, dtype=tf.float32)
-                state1 = self._SSM.zero_state(1, dtype=tf.float32)
-                x_ = tf.zeros((1, self._dimInput), dtype=tf.float32)
-                # TensorArray to save the output of the generating.
-                gen_operator = tf.TensorArray(tf.float32, self.sampleLen)
-                # condition and body of while loop (input: i-iteration, xx-RNN input, ss-RNN state)
-                i = tf.constant(0)
-                cond = lambda i, xx, ss0, ss1, array: tf.less(i, self.sampleLen)
-                #
-                # Set the variational cell to use the prior P(Z) to generate Zt.
-                self._SSM.setGen()
+                def build_gen():
+                    # the initial state and initial input of the RNN.
+                    state0 = self._forwardCell.zero_state(self.sampleNum, dtype=tf.float32)
+                    state1 = self._SSM.zero_state(self.sampleNum, dtype=tf.float32)
+                    x_ = tf.zeros((self.sampleNum, self._dimInput), dtype=tf.float32)
+                    # TensorArray to save the output of the generating.
+                    gen_operator = tf.TensorArray(tf.float32, self.sampleLen)
+                    # condition and body of while loop (input: i-iteration, xx-RNN input, ss-RNN state)
+                    i = tf.constant(0)
+                    cond = lambda i, xx, ss0, ss1, array: tf.less(i, self.sampleLen)
+                    #
+                    # Set the variational cell to use the prior P(Z) to generate Zt.
+                    self._SSM.setGen()
 
-                def body(i, xx, ss0, ss1, array):
-                    ii = i + 1
-                    d_t, new_ss0 = self._forwardCell(self._MLPx(xx), ss0)
-                    a_t = tf.zeros((1, self._dimRecA[-1]), dtype=tf.float32)
-                    input = tf.concat(axis=-1, values=(d_t, a_t))
-                    (_, _, _, _, hidden_dec, _), new_ss1 = self._SSM(input, ss1)
-                    probs = tf.nn.sigmoid(tf.tensordot(hidden_dec, Wdec, [[-1], [0]]) + bdec)
-                    new_xx = tf.distributions.Bernoulli(probs=probs, dtype=tf.float32).sample()
-                    new_array = array.write(i, new_xx)
-                    return ii, new_xx, new_ss0, tf.reshape(new_ss1, shape=(1, self._dimState)), new_array
+                    def body(i, xx, ss0, ss1, array):
+                        ii = i + 1
+                        d_t, new_ss0 = self._forwardCell(self._MLPx(xx), ss0)
+                        a_t = tf.zeros((self.sampleNum, self._dimRecA[-1]), dtype=tf.float32)
+                        input = tf.concat(axis=-1, values=(d_t, a_t))
+                        (_, _, _, _, hidden_dec, _), new_ss1 = self._SSM(input, ss1)
+                        probs = tf.nn.sigmoid(tf.tensordot(hidden_dec, Wdec, [[-1], [0]]) + bdec)
+                        new_xx = tf.distributions.Bernoulli(probs=probs, dtype=tf.float32).sample()
+                        new_array = array.write(i, new_xx)
+                        return ii, new_xx, new_ss0, tf.reshape(new_ss1, shape=(-1, self._dimState)), new_array
 
-                gen_operator = tf.while_loop(cond, body, [i, x_, state0, state1, gen_operator])[-1]
-                self._gen_operator = gen_operator.concat()
+                    gen_operator = tf.while_loop(cond, body, [i, x_, state0, state1, gen_operator])[-1]
+                    return tf.transpose(gen_operator.stack(), [1, 0, 2])
+                self._lazy('gen', build_gen)
                 self._runSession()
 
 """#########################################################################
@@ -143,35 +159,40 @@ class gaussSRNN(_SRNN, object):
                 self._dec = [mu, std]
                 self._outputs = mu
 
-                self._loss += GaussNLL(self.x, mu, std ** 2)
+                self._loss += GaussNLL(self.x, mu, std ** 2, self._mask)
                 self._params = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES)
-                self._train_step = self._optimizer.minimize(tf.cast(tf.shape(self.x), tf.float32)[-1] * self._loss)
+                Loss = tf.cast(tf.shape(self.x), tf.float32)[-1] * self._loss
+                self._lazy('train', lambda: self._minimize(Loss))
+                # the importance-weighted bound of the log-likelihood.
+                self._lazy('iwae', lambda: self._iwae(self._logWeight(GaussLL(self.x, mu, std ** 2)), self._mask))
                 """define the process to generate samples."""
-                # the initial state and initial input of the RNN.
-                state0 = self._forwardCell.zero_state(1, dtype=tf.float32)
-                state1 = self._SSM.zero_state(1, dtype=tf.float32)
-                x_ = tf.zeros((1, self._dimInput), dtype=tf.float32)
-                # TensorArray to save the output of the generating.
-                gen_operator = tf.TensorArray(tf.float32, self.sampleLen)
-                # condition and body of while loop (input: i-iteration, xx-RNN input, ss-RNN state)
-                i = tf.constant(0)
-                cond = lambda i, xx, ss0, ss1, array: tf.less(i, self.sampleLen)
-                #
-                # Set the variational cell to use the prior P(Z) to generate Zt.
-                self._SSM.setGen()
+                def build_gen():
+                    # the initial state and initial input of the RNN.
+                    state0 = self._forwardCell.zero_state(self.sampleNum, dtype=tf.float32)
+                    state1 = self._SSM.zero_state(self.sampleNum, dtype=tf.float32)
+                    x_ = tf.zeros((self.sampleNum, self._dimInput), dtype=tf.float32)
+                    # TensorArray to save the output of the generating.
+                    gen_operator = tf.TensorArray(tf.float32, self.sampleLen)
+                    # condition and body of while loop (input: i-iteration, xx-RNN input, ss-RNN state)
+                    i = tf.constant(0)
+                    cond = lambda i, xx, ss0, ss1, array: tf.less(i, self.sampleLen)
+                    #
+                    # Set the variational cell to use the prior P(Z) to generate Zt.
+                    self._SSM.setGen()
 
-                def body(i, xx, ss0, ss1, array):
-                    ii = i + 1
-                    d_t, new_ss0 = self._forwardCell(self._MLPx(xx), ss0)
-                    a_t = tf.zeros((1, self._dimRecA[-1]), dtype=tf.float32)
-                    input = tf.concat(axis=-1, values=(d_t, a_t))
-                    (_, _, _, _, hidden_dec, _), new_ss1 = self._SSM(input, ss1)
-                    mu = tf.tensordot(hidden_dec, Wdec_mu, [[-1], [0]]) + bdec_mu
-                    std = tf.nn.softplus(tf.tensordot(hidden_dec, Wdec_sig, [[-1], [0]]) + bdec_sig) + 1e-8
-                    new_xx = tf.distributions.Normal(loc=mu, scale=std).sample()
-                    new_array = array.write(i, new_xx)
-                    return ii, new_xx, new_ss0, tf.reshape(new_ss1, shape=(1, self._dimState)), new_array
+                    def body(i, xx, ss0, ss1, array):
+                        ii = i + 1
+                        d_t, new_ss0 = self._forwardCell(self._MLPx(xx), ss0)
+                        a_t = tf.zeros((self.sampleNum, self._dimRecA[-1]), dtype=tf.float32)
+                        input = tf.concat(axis=-1, values=(d_t, a_t))
+                        (_, _, _, _, hidden_dec, _), new_ss1 = self._SSM(input, ss1)
+                        mu = tf.tensordot(hidden_dec, Wdec_mu, [[-1], [0]]) + bdec_mu
+                        std = tf.nn.softplus(tf.tensordot(hidden_dec, Wdec_sig, [[-1], [0]]) + bdec_sig) + 1e-8
+                        new_xx = tf.distributions.Normal(loc=mu, scale=std).sample()
+                        new_array = array.write(i, new_xx)
+                        return ii, new_xx, new_ss0, tf.reshape(new_ss1, shape=(-1, self._dimState)), new_array
 
-                gen_operator = tf.while_loop(cond, body, [i, x_, state0, state1, gen_operator])[-1]
-                self._gen_operator = gen_operator.concat()
+                    gen_operator = tf.while_loop(cond, body, [i, x_, state0, state1, gen_operator])[-1]
+                    return tf.transpose(gen_operator.stack(), [1, 0, 2])
+                self._lazy('gen', build_gen)
                 self._runSession()
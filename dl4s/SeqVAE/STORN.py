@@ -7,7 +7,7 @@ Descriptions: the file contains the model description of STORN.
 
 import tensorflow as tf
 from .utility import buildSTORN
-from dl4s.cores.tools import GaussKL, BernoulliNLL, GaussNLL
+from dl4s.cores.tools import GaussKL, BernoulliNLL, GaussNLL, BernoulliLL, GaussLL
 from dl4s.cores.model import _model
 import numpy as np
 
@@ -45,16 +45,16 @@ class _STORN(_model, object):
             # self._sigZ - the std value of conditional Gaussian P(Z|X)    ###
             # self._hg_t - the hidden output of  value of the generating model, ###
             #              with Zt sampled from P(Z|X)                          ###
+            # self._Z - the sample of Z from P(Z|X)                             ###
             # self._hiddenGen_t - the hidden output of  value of the generating ###
             #               model, with Zt sampled from prior P(Z)= N(0, 1)     ###
             # self._allCell - recurrent cell representing the whole model       ###
             # self._halfCell - recurrent cell representing the generating model.###
-            self._muZ, self._sigZ, self._hg_t, self._Cell = buildSTORN(self.x, self._graph, config)
+            self._muZ, self._sigZ, self._hg_t, self._Z, self._Cell, self._initState, self._finalState = \
+                buildSTORN(self.x, self._graph, config, self.seqLen)
             # <pass> will be define in the children classes.
-            self._loss = GaussKL(self._muZ, self._sigZ**2, 0.0, 1.0)
+            self._loss = GaussKL(self._muZ, self._sigZ**2, 0.0, 1.0, self._mask[:, 0:-1])
             self._kl_divergence = self._loss
-            # <pass> will be define in the children classes.
-            self._train_step = None
             # <pass> the output of the recognition model.
             self._regOut = [self._muZ, self._sigZ]
             # using the E(Z|X) as extracted feature.
@@ -64,6 +64,15 @@ class _STORN(_model, object):
             # <pass> the output of P(X|Z) given Z ~ N(0,1) will be define in the children classes.
             self._halfgenOut = None
 
+    """#########################################################################
+    _logWeight: compute the log importance weight of each step, i.e.
+                log P(X|Z) + log P(Z) - log P(Z|X) with Z ~ P(Z|X).
+    input: logPx - the log-likelihood log P(X|Z) with shape [batch, steps].
+    output: the log weights with shape [batch, steps].
+    #########################################################################"""
+    def _logWeight(self, logPx):
+        return logPx + GaussLL(self._Z, 0.0, 1.0) - GaussLL(self._Z, self._muZ, self._sigZ**2)
+
     """#########################################################################
     encoder: compute the P(Z|X) with given X.
     input: input - numerical input.
@@ -99,32 +108,38 @@ class binSTORN(_STORN, object):
             self._dec = tf.nn.sigmoid(tf.tensordot(self._hg_t, W, [[-1], [0]]) + b)
             self._outputs = self._dec
             #
-            self._loss += BernoulliNLL(self.x[:, 1:, :], self._outputs)
+            self._loss += BernoulliNLL(self.x[:, 1:, :], self._outputs, self._mask[:, 0:-1])
             self._params = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES)
-            self._train_step = self._optimizer.minimize(tf.cast(tf.shape(self.x), tf.float32)[-1] * self._loss)
+            Loss = tf.cast(tf.shape(self.x), tf.float32)[-1] * self._loss
+            self._lazy('train', lambda: self._minimize(Loss))
+            # the importance-weighted bound of the log-likelihood.
+            self._lazy('iwae', lambda: self._iwae(self._logWeight(BernoulliLL(self.x[:, 1:, :], self._dec)),
+                                                  self._mask[:, 0:-1]))
             """define the process to generate samples."""
-            # the initial state and initial input of the RNN.
-            state = self._Cell.zero_state(1, dtype=tf.float32)
-            x_ = tf.zeros((1, self._dimInput), dtype='float32')
-            # TensorArray to save the output of the generating.
-            gen_operator = tf.TensorArray(tf.float32, self.sampleLen)
-            # condition and body of while loop (input: i-iteration, xx-RNN input, ss-RNN state)
-            i = tf.constant(0)
-            cond = lambda i, xx, ss, array: tf.less(i, self.sampleLen)
-            #
-            # Set the variational cell to use the prior P(Z) to generate Zt.
-            self._Cell.setGen()
+            def build_gen():
+                # the initial state and initial input of the RNN.
+                state = self._Cell.zero_state(self.sampleNum, dtype=tf.float32)
+                x_ = tf.zeros((self.sampleNum, self._dimInput), dtype='float32')
+                # TensorArray to save the output of the generating.
+                gen_operator = tf.TensorArray(tf.float32, self.sampleLen)
+                # condition and body of while loop (input: i-iteration, xx-RNN input, ss-RNN state)
+                i = tf.constant(0)
+                cond = lambda i, xx, ss, array: tf.less(i, self.sampleLen)
+                #
+                # Set the variational cell to use the prior P(Z) to generate Zt.
+                self._Cell.setGen()
 
-            def body(i, xx, ss, array):
-                ii = i + 1
-                (_, _, hidde_), new_ss = self._Cell(xx, ss)
-                probs = tf.nn.sigmoid(tf.tensordot(hidde_, W, [[-1], [0]]) + b)
-                new_xx = tf.distributions.Bernoulli(probs=probs, dtype=tf.float32).sample()
-                new_array = array.write(i, new_xx)
-                return ii, new_xx, new_ss, new_array
+                def body(i, xx, ss, array):
+                    ii = i + 1
+                    (_, _, hidde_, _), new_ss = self._Cell(xx, ss)
+                    probs = tf.nn.sigmoid(tf.tensordot(hidde_, W, [[-1], [0]]) + b)
+                    new_xx = tf.distributions.Bernoulli(probs=probs, dtype=tf.float32).sample()
+                    new_array = array.write(i, new_xx)
+                    return ii, new_xx, new_ss, new_array
 
-            gen_operator = tf.while_loop(cond, body, [i, x_, state, gen_operator])[-1]
-            self._gen_operator = gen_operator.concat()
+                gen_operator = tf.while_loop(cond, body, [i, x_, state, gen_operator])[-1]
+                return tf.transpose(gen_operator.stack(), [1, 0, 2])
+            self._lazy('gen', build_gen)
             #
             self._runSession()
 
@@ -157,32 +172,38 @@ class gaussSTORN(_STORN, object):
             self._outputs = mu
             #
             # Compute the gaussian negative ll.
-            self._loss += GaussNLL(self.x[:, 1:, :], mu, std**2)
+            self._loss += GaussNLL(self.x[:, 1:, :], mu, std**2, self._mask[:, 0:-1])
             self._params = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES)
-            self._train_step = self._optimizer.minimize(tf.cast(tf.shape(self.x), tf.float32)[-1] * self._loss)
+            Loss = tf.cast(tf.shape(self.x), tf.float32)[-1] * self._loss
+            self._lazy('train', lambda: self._minimize(Loss))
+            # the importance-weighted bound of the log-likelihood.
+            self._lazy('iwae', lambda: self._iwae(self._logWeight(GaussLL(self.x[:, 1:, :], mu, std**2)),
+                                                  self._mask[:, 0:-1]))
             """define the process to generate samples."""
-            # the initial state and initial input of the RNN.
-            state = self._Cell.zero_state(1, dtype=tf.float32)
-            x_ = tf.zeros((1, self._dimInput), dtype='float32')
-            # TensorArray to save the output of the generating.
-            gen_operator = tf.TensorArray(tf.float32, self.sampleLen)
-            # condition and body of while loop (input: i-iteration, xx-RNN input, ss-RNN state)
-            i = tf.constant(0)
-            cond = lambda i, xx, ss, array: tf.less(i, self.sampleLen)
-            #
-            # Set the variational cell to use the prior P(Z) to generate Zt.
-            self._Cell.setGen()
+            def build_gen():
+                # the initial state and initial input of the RNN.
+                state = self._Cell.zero_state(self.sampleNum, dtype=tf.float32)
+                x_ = tf.zeros((self.sampleNum, self._dimInput), dtype='float32')
+                # TensorArray to save the output of the generating.
+                gen_operator = tf.TensorArray(tf.float32, self.sampleLen)
+                # condition and body of while loop (input: i-iteration, xx-RNN input, ss-RNN state)
+                i = tf.constant(0)
+                cond = lambda i, xx, ss, array: tf.less(i, self.sampleLen)
+                #
+                # Set the variational cell to use the prior P(Z) to generate Zt.
+                self._Cell.setGen()
 
-            def body(i, xx, ss, array):
-                ii = i + 1
-                (_, _, hidde_), new_ss = self._Cell(xx, ss)
-                mu = tf.tensordot(hidde_, Wg_mu, [[-1], [0]]) + bg_mu
-                sig = tf.nn.softplus(tf.tensordot(hidde_, Wg_sig, [[-1], [0]]) + bg_sig) + 1e-8
-                new_xx = tf.distributions.Normal(loc=mu, scale=sig).sample()
-                new_array = array.write(i, new_xx)
-                return ii, new_xx, new_ss, new_array
+                def body(i, xx, ss, array):
+                    ii = i + 1
+                    (_, _, hidde_, _), new_ss = self._Cell(xx, ss)
+                    mu = tf.tensordot(hidde_, Wg_mu, [[-1], [0]]) + bg_mu
+                    sig = tf.nn.softplus(tf.tensordot(hidde_, Wg_sig, [[-1], [0]]) + bg_sig) + 1e-8
+                    new_xx = tf.distributions.Normal(loc=mu, scale=sig).sample()
+                    new_array = array.write(i, new_xx)
+                    return ii, new_xx, new_ss, new_array
 
-            gen_operator = tf.while_loop(cond, body, [i, x_, state, gen_operator])[-1]
-            self._gen_operator = gen_operator.concat()
+                gen_operator = tf.while_loop(cond, body, [i, x_, state, gen_operator])[-1]
+                return tf.transpose(gen_operator.stack(), [1, 0, 2])
+            self._lazy('gen', build_gen)
             #
             self._runSession()
\ No newline at end of file
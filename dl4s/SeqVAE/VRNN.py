@@ -8,7 +8,7 @@ Descriptions: the file contains the model description of VRNN.
 import tensorflow as tf
 from .utility import buildVRNN
 from .utility import configVRNN
-from dl4s.cores.tools import GaussKL, BernoulliNLL, GaussNLL
+from dl4s.cores.tools import GaussKL, BernoulliNLL, GaussNLL, BernoulliLL, GaussLL, feedable_state
 from dl4s.cores.model import _model
 
 """#########################################################################
@@ -39,8 +39,9 @@ class _VRNN(_model, object):
             self._dimInput = config.dimIN
             #
             self._prior_mu, self._prior_sig, self._pos_mu, self._pos_sig,\
-            self._hidden_dec, self._varCell, self._Z = buildVRNN(self.x, self._graph, config)
-            self._loss = GaussKL(self._pos_mu, self._pos_sig ** 2, self._prior_mu, self._prior_sig ** 2)
+            self._hidden_dec, self._varCell, self._Z, self._initState, self._finalState = \
+                buildVRNN(self.x, self._graph, config, self.seqLen)
+            self._loss = GaussKL(self._pos_mu, self._pos_sig ** 2, self._prior_mu, self._prior_sig ** 2, self._mask)
             self._kl_divergence = self._loss
             # the prior P(Z).
             self._prior = [self._prior_mu, self._prior_sig]
@@ -51,6 +52,16 @@ class _VRNN(_model, object):
             # using the E(Z|X) as extracted feature.
             self._feature = self._pos_mu
 
+    """#########################################################################
+    _logWeight: compute the log importance weight of each step, i.e.
+                log P(X|Z) + log P(Z) - log P(Z|X) with Z ~ P(Z|X).
+    input: logPx - the log-likelihood log P(X|Z) with shape [batch, steps].
+    output: the log weights with shape [batch, steps].
+    #########################################################################"""
+    def _logWeight(self, logPx):
+        return logPx + GaussLL(self._Z, self._prior_mu, self._prior_sig ** 2) - \
+               GaussLL(self._Z, self._pos_mu, self._pos_sig ** 2)
+
     """#########################################################################
     encoder: return the mean and std of P(Z|X).
     input: input - numerical input.
@@ -83,31 +94,38 @@ class binVRNN(_VRNN, object):
                 self._dec = tf.nn.sigmoid(tf.tensordot(self._hidden_dec, Wdec, [[-1], [0]]) + bdec)
                 self._outputs = self._dec
                 #
-                self._loss += BernoulliNLL(self.x, self._dec)
+                self._loss += BernoulliNLL(self.x, self._dec, self._mask)
                 self._params = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES)
-                self._train_step = self._optimizer.minimize(tf.cast(tf.shape(self.x), tf.float32)[-1] * self._loss)
+                Loss = tf.cast(tf.shape(self.x), tf.float32)[-1] * self._loss
+                self._lazy('train', lambda: self._minimize(Loss))
+                # the importance-weighted bound of the log-likelihood.
+                self._lazy('iwae', lambda: self._iwae(self._logWeight(BernoulliLL(self.x, self._dec)), self._mask))
                 """define the process to generate samples."""
-                # the initial state and initial input of the RNN.
-                state = self._varCell.zero_state(1, dtype=tf.float32)
-                x_ = tf.zeros((1, self._dimInput), dtype='float32')
-                # TensorArray to save the output of the generating.
-                gen_operator = tf.TensorArray(tf.float32, self.sampleLen)
-                # condition and body of while loop (input: i-iteration, xx-RNN input, ss-RNN state)
-                i = tf.constant(0)
-                cond = lambda i, xx, ss, array: tf.less(i, self.sampleLen)
-                #
-                # Set the variational cell to use the prior P(Z) to generate Zt.
-                self._varCell.setGen()
-                def body(i, xx, ss, array):
-                    ii = i + 1
-                    (_, _, _, _, hidde_, _, _), new_ss = self._varCell(xx, ss)
-                    probs = tf.nn.sigmoid(tf.nn.xw_plus_b(hidde_, Wdec, bdec))
-                    new_xx = tf.distributions.Bernoulli(probs=probs, dtype=tf.float32).sample()
-                    new_array = array.write(i, new_xx)
-                    return ii, new_xx, new_ss, new_array
+                def build_gen():
+                    # the initial state and initial input of the RNN (fed to continue a primed prefix).
+                    state = feedable_state(self._varCell.zero_state(self.sampleNum, dtype=tf.float32))
+                    x_ = tf.placeholder_with_default(tf.zeros((self.sampleNum, self._dimInput), dtype='float32'),
+                                                     shape=[None, self._dimInput])
+                    self._genSeed = (x_, state)
+                    # TensorArray to save the output of the generating.
+                    gen_operator = tf.TensorArray(tf.float32, self.sampleLen)
+                    # condition and body of while loop (input: i-iteration, xx-RNN input, ss-RNN state)
+                    i = tf.constant(0)
+                    cond = lambda i, xx, ss, array: tf.less(i, self.sampleLen)
+                    #
+                    # Set the variational cell to use the prior P(Z) to generate Zt.
+                    self._varCell.setGen()
+                    def body(i, xx, ss, array):
+                        ii = i + 1
+                        (_, _, _, _, hidde_, _, _), new_ss = self._varCell(xx, ss)
+                        probs = tf.nn.sigmoid(tf.nn.xw_plus_b(hidde_, Wdec, bdec))
+                        new_xx = tf.distributions.Bernoulli(probs=probs, dtype=tf.float32).sample()
+                        new_array = array.write(i, new_xx)
+                        return ii, new_xx, new_ss, new_array
 
-                gen_operator = tf.while_loop(cond, body, [i, x_, state, gen_operator])[-1]
-                self._gen_operator = gen_operator.concat()
+                    gen_operator = tf.while_loop(cond, body, [i, x_, state, gen_operator])[-1]
+                    return tf.transpose(gen_operator.stack(), [1, 0, 2])
+                self._lazy('gen', build_gen)
                 self._runSession()
 
 """#########################################################################
@@ -137,31 +155,38 @@ class gaussVRNN(_VRNN, object):
                 self._dec = [mu, std]
                 self._outputs = mu
                 #
-                self._loss += GaussNLL(self.x, mu, std**2)
+                self._loss += GaussNLL(self.x, mu, std**2, self._mask)
                 self._params = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES)
-                self._train_step = self._optimizer.minimize(tf.cast(tf.shape(self.x), tf.float32)[-1] * self._loss)
+                Loss = tf.cast(tf.shape(self.x), tf.float32)[-1] * self._loss
+                self._lazy('train', lambda: self._minimize(Loss))
+                # the importance-weighted bound of the log-likelihood.
+                self._lazy('iwae', lambda: self._iwae(self._logWeight(GaussLL(self.x, mu, std ** 2)), self._mask))
                 """define the process to generate samples."""
-                # the initial state and initial input of the RNN.
-                state = self._varCell.zero_state(1, dtype=tf.float32)
-                x_ = tf.zeros((1, self._dimInput), dtype='float32')
-                # TensorArray to save the output of the generating.
-                gen_operator = tf.TensorArray(tf.float32, self.sampleLen)
-                # condition and body of while loop (input: i-iteration, xx-RNN input, ss-RNN state)
-                i = tf.constant(0)
-                cond = lambda i, xx, ss, array: tf.less(i, self.sampleLen)
-                #
-                # Set the variational cell to use the prior P(Z) to generate Zt.
-                self._varCell.setGen()
+                def build_gen():
+                    # the initial state and initial input of the RNN (fed to continue a primed prefix).
+                    state = feedable_state(self._varCell.zero_state(self.sampleNum, dtype=tf.float32))
+                    x_ = tf.placeholder_with_default(tf.zeros((self.sampleNum, self._dimInput), dtype='float32'),
+                                                     shape=[None, self._dimInput])
+                    self._genSeed = (x_, state)
+                    # TensorArray to save the output of the generating.
+                    gen_operator = tf.TensorArray(tf.float32, self.sampleLen)
+                    # condition and body of while loop (input: i-iteration, xx-RNN input, ss-RNN state)
+                    i = tf.constant(0)
+                    cond = lambda i, xx, ss, array: tf.less(i, self.sampleLen)
+                    #
+                    # Set the variational cell to use the prior P(Z) to generate Zt.
+                    self._varCell.setGen()
 
-                def body(i, xx, ss, array):
-                    ii = i + 1
-                    (_, _, _, _, hidde_, _, _), new_ss = self._varCell(xx, ss)
-                    mu = tf.tensordot(hidde_, Wdec_mu, [[-1], [0]]) + bdec_mu
-                    sig = tf.nn.softplus(tf.tensordot(hidde_, Wdec_mu, [[-1], [0]]) + bdec_mu) + 1e-8
-                    new_xx = tf.distributions.Normal(loc=mu, scale=sig).sample()
-                    new_array = array.write(i, new_xx)
-                    return ii, new_xx, new_ss, new_array
+                    def body(i, xx, ss, array):
+                        ii = i + 1
+                        (_, _, _, _, hidde_, _, _), new_ss = self._varCell(xx, ss)
+                        mu = tf.tensordot(hidde_, Wdec_mu, [[-1], [0]]) + bdec_mu
+                        sig = tf.nn.softplus(tf.tensordot(hidde_, Wdec_mu, [[-1], [0]]) + bdec_mu) + 1e-8
+                        new_xx = tf.distributions.Normal(loc=mu, scale=sig).sample()
+                        new_array = array.write(i, new_xx)
+                        return ii, new_xx, new_ss, new_array
 
-                gen_operator = tf.while_loop(cond, body, [i, x_, state, gen_operator])[-1]
-                self._gen_operator = gen_operator.concat()
+                    gen_operator = tf.while_loop(cond, body, [i, x_, state, gen_operator])[-1]
+                    return tf.transpose(gen_operator.stack(), [1, 0, 2])
+                self._lazy('gen', build_gen)
                 self._runSession()
\ No newline at end of file
@@ -6,12 +6,13 @@ Descriptions: Tools to build an sequential VAE.
 #########################################################################"""
 import tensorflow as tf
 from dl4s.cores.model import _config
+from dl4s.cores.tools import feedable_state
 
 """#########################################################################
 Function: buildRec - build the recurrent hidden layers.
 input: x - a placeholder that indicates the input data.
        dimLayer - dimension of each hidden layer.
-       unitType - the type of recurrent units.
+       unitType - the type of recurrent units (LSTM/GRU/BlockLSTM/BlockGRU/Tanh).
        init_scale - the initialization scaling of the weights.
 output: cells - a tensorflow RNNcell object.
 #########################################################################"""
@@ -29,6 +30,11 @@ def buildRec(
             layers.append(tf.nn.rnn_cell.LSTMCell(num_units=dimLayer[i]))
         elif unitType == 'GRU':
             layers.append(tf.nn.rnn_cell.GRUCell(num_units=dimLayer[i]))
+        # the fused kernels compute all the gates of a step in one op (one matmul).
+        elif unitType == 'BlockLSTM':
+            layers.append(tf.contrib.rnn.LSTMBlockCell(dimLayer[i]))
+        elif unitType == 'BlockGRU':
+            layers.append(tf.contrib.rnn.GRUBlockCell(dimLayer[i]))
         else:
             layers.append(tf.nn.rnn_cell.BasicRNNCell(num_units=dimLayer[i]))
     cells = tf.contrib.rnn.MultiRNNCell(layers, state_is_tuple=True)
@@ -60,9 +66,31 @@ class MLP(object):
         if len(self._dimFor) == 0:
             return x
         # build the network.
-        xx = x
+        return self.forward(self.project(x, 0, self._dimInput, bias=True))
+
+    """
+    project: compute the logit of the first layer contributed by the input
+             entries [begin, end), which allows the parts of a concatenated
+             input to be projected separately.
+    input: x - the part of the input with shape (..., end - begin).
+           begin, end - the entries of the input.
+           bias - whether to add the bias of the first layer.
+    output: the (partial) logit of the first layer.
+    """
+    def project(self, x, begin, end, bias=False):
+        W = self._W[0] if (begin, end) == (0, self._dimInput) else self._W[0][begin:end]
+        logit = tf.tensordot(x, W, [[-1], [0]])
+        return logit + self._b[0] if bias else logit
+
+    """
+    forward: run the network from the logit of the first layer.
+    input: logit - the logit of the first layer.
+    output: the output of the network.
+    """
+    def forward(self, logit):
         for l in range(len(self._dimFor)):
-                logit = tf.tensordot(xx, self._W[l], [[-1], [0]]) + self._b[l]
+                if l > 0:
+                    logit = tf.tensordot(xx, self._W[l], [[-1], [0]]) + self._b[l]
                 if self._unitType == 'relu':
                     xx = tf.nn.relu(logit, name="relu-"+str(l))
                 elif self._unitType == 'tanh':
@@ -73,6 +101,36 @@ class MLP(object):
                     raise ValueError("The unitType should be either relu, tanh or sigmoid!!")
         return xx
 
+"""#########################################################################
+Class: stepCell - the recurrent part of a cell whose time-parallel part is
+                  computed for the whole sequence by cell.prepare. The scan
+                  runs cell.step over the prepared input.
+#########################################################################"""
+class stepCell(tf.contrib.rnn.RNNCell):
+    """
+    __init__: the initialization function.
+    input: cell - the cell with the methods prepare and step.
+           output_size - the output size of cell.step (cell.output_size in default).
+    output: None.
+    """
+    def __init__(self, cell, output_size=None):
+        self._cell = cell
+        self._output_size = output_size if output_size is not None else cell.output_size
+
+    def __call__(self, x, state, scope=None):
+        return self._cell.step(x, state)
+
+    def zero_state(self, batch_size, dtype):
+        return self._cell.zero_state(batch_size, dtype)
+
+    @property
+    def state_size(self):
+        return self._cell.state_size
+
+    @property
+    def output_size(self):
+        return self._output_size
+
 
 
 """###############################################STORN####################################################"""
@@ -94,7 +152,7 @@ class configSTORN(_config, object):
     ----from Stackoverflow(https://stackoverflow.com/questions/9056957/
     correct-way-to-define-class-variables-in-python).
     """
-    unitType = 'LSTM'           # <string> the type of hidden units(LSTM/GRU/Tanh).
+    unitType = 'LSTM'           # <string> the type of hidden units(LSTM/GRU/BlockLSTM/BlockGRU/Tanh).
     dimGen = []                 # <scalar list> the size of hidden layers in generating model.
     dimReg = []                 # <scalar list> the size of hidden layers in recognition model.
     dimState = None                # <scalar> the size of the stochastic layer.
@@ -124,8 +182,8 @@ class stornCell(tf.contrib.rnn.RNNCell):
 
     @property
     def output_size(self):
-        # shape of mu, sig and generating hidden output.
-        return (self._dimState, self._dimState, self._dimGen[-1])
+        # shape of mu, sig, generating hidden output and the sample Z.
+        return (self._dimState, self._dimState, self._dimGen[-1], self._dimState)
 
     """
     setGen: setting the generative models.
@@ -141,8 +199,9 @@ class stornCell(tf.contrib.rnn.RNNCell):
     input: x - the current input with size (batch, frame)
            state - the previous state of the cells.
            scope - indicate the variable scope.
-    output: (muZ, sigZ, hg_t) - the mean and variance of P(Z_t|X_{1:t});
-                                the generating hidden output that will be used by binSTORN/gaussSTORN.
+    output: (muZ, sigZ, hg_t, z) - the mean and variance of P(Z_t|X_{1:t});
+                                   the generating hidden output that will be used by binSTORN/gaussSTORN;
+                                   the sample of Z_t.
             stateReg + stateGen - the new state of the cell.
     """
     def __call__(self, x, state, scope=None):
@@ -164,12 +223,13 @@ class stornCell(tf.contrib.rnn.RNNCell):
                 Z_t = muZ + sigZ * eps
             with tf.variable_scope('generateModel'):
                 if self._train:
-                    # generating hidden output batch, frame)
-                    hg_t, stateGen = self.hiddenGen(tf.concat(axis=1, values=(x, Z_t)), state[len(self._dimReg):])
+                    z = Z_t
                 else:
-                    hg_t, stateGen = self.hiddenGen(tf.concat(axis=1, values=(x, eps)), state[len(self._dimReg):])
+                    z = eps
+                # generating hidden output batch, frame)
+                hg_t, stateGen = self.hiddenGen(tf.concat(axis=1, values=(x, z)), state[len(self._dimReg):])
 
-            return (muZ, sigZ, hg_t), stateReg + stateGen
+            return (muZ, sigZ, hg_t, z), stateReg + stateGen
 
     """
     zero_state: generate the zero initial state of the cells.
@@ -188,21 +248,23 @@ Function: buildTrainModel - build the model structure (Recognition + Genera
 input: x - a placeholder that indicates the input data. [batch, step, frame]
        graph - the default tf.graph that we build the model.
        Config - model configuration.
+       seqLen - the valid length of each sequence.
 output:
 #########################################################################"""
 def buildSTORN(
         x,
         graph,
         Config=configSTORN(),
+        seqLen=None,
 ):
     with graph.as_default():
         # define the variational cell of STORN
         Cell = stornCell(Config)
 
         # run the whole model.
-        state = Cell.zero_state(tf.shape(x)[0], dtype=tf.float32)
-        (muZ, sigZ, hg_t), _ = tf.nn.dynamic_rnn(Cell, x, initial_state=state)
-    return muZ[:, 0:-1, :], sigZ[:, 0:-1, :], hg_t[:, 0:-1, :], Cell
+        state = feedable_state(Cell.zero_state(tf.shape(x)[0], dtype=tf.float32))
+        (muZ, sigZ, hg_t, z), finalState = tf.nn.dynamic_rnn(Cell, x, sequence_length=seqLen, initial_state=state)
+    return muZ[:, 0:-1, :], sigZ[:, 0:-1, :], hg_t[:, 0:-1, :], z[:, 0:-1, :], Cell, state, finalState
 
 """###############################################VRNN#####################################################"""
 #####################################################
@@ -221,7 +283,7 @@ class configVRNN(_config, object):
     Elements inside the __init__ method are elements of the object.
     ----from Stackoverflow(https://stackoverflow.com/questions/9056957/correct-way-to-define-class-variables-in-python).
     """
-    recType = 'LSTM'            # <string> the type of recurrent hidden units(LSTM/GRU/Tanh).
+    recType = 'LSTM'            # <string> the type of recurrent hidden units(LSTM/GRU/BlockLSTM/BlockGRU/Tanh).
     mlpType = 'relu'            # <string> the type of feedforward hidden units(relu/tanh/sigmoid).
     dimRec = []                 # <scalar list> the size of recurrent hidden layers.
     dimForX = []                # <scalar list> the size of feedforward hidden layers of input.
@@ -229,6 +291,7 @@ class configVRNN(_config, object):
     dimForEnc = []              # <scalar list> the size of feedforward hidden layers in the encoder.
     dimForDec = []              # <scalar list> the size of feedforward hidden layers in the decoder.
     dimState = None              # <scalar> the size of the stochastic layer.
+    hoistMLP = False            # <bool> whether to compute the MLP of X outside the recurrence.
 
 """#########################################################################
 Class: varCell - the variational cell of the VRNN models. 
@@ -334,7 +397,28 @@ class varCell(tf.contrib.rnn.RNNCell):
     output: 
     """
     def __call__(self, x, state, scope=None):
-        if self._recType == 'LSTM':
+        with tf.variable_scope('encoder'):
+            xx = self._mlpx(x)
+        return self.step(xx, state)
+
+    """
+    prepare: compute the features of X for the whole sequence in one batched
+             op, as the feedforward network of X does not depend on the state.
+    input: x - the input with shape (batch, steps, frame).
+    output: the features of X with shape (batch, steps, ...).
+    """
+    def prepare(self, x):
+        with tf.variable_scope('encoder'):
+            return self._mlpx(x)
+
+    """
+    step: the recurrent step with the features of X computed in advance.
+    input: xx - the features of the current input with size (batch, ...).
+           state - the previous state of the cells.
+    output: the same as __call__.
+    """
+    def step(self, xx, state):
+        if self._recType == 'LSTM' or self._recType == 'BlockLSTM':
             h_tm1 = state[-1][1]
         else:
             h_tm1 = state[-1]
@@ -345,7 +429,6 @@ class varCell(tf.contrib.rnn.RNNCell):
             prior_sig = tf.nn.softplus(tf.tensordot(h_tm1, self._Wp_sig, [[-1], [0]]) + self._bp_sig) + 1e-8
         # Compute the encoder.
         with tf.variable_scope('encoder'):
-            xx = self._mlpx(x)
             hidden_enc = self._mlpEnc(tf.concat(axis=1, values=(xx, h_tm1)))
             # compute the mean and variance of the posterior P(Z|X).
             pos_mu = tf.tensordot(hidden_enc, self._Wenc_mu, [[-1], [0]]) + self._benc_mu
@@ -353,7 +436,7 @@ class varCell(tf.contrib.rnn.RNNCell):
 
         # sample Z from the posterior.
         eps = tf.distributions.Normal(loc=0.0, scale=1.0
-                                      ).sample(sample_shape=(tf.shape(x)[0], self._dimState))
+                                      ).sample(sample_shape=(tf.shape(xx)[0], self._dimState))
         if self._train:
             z = pos_mu + pos_sig * eps
         else:
@@ -381,25 +464,34 @@ Function: buildVRNN - build the whole graph of VRNN.
 input: x - a placeholder that indicates the input data. [batch, step, frame]
        graph - the default tf.graph that we build the model.
        Config - model configuration.
+       seqLen - the valid length of each sequence.
 output: [prior_mu, prior_sig] -- parameters of prior P(Z)
         [pos_mu, pos_sig] --  parameters of posterior P(Z|X)
         [hidden_dec] -- hidden activation of the decoder part.
         [allCell] -- return the rnn cell.
         [z] -- sampling of Z.
+        [state, finalState] -- the (feedable) initial state and the final state.
 #########################################################################"""
 def buildVRNN(
         x,
         graph,
         Config,
+        seqLen=None,
 ):
     with graph.as_default():
         # define the variational cell of VRNN
         allCell = varCell(Config)
 
         # run the whole model.
-        state = allCell.zero_state(tf.shape(x)[0], dtype=tf.float32)
-        (prior_mu, prior_sig, pos_mu, pos_sig, hidden_dec, h_tm1, z), _ = tf.nn.dynamic_rnn(allCell, x, initial_state=state)
-        return prior_mu, prior_sig, pos_mu, pos_sig, hidden_dec, allCell, z
+        state = feedable_state(allCell.zero_state(tf.shape(x)[0], dtype=tf.float32))
+        if Config.hoistMLP:
+            # the features of X are computed for the whole sequence outside the recurrence.
+            (prior_mu, prior_sig, pos_mu, pos_sig, hidden_dec, h_tm1, z), finalState = \
+                tf.nn.dynamic_rnn(stepCell(allCell), allCell.prepare(x), sequence_length=seqLen, initial_state=state)
+        else:
+            (prior_mu, prior_sig, pos_mu, pos_sig, hidden_dec, h_tm1, z), finalState = \
+                tf.nn.dynamic_rnn(allCell, x, sequence_length=seqLen, initial_state=state)
+        return prior_mu, prior_sig, pos_mu, pos_sig, hidden_dec, allCell, z, state, finalState
 
 
 """###############################################SRNN#####################################################"""
@@ -414,7 +506,7 @@ Class: configSRNN - Basic configuration of the SRNN models.
         https://arxiv.org/abs/1605.07571
 #########################################################################"""
 class configSRNN(_config, object):
-    recType = 'LSTM'            # <string> the type of recurrent hidden units(LSTM/GRU/Tanh).
+    recType = 'LSTM'            # <string> the type of recurrent hidden units(LSTM/GRU/BlockLSTM/BlockGRU/Tanh).
     mlpType = 'relu'            # <string> the type of feedforward hidden units(relu/tanh/sigmoid).
     mode = 'smooth'             # <string> indicate the operating mode of SRNN (smooth/filter).
     Res = False                 # <bool> indicate whether uses residual parametrization.
@@ -523,6 +615,69 @@ class stoCell(tf.contrib.rnn.RNNCell):
 
         return (prior_mu, prior_sig, pos_mu, pos_sig, hidden_dec, z), z
 
+    """
+    prepare: compute the projections that do not depend on Z{t-1} for the
+             whole sequence in batched matmuls, i.e. the d_{t-1} part of the
+             prior and the a_t part of the encoder. Only the Z{t-1} terms are
+             left in the recurrent scan (see step and stepCell).
+    input: d_t - the output of the forward recurrent layers [batch, steps, dimDt].
+           a_t - the output of the backward layers/MLP [batch, steps, dimAt].
+    output: the projections with shape [batch, steps, ...].
+    """
+    def prepare(self, d_t, a_t):
+        S = self._dimState
+        prior_mu = tf.tensordot(d_t, self._Wp_mu[S:], [[-1], [0]]) + self._bp_mu
+        prior_sig = tf.tensordot(d_t, self._Wp_sig[S:], [[-1], [0]]) + self._bp_sig
+        if len(self._dimEnc) != 0:
+            # the logit of the first layer of the encoder.
+            enc = self._encoder.project(a_t, S, S + self._dimAt, bias=True)
+        else:
+            enc = tf.concat(axis=-1, values=(tf.tensordot(a_t, self._Wpos_mu[S:], [[-1], [0]]) + self._bpos_mu,
+                                             tf.tensordot(a_t, self._Wpos_sig[S:], [[-1], [0]]) + self._bpos_sig))
+        return tf.concat(axis=-1, values=(prior_mu, prior_sig, enc))
+
+    """
+    step: the recurrent step over the projections computed by prepare.
+    input: x - the projections of the current step with size (batch, ...).
+           state - the previous state Z{t-1}.
+    output: (prior_mu, prior_sig, pos_mu, pos_sig, z), z
+    """
+    def step(self, x, state):
+        S = self._dimState
+        with tf.variable_scope('prior'):
+            prior_mu = tf.matmul(state, self._Wp_mu[0:S]) + x[:, 0:S]
+            prior_sig = tf.nn.softplus(tf.matmul(state, self._Wp_sig[0:S]) + x[:, S:2*S]) + 1e-8
+        with tf.variable_scope('encoder'):
+            if len(self._dimEnc) != 0:
+                actPos = self._encoder.forward(x[:, 2*S:] + self._encoder.project(state, 0, S))
+                pos_mu = tf.tensordot(actPos, self._Wpos_mu, [[-1], [0]]) + self._bpos_mu
+                pos_sig = tf.tensordot(actPos, self._Wpos_sig, [[-1], [0]]) + self._bpos_sig
+            else:
+                pos_mu = tf.matmul(state, self._Wpos_mu[0:S]) + x[:, 2*S:3*S]
+                pos_sig = tf.matmul(state, self._Wpos_sig[0:S]) + x[:, 3*S:]
+            if self._Res:
+                pos_mu = prior_mu + pos_mu
+            pos_sig = tf.nn.softplus(pos_sig) + 1e-8
+            # sample Z/NewSate from the posterior.
+            eps = tf.distributions.Normal(loc=0.0, scale=1.0
+                                          ).sample(sample_shape=(tf.shape(x)[0], self._dimState))
+            if self._train:
+                z = pos_mu + pos_sig * eps
+            else:
+                z = prior_mu + prior_sig * eps
+        return (prior_mu, prior_sig, pos_mu, pos_sig, z), z
+
+    """
+    decode: compute the decoder over the whole sequence with input = [Z{t}, d{t}],
+            which is outside the recurrence.
+    input: z - the samples of Z [batch, steps, dimState].
+           d_t - the output of the forward recurrent layers [batch, steps, dimDt].
+    output: hidden_dec - the hidden output of the decoder.
+    """
+    def decode(self, z, d_t):
+        with tf.variable_scope('decoder'):
+            return self._decoder(tf.concat(axis=-1, values=(z, d_t)))
+
     """
     zero_state: generate the zero initial state of the cells.
     input: batch_size - the batch size of data chunk.
@@ -552,29 +707,43 @@ Function: buildSRNN - build the whole graph of SRNN.
 input: x - a placeholder that indicates the input data. [batch, step, frame]
        graph - the default tf.graph that we build the model.
        Config - model configuration.
+       seqLen - the valid length of each sequence.
+output: [prior_mu, prior_sig] -- parameters of prior P(Z)
+        [pos_mu, pos_sig] --  parameters of posterior P(Z|X)
+        [hidden_dec] -- hidden activation of the decoder part.
+        [forwardCell, SSM, MLPx] -- the components.
+        [z] -- sampling of Z.
+        [initState, finalState] -- the (feedable) initial state and the final state,
+                                   as (forward state, SSM state, previous frame).
 #########################################################################"""
 def buildSRNN(
         x,
         graph,
         Config,
+        seqLen=None,
 ):
     with graph.as_default():
         # define the variational cell of VRNN
         MLPx = MLP(Config.init_scale, Config.dimIN, Config.dimMLPx, Config.mlpType)
+        if seqLen is None:
+            seqLen = tf.fill([tf.shape(x)[0]], tf.shape(x)[1])
+        # the frame before the sequence (zero by default).
+        x0 = feedable_state(tf.zeros(shape=(tf.shape(x)[0], Config.dimIN)))
         with tf.variable_scope("forwardCell"):
             forwardCell = buildRec(Config.dimRecD, Config.recType, Config.init_scale)  # the hidden layer part of the recognition model.
             # run the forward recurrent layers to compute the deterministic transition.
-            paddings = tf.constant([[0, 0], [1, 0], [0, 0]])
-            xx = tf.pad(x[:, 0:-1, :], paddings)
-            state = forwardCell.zero_state(tf.shape(xx)[0], dtype=tf.float32)
-            d_t, _ = tf.nn.dynamic_rnn(forwardCell, MLPx(xx), initial_state=state)
+            xx = tf.concat(axis=1, values=(tf.expand_dims(x0, 1), x[:, 0:-1, :]))
+            state0 = feedable_state(forwardCell.zero_state(tf.shape(xx)[0], dtype=tf.float32))
+            d_t, finalState0 = tf.nn.dynamic_rnn(forwardCell, MLPx(xx), sequence_length=seqLen, initial_state=state0)
         # run the backward recurrent layers or MLP to compute a_t.
         with tf.variable_scope("backward"):
             if Config.mode == 'smooth':
                 backwardCell = buildRec(Config.dimRecA, Config.recType, Config.init_scale)
                 state = backwardCell.zero_state(tf.shape(x)[0], dtype=tf.float32)
-                a_t, _ = tf.nn.dynamic_rnn(backwardCell, tf.reverse(tf.concat(axis=-1, values=(d_t, x)), [1]), initial_state=state)
-                a_t = tf.reverse(a_t, [1])
+                a_t, _ = tf.nn.dynamic_rnn(backwardCell,
+                                           tf.reverse_sequence(tf.concat(axis=-1, values=(d_t, x)), seqLen, 1, 0),
+                                           sequence_length=seqLen, initial_state=state)
+                a_t = tf.reverse_sequence(a_t, seqLen, 1, 0)
             elif Config.mode == 'filter':
                 backwardCell = MLP(Config.init_scale, Config.dimRecD[-1] + Config.dimIN,
                                    Config.dimRecA, Config.mlpType)
@@ -584,6 +753,14 @@ def buildSRNN(
                 raise ValueError("The operating mode is not correct!!(Should be smooth/filter)")
         # the state space model cell.
         SSM = stoCell(Config)
-        state = SSM.zero_state(tf.shape(x)[0], dtype=tf.float32)
-        (prior_mu, prior_sig, pos_mu, pos_sig, hidden_dec, z), _ = tf.nn.dynamic_rnn(SSM, tf.concat(axis=-1, values=(d_t, a_t)), initial_state=state)
-        return prior_mu, prior_sig, pos_mu, pos_sig, hidden_dec, [forwardCell, SSM, MLPx], z
\ No newline at end of file
+        state1 = feedable_state(SSM.zero_state(tf.shape(x)[0], dtype=tf.float32))
+        # the projections that do not depend on Z{t-1} and the decoder run over the whole
+        # sequence, and only the Z{t-1} terms are left in the scan.
+        (prior_mu, prior_sig, pos_mu, pos_sig, z), finalState1 = \
+            tf.nn.dynamic_rnn(stepCell(SSM, (SSM.state_size,) * 5), SSM.prepare(d_t, a_t),
+                              sequence_length=seqLen, initial_state=state1)
+        hidden_dec = SSM.decode(z, d_t)
+        # the last valid frame will be the previous frame of the next segment.
+        xT = tf.gather_nd(x, tf.stack([tf.range(tf.shape(x)[0]), seqLen - 1], axis=1))
+        return prior_mu, prior_sig, pos_mu, pos_sig, hidden_dec, [forwardCell, SSM, MLPx], z, \
+               (state0, state1, x0), (finalState0, finalState1, xT)
\ No newline at end of file
@@ -10,7 +10,7 @@ Descriptions: the file contains the model description of RBM. For each
 
 import tensorflow as tf
 import numpy as np
-from dl4s.cores.tools import BernoulliNLL
+from dl4s.cores.tools import BernoulliNLL, MaskedMean
 
 """#########################################################################
 Class: _RBM - the basic class of a Restricted Boltzmann Machine.
@@ -67,6 +67,8 @@ class _RBM(object):
         else:
             self._scopeName = scope
 
+        # the RBM is conditional if its biases are provided per frame (e.g. RNN-RBM).
+        self._conditional = (bv is not None and bv.shape.ndims > 1) or (bh is not None and bh.shape.ndims > 1)
         # create the system parameters.
         initializer = tf.random_uniform_initializer(-init_scale, init_scale)
         with tf.variable_scope(self._scopeName, initializer=initializer):
@@ -87,7 +89,7 @@ class _RBM(object):
     #########################################################################"""
     def sampleHgivenV(self, V, beta=1.0):
         # shape of tensordot = [batch, dimH]
-        Ph_v = tf.nn.sigmoid(tf.tensordot(V, beta * self._W, [[-1], [0]]) + self._bh)
+        Ph_v = tf.nn.sigmoid(beta * tf.tensordot(V, self._W, [[-1], [0]]) + self._bh)
         newH = tf.distributions.Bernoulli(probs=Ph_v, dtype=tf.float32).sample()
         return newH, Ph_v
 
@@ -104,23 +106,43 @@ class _RBM(object):
     GibbsSampling: Gibbs sampling.
     input: V - the input vector, could be [batch, dimV].
            beta - a scaling factor for AIS.
-           k - the running times of the Gibbs sampling. 1 in default.
+           k - the running times of the Gibbs sampling. 1 in default. It could
+               also be a scalar tensor to set the steps at run time.
     output: newV - new sample of V.
             newH - new sample of H.
             Ph_v - P(H|V).
             Pv_h - P(V|H).
     #########################################################################"""
     def GibbsSampling(self, V, beta=1.0, k=1):
-        newV = V
-        newH = None
-        Ph_v = None
-        Pv_h = None
-        for i in range(k):
-            newH, Ph_v = self.sampleHgivenV(newV, beta)
+        def sweep(V):
+            newH, Ph_v = self.sampleHgivenV(V, beta)
             newV, Pv_h = self.sampleVgivenH(newH, beta)
             if newV is None:
                 raise ValueError("You have not yet define the sampleVgivenH!!")
-        return newV, newH, Pv_h, Ph_v
+            return newV, newH, Pv_h, Ph_v
+        return self._chain(sweep, V, k)
+
+    """#########################################################################
+    _chain: run k sweeps of a Gibbs chain. The sweeps are unrolled when k is a
+            python integer and run in a tf.while_loop when k is a tensor, so
+            that the graph size does not depend on the number of steps.
+    input: sweep - one Gibbs sweep, mapping V to a tuple starting with new V.
+           V - the input vector, could be [..., dimV].
+           k - the running times of the sweep (at least one sweep is run).
+    output: the outputs of the last sweep.
+    #########################################################################"""
+    def _chain(self, sweep, V, k):
+        if not isinstance(k, (tf.Tensor, tf.Variable)):
+            if k < 1:
+                raise ValueError("k should be greater than zero!!")
+            outputs = sweep(V)
+            for i in range(k - 1):
+                outputs = sweep(outputs[0])
+            return outputs
+        outputs = sweep(V)
+        cond = lambda i, outputs: tf.less(i, k)
+        body = lambda i, outputs: (i + 1, sweep(outputs[0]))
+        return tf.while_loop(cond, body, [tf.constant(1), outputs])[1]
 
     """#########################################################################
     FreeEnergy: the free energy function.
@@ -137,18 +159,127 @@ class _RBM(object):
                 the proposal. We should define the lower bound outer the class.
     input: V - the latent state, could be [batch, dimV].
            samplesteps - the number of sample to be drawn. Default is 1.
+           mask - the mask of valid frames [batch, steps] (None for all valid).
+           persistent - if True, the negative samples are drawn from the
+                        persistent chains (PCD) instead of the data (CD). Only
+                        for the unconditional RBM.
+           tempering - the inverse temperatures of parallel tempering, starting
+                       from 1.0 (None for plain Gibbs sampling).
     output: the average loss per frame in tensor.
     #########################################################################"""
-    def ComputeLoss(self, V, samplesteps=10):
+    def ComputeLoss(self, V, samplesteps=10, mask=None, persistent=False, tempering=None):
         # samples.shape = [batch, dimV].
-        samples, _, _, _ = self.GibbsSampling(V=V, k=samplesteps)
+        if persistent:
+            samples = self.PersistentChain(V=V, k=samplesteps, betas=tempering)
+        elif tempering is not None:
+            samples = self.ParallelTempering(V=V, betas=tempering, k=samplesteps)
+        else:
+            samples, _, _, _ = self.GibbsSampling(V=V, k=samplesteps)
         samples = tf.stop_gradient(samples)
         # negative phase with shape [samples].
-        negPhase = tf.reduce_mean(self.FreeEnergy(samples))
+        negPhase = MaskedMean(self.FreeEnergy(samples), mask)
         # positive phase with shape [batch].
-        posPhase = tf.reduce_mean(self.FreeEnergy(V))
+        posPhase = MaskedMean(self.FreeEnergy(V), mask)
         return posPhase - negPhase
 
+    """#########################################################################
+    PersistentChain: run the persistent Gibbs chains (fantasy particles) for
+                     the persistent contrastive divergence. The particles are
+                     kept in a local variable and advanced by k steps per run.
+                     They are restarted from the data when the shape of the
+                     input changes (e.g. a new batch size or sequence length).
+                     Only the unconditional RBM is supported, since the chains
+                     of a conditional RBM (e.g. RNN-RBM) would be tied to the
+                     biases of one (batch, step) and would not follow the
+                     model distribution across updates.
+    input: V - the input vector, could be [..., dimV].
+           k - the steps of Gibbs sampling per run.
+           betas - if provided, the particles are a ladder of replicas advanced
+                   by parallel tempering with these inverse temperatures.
+    output: samples - the new particles with the same shape as V.
+    #########################################################################"""
+    def PersistentChain(self, V, k=1, betas=None):
+        if self._conditional:
+            raise ValueError("The persistent chains are only supported by the unconditional RBM!!")
+        init = V if betas is None else self._ladder(V, betas)
+        with tf.variable_scope(self._scopeName):
+            particles = tf.Variable(tf.zeros([0] * (init.shape.ndims - 1) + [self._dimV]), trainable=False,
+                                    validate_shape=False, name='particles',
+                                    collections=[tf.GraphKeys.LOCAL_VARIABLES])
+        sameShape = tf.reduce_all(tf.equal(tf.shape(particles), tf.shape(init)))
+        start = tf.cond(sameShape, lambda: tf.identity(particles), lambda: init)
+        start.set_shape(init.shape)
+        if betas is None:
+            particles_ = self.GibbsSampling(V=start, k=k)[0]
+            samples = particles_
+        else:
+            particles_ = self._temper(start, betas, k)
+            samples = particles_[0]
+        with tf.control_dependencies([tf.assign(particles, particles_, validate_shape=False)]):
+            return tf.identity(samples)
+
+    """#########################################################################
+    ParallelTempering: draw samples by parallel tempering. A ladder of replicas
+                       at the given inverse temperatures runs as one batched
+                       tensor. After each Gibbs sweep, the neighbouring replicas
+                       (even and odd pairs in turn) exchange their states by the
+                       Metropolis rule.
+    input: V - the input vector, could be [..., dimV].
+           betas - the list of inverse temperatures, where betas[0] = 1.0 is
+                   the model itself and lower betas mix faster.
+           k - the number of sweeps. It could also be a scalar tensor.
+    output: samples - the samples of the replica at beta = 1.0.
+    #########################################################################"""
+    def ParallelTempering(self, V, betas, k=1):
+        return self._temper(self._ladder(V, betas), betas, k)[0]
+
+    """#########################################################################
+    _ladder: replicate the input for each temperature of parallel tempering.
+    input: V - the input vector, could be [..., dimV].
+           betas - the list of inverse temperatures.
+    output: the replicas with shape [len(betas), ..., dimV].
+    #########################################################################"""
+    def _ladder(self, V, betas):
+        if len(betas) < 2 or betas[0] != 1.0:
+            raise ValueError("The temperatures should have at least two levels and start from 1.0!!")
+        return tf.tile(tf.expand_dims(V, 0), [len(betas)] + [1] * V.shape.ndims)
+
+    """#########################################################################
+    _temper: run k sweeps of parallel tempering over a ladder of replicas.
+    input: ladder - the replicas with shape [len(betas), ..., dimV].
+           betas - the list of inverse temperatures.
+           k - the number of sweeps. It could also be a scalar tensor.
+    output: the new replicas with the same shape as the ladder.
+    #########################################################################"""
+    def _temper(self, ladder, betas, k=1):
+        numR = len(betas)
+        # the swap partner of each replica for the even and the odd pairs.
+        partners = np.tile(np.arange(numR), [2, 1])
+        for parity in range(2):
+            for j in range(parity, numR - 1, 2):
+                partners[parity, j], partners[parity, j + 1] = j + 1, j
+        partners = tf.constant(partners, dtype=tf.int32)
+        # shape = [numR, 1, ..., 1] to broadcast over the replicas.
+        beta = tf.reshape(tf.constant(betas, dtype=tf.float32), [-1] + [1] * (ladder.shape.ndims - 1))
+
+        def cond(i, ladder):
+            return tf.less(i, k)
+
+        def body(i, ladder):
+            newLadder = self.GibbsSampling(V=ladder, beta=beta)[0]
+            partner = tf.gather(partners, tf.mod(i, 2))
+            swapped = tf.gather(newLadder, partner)
+            # log acceptance ratio of exchanging the states of each pair.
+            delta = self.FreeEnergy(newLadder, beta) - self.FreeEnergy(swapped, beta)
+            logA = delta + tf.gather(delta, partner)
+            # the two replicas of a pair share one uniform variable.
+            u = tf.gather(tf.random_uniform(tf.shape(delta)), tf.minimum(tf.range(numR), partner))
+            accept = tf.expand_dims(tf.cast(tf.log(u) < logA, tf.float32), -1)
+            newLadder = accept * swapped + (1 - accept) * newLadder
+            newLadder.set_shape(ladder.shape)
+            return i + 1, newLadder
+        return tf.while_loop(cond, body, [tf.constant(0), ladder])[1]
+
     """#########################################################################
     _ais_term: compute the ais term of the partition function 
                by annealed importance sampling.
@@ -157,39 +288,159 @@ class _RBM(object):
            samplesteps - the number of sample to be drawn. Default is 1.
            Batch - indicate whether the parameter is batch.
            Seq - indicate whether the parameter is batch.
-    output: the log partition function logZB in tensor.
+           scale - the log-weights are averaged as scale * logmeanexp(logWk / scale).
+           chunk - the number of runs annealed at a time. The chunks are merged
+                   by a streaming log-sum-exp so that the peak memory is bounded
+                   by the chunk instead of the runs (None for all at once).
+           schedule - the annealing schedule, 'linear', 'geometric', 'sigmoid' or
+                      'adaptive' (see _ais_schedule and _adaptive_beta).
+           targetESS - the fraction of runs kept effective at each level by the
+                       adaptive schedule.
+    output: the log partition function logZB in tensor. The log of the first two
+            moments of the weights and the effective sample size of the estimate
+            are kept in self.aisMoments and self.aisESS.
     #########################################################################"""
-    def _ais_term(self, run=10, levels=10, Batch=None, Seq=None):
-        if Batch is not None and Seq is None:
-            sample = tf.zeros(shape=[run, Batch, self._dimV])
-        elif Batch is None and Seq is not None:
-            sample = tf.zeros(shape=[run, Seq, self._dimV])
-        elif Batch is not None and Seq is not None:
-            sample = tf.zeros(shape=[run, Batch, Seq, self._dimV])
+    def _ais_term(self, run=10, levels=10, Batch=None, Seq=None, scale=1., chunk=None,
+                  schedule='linear', targetESS=0.9):
+        dims = [dim for dim in (Batch, Seq) if dim is not None]
+        if chunk is None or chunk >= run:
+            logWk = self._ais_logw(run, levels, dims, schedule, targetESS)
+            # the log of the mean of the weights and of the squared weights.
+            log_wk_max = tf.reduce_max(logWk, axis=0)
+            self.aisMoments = (tf.log(tf.reduce_mean(tf.exp(logWk - log_wk_max), axis=0)) + log_wk_max,
+                               tf.log(tf.reduce_mean(tf.exp(2 * (logWk - log_wk_max)), axis=0)) + 2 * log_wk_max)
+            logWk = logWk / scale
+            # compute the average weight. [...]
+            log_wk_mean = tf.reduce_max(logWk, axis=0)
+            r_ais = tf.reduce_mean(tf.exp(logWk - log_wk_mean), axis=0)
+            logZ = scale * (tf.log(r_ais) + log_wk_mean)
         else:
-            sample = tf.zeros(shape=[run, self._dimV])
+            # the cond and body for tf.while_loop over the chunks of runs.
+            def cond(c, logMax, sumExp, rawMax, sumW, sumW2):
+                return c * chunk < run
+            #
+            def body(c, logMax, sumExp, rawMax, sumW, sumW2):
+                logWk = self._ais_logw(tf.minimum(chunk, run - c * chunk), levels, dims, schedule, targetESS)
+                newMax = tf.maximum(logMax, tf.reduce_max(logWk / scale, axis=0))
+                sumExp = sumExp * tf.exp(logMax - newMax) + tf.reduce_sum(tf.exp(logWk / scale - newMax), axis=0)
+                # the moments of the weights in the original scale.
+                newRaw = tf.maximum(rawMax, tf.reduce_max(logWk, axis=0))
+                sumW = sumW * tf.exp(rawMax - newRaw) + tf.reduce_sum(tf.exp(logWk - newRaw), axis=0)
+                sumW2 = sumW2 * tf.exp(2 * (rawMax - newRaw)) + tf.reduce_sum(tf.exp(2 * (logWk - newRaw)), axis=0)
+                return c + 1, newMax, sumExp, newRaw, sumW, sumW2
+
+            zeros = tf.zeros(shape=dims)
+            _, logMax, sumExp, rawMax, sumW, sumW2 = tf.while_loop(
+                cond=cond, body=body, loop_vars=[tf.constant(0), zeros - np.inf, zeros, zeros - np.inf, zeros, zeros])
+            self.aisMoments = (tf.log(sumW / run) + rawMax, tf.log(sumW2 / run) + 2 * rawMax)
+            logZ = scale * (tf.log(sumExp / run) + logMax)
+        # ESS = (sum w)^2 / sum w^2.
+        self.aisESS = run * tf.exp(2 * self.aisMoments[0] - self.aisMoments[1])
+        return logZ
 
-        beta = tf.constant(value=1.0)
+    """#########################################################################
+    _ais_logw: run the annealing of AIS and compute the log-weights.
+    input: run - the number of samples.
+           levels - the number of intermediate proposals.
+           dims - the list of the batch/sequence dimensions of the parameters.
+           schedule - the annealing schedule.
+           targetESS - the target fraction of effective runs (adaptive only).
+    output: the log-weights logWk with shape [run, ...].
+    #########################################################################"""
+    def _ais_logw(self, run, levels, dims, schedule='linear', targetESS=0.9):
+        sample = tf.zeros(shape=[run] + dims + [self._dimV])
         # logwk is the weighted matrix.
         logWk = tf.zeros(shape=tf.shape(sample)[0:-1], dtype=tf.float32)
         sample = self.GibbsSampling(V=sample, beta=0.0)[0]
+        if schedule == 'adaptive':
+            nextBeta = lambda sample, level, beta: self._adaptive_beta(sample, level, beta, levels, targetESS)
+        else:
+            betas = tf.constant(self._ais_schedule(schedule, levels), dtype=tf.float32)
+            nextBeta = lambda sample, level, beta: betas[level]
 
         # the cond and body for tf.while_loop
-        def cond(sample, beta, logWk):
-            return beta <= levels
+        def cond(sample, level, beta, logWk):
+            return tf.less(beta, 1.0)
         #
-        def body(sample, beta, logWk):
-            newsample = self.GibbsSampling(V=sample, beta=beta/levels)[0]
-            logp_k = -self.FreeEnergy(V=newsample, beta=beta/levels)
-            logp_km1 = -self.FreeEnergy(V=newsample, beta=(beta-1)/levels)
+        def body(sample, level, beta, logWk):
+            newBeta = nextBeta(sample, level + 1, beta)
+            newsample = self.GibbsSampling(V=sample, beta=newBeta)[0]
+            logp_k = -self.FreeEnergy(V=newsample, beta=newBeta)
+            logp_km1 = -self.FreeEnergy(V=newsample, beta=beta)
             logWk += logp_k - logp_km1
-            return newsample, beta + 1, logWk
+            return newsample, level + 1, newBeta, logWk
+
+        _, _, _, logWk = tf.while_loop(cond=cond, body=body,
+                                       loop_vars=[sample, tf.constant(0), tf.constant(0.0), logWk])
+        return logWk
+
+    """#########################################################################
+    _ais_schedule: the fixed annealing schedules of AIS.
+    input: schedule - 'linear' (uniform steps), 'geometric' (from 1e-3 to 1 in
+                      log space) or 'sigmoid' (dense at both ends).
+           levels - the number of intermediate proposals.
+    output: the inverse temperatures with shape [levels + 1] from 0 to 1.
+    #########################################################################"""
+    def _ais_schedule(self, schedule, levels):
+        steps = np.arange(levels + 1) / levels
+        if schedule == 'linear':
+            betas = steps
+        elif schedule == 'geometric':
+            betas = np.concatenate([[0.0], np.geomspace(1e-3, 1.0, levels)])
+        elif schedule == 'sigmoid':
+            betas = 1 / (1 + np.exp(-4 * (2 * steps - 1)))
+            betas = (betas - betas[0]) / (betas[-1] - betas[0])
+        else:
+            raise ValueError("The schedule should be either 'linear', 'geometric', 'sigmoid' or 'adaptive'!!")
+        betas[-1] = 1.0
+        return betas
+
+    """#########################################################################
+    _adaptive_beta: choose the next inverse temperature of AIS by bisection, so
+                    that the effective sample size of the incremental weights
+                    stays at the target (the smallest over the batch is used).
+    input: sample - the current samples with shape [run, ..., dimV].
+           level - the index of the next level.
+           beta - the current inverse temperature.
+           levels - the maximal number of levels, where the annealing ends.
+           targetESS - the target fraction of effective runs.
+           iters - the steps of bisection.
+    output: the next inverse temperature.
+    #########################################################################"""
+    def _adaptive_beta(self, sample, level, beta, levels, targetESS=0.9, iters=10):
+        logp = -self.FreeEnergy(V=sample, beta=beta)
+
+        def ess(newBeta):
+            logw = -self.FreeEnergy(V=sample, beta=newBeta) - logp
+            logw = logw - tf.reduce_max(logw, axis=0)
+            ratio = tf.reduce_sum(tf.exp(logw), axis=0) ** 2 / tf.reduce_sum(tf.exp(2 * logw), axis=0)
+            return tf.reduce_min(ratio) / tf.cast(tf.shape(logw)[0], tf.float32)
 
-        _, _, logWk = tf.while_loop(cond=cond, body=body, loop_vars=[sample, beta, logWk])
-        # compute the average weight. [...]
-        log_wk_mean = tf.reduce_max(logWk, axis=0)
-        r_ais = tf.reduce_mean(tf.exp(logWk - log_wk_mean), axis=0)
-        return tf.log(r_ais) + log_wk_mean
+        low, high = beta, tf.constant(1.0)
+        for i in range(iters):
+            mid = (low + high) / 2
+            accept = ess(mid) >= targetESS
+            low, high = tf.where(accept, mid, low), tf.where(accept, high, mid)
+        # move at least by the resolution of the bisection.
+        newBeta = tf.maximum(low, beta + (1.0 - beta) / 2 ** iters)
+        newBeta = tf.where(ess(tf.constant(1.0)) >= targetESS, tf.constant(1.0), newBeta)
+        return tf.where(level >= levels, tf.constant(1.0), newBeta)
+
+    """#########################################################################
+    preserve: wrap the builder of a sub-graph that calls the RBM. Calling the
+              RBM replaces its (time-variant) biases, so they are restored
+              after the sub-graph is built.
+    input: builder - the function without input that builds the sub-graph.
+    output: the wrapped builder.
+    #########################################################################"""
+    def preserve(self, builder):
+        def wrapper():
+            bias = {key: getattr(self, key) for key in ['_bv', '_bh', '_gamma'] if hasattr(self, key)}
+            output = builder()
+            for key, value in bias.items():
+                setattr(self, key, value)
+            return output
+        return wrapper
 
 """#########################################################################
 Class: binRBM - the RBM model for binary observations
@@ -245,7 +496,7 @@ class binRBM(_RBM, object):
     #########################################################################"""
     def sampleVgivenH(self, H, beta=1.0):
         # shape of tensordot = [batch, dimH]
-        Pv_h = tf.nn.sigmoid(tf.tensordot(H, beta * tf.transpose(self._W), [[-1], [0]]) + self._bv)
+        Pv_h = tf.nn.sigmoid(beta * tf.tensordot(H, tf.transpose(self._W), [[-1], [0]]) + self._bv)
         newV = tf.distributions.Bernoulli(probs=Pv_h, dtype=tf.float32).sample()
         return newV, Pv_h
 
@@ -257,7 +508,7 @@ class binRBM(_RBM, object):
     #########################################################################"""
     def FreeEnergy(self, V, beta=1.0):
         term1 = V * self._bv
-        term2 = tf.nn.softplus(tf.tensordot(V, beta * self._W, [[-1], [0]]) + self._bh)
+        term2 = tf.nn.softplus(beta * tf.tensordot(V, self._W, [[-1], [0]]) + self._bh)
         return -tf.reduce_sum(term1, axis=-1) - tf.reduce_sum(term2, axis=-1)
 
     """#########################################################################
@@ -267,13 +518,55 @@ class binRBM(_RBM, object):
            samplesteps - the number of sample to be drawn. Default is 1.
            Batch - indicate whether the parameter is batch.
            Seq - indicate whether the parameter is batch.
+           chunk - the number of runs annealed at a time (None for all at once).
+           schedule - the annealing schedule (see _ais_term).
+           targetESS - the target fraction of effective runs (adaptive only).
     output: the log partition function logZB in tensor.
     #########################################################################"""
-    def AIS(self, run=10, levels=10, Batch=None, Seq=None):
+    def AIS(self, run=10, levels=10, Batch=None, Seq=None, chunk=None, schedule='linear', targetESS=0.9):
         # proposal partition function with shape []/[...].
         logZA = tf.reduce_sum(tf.nn.softplus(self._bv), axis=-1) + \
                 tf.reduce_sum(tf.nn.softplus(self._bh), axis=-1)
-        return logZA + self._ais_term(run, levels, Batch, Seq)
+        return logZA + self._ais_term(run, levels, Batch, Seq, chunk=chunk, schedule=schedule, targetESS=targetESS)
+
+    """#########################################################################
+    ExactLogZ: compute the exact partition function by enumerating all the
+               hidden configurations, which is tractable for small dimH. The
+               configurations are enumerated in chunks to bound the memory and
+               merged by a streaming log-sum-exp.
+    input: chunk - the number of hidden configurations evaluated at a time.
+    output: the log partition function logZ in tensor with the batch/sequence
+            shape of the biases.
+    #########################################################################"""
+    def ExactLogZ(self, chunk=1024):
+        if self._dimH > 25:
+            raise ValueError("The exact partition function is only tractable for dimH <= 25!!")
+        total = 2 ** self._dimH
+        chunk = min(chunk, total)
+        numChunk = -(-total // chunk)
+        powers = tf.constant([2 ** j for j in range(self._dimH)], dtype=tf.int64)
+        #
+        def logTerms(c):
+            # the hidden configurations with shape [chunk, dimH].
+            index = tf.range(c * chunk, tf.minimum((c + 1) * chunk, total), dtype=tf.int64)
+            H = tf.cast(tf.floormod(tf.floordiv(tf.expand_dims(index, -1), powers), 2), tf.float32)
+            # the visible units are summed out analytically, shape = [..., chunk].
+            bvt = tf.expand_dims(self._bv, -2) + tf.tensordot(H, tf.transpose(self._W), [[-1], [0]])
+            return tf.tensordot(self._bh, H, [[-1], [-1]]) + tf.reduce_sum(tf.nn.softplus(bvt), axis=-1)
+        #
+        def body(c, logMax, sumExp):
+            terms = logTerms(c)
+            newMax = tf.maximum(logMax, tf.reduce_max(terms, axis=-1))
+            sumExp = sumExp * tf.exp(logMax - newMax) + \
+                     tf.reduce_sum(tf.exp(terms - tf.expand_dims(newMax, -1)), axis=-1)
+            return c + 1, newMax, sumExp
+
+        terms = logTerms(tf.constant(0, dtype=tf.int64))
+        logMax = tf.reduce_max(terms, axis=-1)
+        sumExp = tf.reduce_sum(tf.exp(terms - tf.expand_dims(logMax, -1)), axis=-1)
+        _, logMax, sumExp = tf.while_loop(cond=lambda c, logMax, sumExp: c < numChunk, body=body,
+                                          loop_vars=[tf.constant(1, dtype=tf.int64), logMax, sumExp])
+        return tf.log(sumExp) + logMax
 
     """
     __call__:
@@ -349,7 +642,7 @@ class gaussRBM(_RBM, object):
     #########################################################################"""
     def sampleHgivenV(self, V, beta=1.0):
         # shape of tensordot = [batch, dimH]
-        Ph_v = tf.nn.sigmoid(tf.tensordot(V/(tf.nn.softplus(self._std)**2 + 1e-8), beta * self._W, [[-1], [0]]) + self._bh)
+        Ph_v = tf.nn.sigmoid(beta * tf.tensordot(V/(tf.nn.softplus(self._std)**2 + 1e-8), self._W, [[-1], [0]]) + self._bh)
         newH = tf.distributions.Bernoulli(probs=Ph_v, dtype=tf.float32).sample()
         return newH, Ph_v
 
@@ -362,7 +655,7 @@ class gaussRBM(_RBM, object):
     #########################################################################"""
     def sampleVgivenH(self, H, beta=1.0):
         # shape of tensordot = [batch, dimH]
-        muV = tf.tensordot(H, beta * tf.transpose(self._W), [[-1], [0]]) + self._bv
+        muV = beta * tf.tensordot(H, tf.transpose(self._W), [[-1], [0]]) + self._bv
         return muV, muV
 
     """#########################################################################
@@ -374,7 +667,7 @@ class gaussRBM(_RBM, object):
     def FreeEnergy(self, V, beta=1.0):
         #
         term1 = (V - self._bv)**2 / (2 * tf.nn.softplus(self._std)**2 + 1e-8)
-        term2 = tf.nn.softplus(tf.tensordot(V/(tf.nn.softplus(self._std)**2 + 1e-8), beta * self._W, [[-1], [0]]) + self._bh)
+        term2 = tf.nn.softplus(beta * tf.tensordot(V/(tf.nn.softplus(self._std)**2 + 1e-8), self._W, [[-1], [0]]) + self._bh)
         return tf.reduce_sum(term1, axis=-1) - tf.reduce_sum(term2, axis=-1)
 
     """#########################################################################
@@ -384,14 +677,17 @@ class gaussRBM(_RBM, object):
            samplesteps - the number of sample to be drawn. Default is 1.
            Batch - indicate whether the parameter is batch.
            Seq - indicate whether the parameter is batch.
+           chunk - the number of runs annealed at a time (None for all at once).
+           schedule - the annealing schedule (see _ais_term).
+           targetESS - the target fraction of effective runs (adaptive only).
     output: the log partition function logZB in tensor.
     #########################################################################"""
-    def AIS(self, run=10, levels=10, Batch=None, Seq=None):
+    def AIS(self, run=10, levels=10, Batch=None, Seq=None, chunk=None, schedule='linear', targetESS=0.9):
         # proposal partition function with shape []/[...].
         logZA_term1 = 0.5 * tf.log(2*np.pi) + tf.log(tf.nn.softplus(self._std))
         logZA = tf.reduce_sum(logZA_term1, axis=-1) + \
                 tf.reduce_sum(tf.nn.softplus(self._bh), axis=-1)
-        return logZA + self._ais_term(run, levels, Batch, Seq)
+        return logZA + self._ais_term(run, levels, Batch, Seq, chunk=chunk, schedule=schedule, targetESS=targetESS)
 
     """
     __call__:
@@ -514,16 +810,6 @@ class mu_ssRBM(_RBM, object):
             self.newV, self.newH, self.newS, self.muV, self.muH, self.muS = self.GibbsSampling(self._V, k=k)
             # one step sample.
             self.newV0, self.newH0, self.newS0, self.muV0, self.muH0, self.muS0 = self.GibbsSampling(self._V, k=1)
-            """Define the expression of conditional convariance and precision."""
-            newH = tf.expand_dims(self.newH, axis=2)
-            W = tf.expand_dims(tf.expand_dims(self._W, axis=0), axis=0)
-            term1 = newH * W / (self._alpha + 1e-8)
-            term1 = tf.tensordot(term1, self._W, [[-1], [-1]])
-            # define the covariance and precision.
-            Cv_sh = 1 / (self._gamma + tf.tensordot(newH, self._phi, [[-1], [0]]) + 1e-8)
-            term2 = Cv_sh * tf.eye(self._dimV, batch_shape=[1, 1])
-            self.PreV_h = term2 + term1
-            self.CovV_h = tf.matrix_inverse(self.PreV_h)
             # define the monitor.
             monitor = tf.reduce_sum((self._V - self.muV) ** 2, axis=-1)
             self._monitor = tf.sqrt(tf.reduce_mean(monitor))
@@ -538,9 +824,9 @@ class mu_ssRBM(_RBM, object):
             meanH_v - the Bernoulli distribution P(H|V), which is also mean(H|V).
     #########################################################################"""
     def sampleHgivenV(self, V, beta=1.0):
-        factorV = tf.tensordot(V, beta * self._W, [[-1], [0]])  # shape = [..., dimH]
+        factorV = beta * tf.tensordot(V, self._W, [[-1], [0]])  # shape = [..., dimH]
         sqr_term = (0.5 * factorV ** 2) / (self._alpha + 1e-8) \
-                   - 0.5 * tf.tensordot(V**2, beta * tf.transpose(self._phi), [[-1], [0]])
+                   - 0.5 * beta * tf.tensordot(V**2, tf.transpose(self._phi), [[-1], [0]])
         lin_term = factorV * self._mu
         if beta == 0.0:
             meanH_v = tf.nn.sigmoid(self._bh, name='meanH_v')
@@ -559,7 +845,7 @@ class mu_ssRBM(_RBM, object):
     #########################################################################"""
     def sampleSgivenVH(self, V, H, beta=1.0):
         #
-        factorV = tf.tensordot(V, beta * self._W, [[-1], [0]]) / (self._alpha + 1e-8)\
+        factorV = beta * tf.tensordot(V, self._W, [[-1], [0]]) / (self._alpha + 1e-8)\
                   + self._mu  # shape = [..., dimH]
         meanS_vh1 = factorV
         eps = tf.truncated_normal(shape=(tf.shape(meanS_vh1)))
@@ -578,7 +864,7 @@ class mu_ssRBM(_RBM, object):
         # shape = [..., dimV]
         Cv_sh = 1 / (self._gamma + beta * tf.tensordot(H, self._phi, [[-1], [0]]) + 1e-8)
         # shape = [..., dimV]
-        meanV_sh = Cv_sh * (tf.tensordot(S*H, beta * tf.transpose(self._W), [[-1], [0]])
+        meanV_sh = Cv_sh * (beta * tf.tensordot(S*H, tf.transpose(self._W), [[-1], [0]])
                             + self._bv)
         eps = tf.truncated_normal(shape=(tf.shape(meanV_sh)))
         newV_sh = meanV_sh + tf.sqrt(Cv_sh) * eps
@@ -589,23 +875,17 @@ class mu_ssRBM(_RBM, object):
     GibbsSampling: Gibbs sampling.
     input: V - the input vector, could be [batch, dimV].
            beta - a scaling factor for AIS.
-           k - the running times of the Gibbs sampling. 1 in default.
+           k - the running times of the Gibbs sampling. 1 in default. It could
+               also be a scalar tensor to set the steps at run time.
     output: 
     #########################################################################"""
     def GibbsSampling(self, V, beta=1.0, k=1):
-        newV = V
-        newH = None
-        newS = None
-        meanH_v = None
-        meanS_vh = None
-        meanV_sh = None
-        if k < 1:
-            raise ValueError("k should be greater than zero!!")
-        for i in range(k):
-            newH, meanH_v = self.sampleHgivenV(newV, beta)
-            newS, meanS_vh = self.sampleSgivenVH(newV, newH, beta)
+        def sweep(V):
+            newH, meanH_v = self.sampleHgivenV(V, beta)
+            newS, meanS_vh = self.sampleSgivenVH(V, newH, beta)
             newV, meanV_sh = self.sampleVgivenSH(newS, newH, beta)
-        return newV, newH, newS, meanV_sh, meanH_v, meanS_vh
+            return newV, newH, newS, meanV_sh, meanH_v, meanS_vh
+        return self._chain(sweep, V, k)
 
     """#########################################################################
     FreeEnergy: the free energy function.
@@ -618,9 +898,9 @@ class mu_ssRBM(_RBM, object):
         lin_term = tf.reduce_sum(V * self._bv, axis=[-1])
         con_term = 0.5 * tf.reduce_sum(tf.log(2*np.pi) - tf.log(self._alpha + 1e-8))
         #
-        factorV = tf.tensordot(V, beta * self._W, [[-1], [0]])  # shape = [..., dimH]
+        factorV = beta * tf.tensordot(V, self._W, [[-1], [0]])  # shape = [..., dimH]
         sqr_term_h = (0.5 * factorV ** 2) / (self._alpha + 1e-8) \
-                   - 0.5 * tf.tensordot(V ** 2, beta * tf.transpose(self._phi), [[-1], [0]])
+                   - 0.5 * beta * tf.tensordot(V ** 2, tf.transpose(self._phi), [[-1], [0]])
         lin_term_h = factorV * self._mu
         splus_term = tf.reduce_sum(tf.nn.softplus(sqr_term_h + lin_term_h + self._bh),
                                        axis=[-1])
@@ -632,16 +912,27 @@ class mu_ssRBM(_RBM, object):
                 the proposal. We should define the lower bound outer the class.
     input: V - the latent state, could be [..., dimV].
            samplesteps - the number of sample to be drawn. Default is 1.
+           mask - the mask of valid frames [batch, steps] (None for all valid).
+           persistent - if True, the negative samples are drawn from the
+                        persistent chains (PCD) instead of the data (CD). Only
+                        for the unconditional RBM.
+           tempering - the inverse temperatures of parallel tempering, starting
+                       from 1.0 (None for plain Gibbs sampling).
     output: the average loss per frame in tensor.
     #########################################################################"""
-    def ComputeLoss(self, V, samplesteps=10):
+    def ComputeLoss(self, V, samplesteps=10, mask=None, persistent=False, tempering=None):
         # samples.shape = [..., dimV].
-        samples, _, _, _, _, _ = self.GibbsSampling(V=V, k=samplesteps)
+        if persistent:
+            samples = self.PersistentChain(V=V, k=samplesteps, betas=tempering)
+        elif tempering is not None:
+            samples = self.ParallelTempering(V=V, betas=tempering, k=samplesteps)
+        else:
+            samples, _, _, _, _, _ = self.GibbsSampling(V=V, k=samplesteps)
         samples = tf.stop_gradient(samples)
         # negative phase with shape [samples].
-        negPhase = tf.reduce_mean(self.FreeEnergy(samples))
+        negPhase = MaskedMean(self.FreeEnergy(samples), mask)
         # positive phase with shape [batch].
-        posPhase = tf.reduce_mean(self.FreeEnergy(V))
+        posPhase = MaskedMean(self.FreeEnergy(V), mask)
         return posPhase - negPhase
 
     """#########################################################################
@@ -651,48 +942,21 @@ class mu_ssRBM(_RBM, object):
            samplesteps - the number of sample to be drawn. Default is 1.
            Batch - indicate whether the parameter is batch.
            Seq - indicate whether the parameter is batch.
+           chunk - the number of runs annealed at a time (None for all at once).
+           schedule - the annealing schedule (see _ais_term).
+           targetESS - the target fraction of effective runs (adaptive only).
     output: the log partition function logZB in tensor.
     #########################################################################"""
-    def AIS(self, run=10, levels=10, Batch=None, Seq=None):
+    def AIS(self, run=10, levels=10, Batch=None, Seq=None, chunk=None, schedule='linear', targetESS=0.9):
         # proposal partition function with shape []/[...].
         logZA_term1 = 0.5 * tf.reduce_sum(self._bv**2 / (self._gamma+1e-8), axis=[-1])
         logZA_term2 = 0.5 * tf.reduce_sum(tf.log(2*np.pi/(self._gamma+1e-8)), axis=[-1])
         logZA_term3 = 0.5 * tf.reduce_sum(tf.log(2*np.pi) - tf.log(self._alpha + 1e-38))
         logZA_term4 = tf.reduce_sum(tf.nn.softplus(self._bh), axis=-1)
         logZA = logZA_term1 + logZA_term2 + logZA_term3 + logZA_term4
-
-        if Batch is not None and Seq is None:
-            sample = tf.zeros(shape=[run, Batch, self._dimV])
-        elif Batch is None and Seq is not None:
-            sample = tf.zeros(shape=[run, Seq, self._dimV])
-        elif Batch is not None and Seq is not None:
-            sample = tf.zeros(shape=[run, Batch, Seq, self._dimV])
-        else:
-            sample = tf.zeros(shape=[run, self._dimV])
-
-        beta = tf.constant(value=1.0)
-        # logwk is the weighted matrix.
-        logWk = tf.zeros(shape=tf.shape(sample)[0:-1], dtype=tf.float32)
-        sample = self.GibbsSampling(V=sample, beta=0.0)[0]
-        # the cond and body for tf.while_loop
-        def cond(sample, beta, logWk):
-            return beta <= levels
-        #
-        def body(sample, beta, logWk):
-            newsample = self.GibbsSampling(V=sample, beta=beta/levels)[0]
-            logp_k = -self.FreeEnergy(V=newsample, beta=beta/levels)
-            logp_km1 = -self.FreeEnergy(V=newsample, beta=(beta-1)/levels)
-            logWk += logp_k - logp_km1
-            return newsample, beta + 1, logWk
-
-        _, beta, logWk = tf.while_loop(cond=cond, body=body, loop_vars=[sample, beta, logWk])
-
-        # compute the average weight. [...]
-        # logWk = tf.minimum(logWk, 2000)
-        logWk = logWk / 1000
-        log_wk_mean = tf.reduce_mean(logWk, axis=0)
-        r_ais = tf.reduce_mean(tf.exp(logWk - log_wk_mean), axis=0)
-        return logZA + 1000 * (tf.log(r_ais) + log_wk_mean)
+        # the log-weights of ss-RBMs are large, so they are averaged in the scale of 1000.
+        return logZA + self._ais_term(run, levels, Batch, Seq, scale=1000., chunk=chunk,
+                                      schedule=schedule, targetESS=targetESS)
 
     """#########################################################################
     add_constraint: compute the partition function by annealed importance sampling.
@@ -704,6 +968,25 @@ class mu_ssRBM(_RBM, object):
         #mask = tf.minimum(1.0, Wnorm)
         return tf.assign(self._W, self._W / Wnorm)
 
+    """#########################################################################
+    Precision: define the expression of conditional precision and covariance
+               matrix of V given the sampled H.
+    input: None.
+    output: PreV_h - the precision matrix.
+            CovV_h - the covariance matrix.
+    #########################################################################"""
+    def Precision(self):
+        newH = tf.expand_dims(self.newH, axis=2)
+        W = tf.expand_dims(tf.expand_dims(self._W, axis=0), axis=0)
+        term1 = newH * W / (self._alpha + 1e-8)
+        term1 = tf.tensordot(term1, self._W, [[-1], [-1]])
+        # define the covariance and precision.
+        Cv_sh = 1 / (self._gamma + tf.tensordot(newH, self._phi, [[-1], [0]]) + 1e-8)
+        term2 = Cv_sh * tf.eye(self._dimV, batch_shape=[1, 1])
+        PreV_h = term2 + term1
+        CovV_h = tf.matrix_inverse(PreV_h)
+        return PreV_h, CovV_h
+
     """
     __call__:
     input: xt - the current input with size (batch, frame).
@@ -814,7 +1097,7 @@ class bin_ssRBM(_RBM, object):
     #########################################################################"""
     def sampleSgivenVH(self, V, H, beta=1.0):
         #
-        factorV = tf.tensordot(V, beta * self._W, [[-1], [0]]) / (self._alpha + 1e-8) + self._mu  # shape = [..., dimH]
+        factorV = beta * tf.tensordot(V, self._W, [[-1], [0]]) / (self._alpha + 1e-8) + self._mu  # shape = [..., dimH]
         meanS_vh1 = factorV
         eps = tf.truncated_normal(shape=(tf.shape(meanS_vh1)))
         newS = meanS_vh1 * H + tf.sqrt(self._alpha) * eps
@@ -828,7 +1111,7 @@ class bin_ssRBM(_RBM, object):
             meanH_v - the Bernoulli distribution P(H|V), which is also mean(H|V).
     #########################################################################"""
     def sampleHgivenV(self, V, beta=1.0):
-        factorV = tf.tensordot(V, beta * self._W, [[-1], [0]])  # shape = [..., dimH]
+        factorV = beta * tf.tensordot(V, self._W, [[-1], [0]])  # shape = [..., dimH]
         sqr_term = (0.5 * factorV ** 2) / (self._alpha + 1e-8)
         lin_term = factorV * self._mu
         meanH_v = tf.nn.sigmoid(sqr_term + lin_term + self._bh, name='meanH_v')
@@ -844,7 +1127,7 @@ class bin_ssRBM(_RBM, object):
             meanV_sh - the meanV given S, H.
     #########################################################################"""
     def sampleVgivenSH(self, S, H, beta=1.0):
-        probit =tf.tensordot(S * H, beta * tf.transpose(self._W), [[-1], [0]]) + self._bv
+        probit =beta * tf.tensordot(S * H, tf.transpose(self._W), [[-1], [0]]) + self._bv
         meanV_sh = tf.nn.sigmoid(probit, name='meanH_v')
         newV_sh = tf.distributions.Bernoulli(probs=meanV_sh, dtype=tf.float32).sample()
         # return newV_sh, meanV_sh
@@ -854,23 +1137,17 @@ class bin_ssRBM(_RBM, object):
     GibbsSampling: Gibbs sampling.
     input: V - the input vector, could be [batch, dimV].
            beta - a scaling factor for AIS.
-           k - the running times of the Gibbs sampling. 1 in default.
+           k - the running times of the Gibbs sampling. 1 in default. It could
+               also be a scalar tensor to set the steps at run time.
     output: 
     #########################################################################"""
     def GibbsSampling(self, V, beta=1.0, k=1):
-        newV = V
-        newH = None
-        newS = None
-        meanH_v = None
-        meanS_vh = None
-        meanV_sh = None
-        if k < 1:
-            raise ValueError("k should be greater than zero!!")
-        for i in range(k):
-            newH, meanH_v = self.sampleHgivenV(newV, beta)
-            newS, meanS_vh = self.sampleSgivenVH(newV, newH, beta)
+        def sweep(V):
+            newH, meanH_v = self.sampleHgivenV(V, beta)
+            newS, meanS_vh = self.sampleSgivenVH(V, newH, beta)
             newV, meanV_sh = self.sampleVgivenSH(newS, newH, beta)
-        return newV, newH, newS, meanV_sh, meanH_v, meanS_vh
+            return newV, newH, newS, meanV_sh, meanH_v, meanS_vh
+        return self._chain(sweep, V, k)
 
     """#########################################################################
     FreeEnergy: the free energy function.
@@ -883,7 +1160,7 @@ class bin_ssRBM(_RBM, object):
         lin_term = tf.reduce_sum(V * self._bv, axis=[-1])
         con_term = 0.5 * tf.reduce_sum(tf.log(2 * np.pi) - tf.log(self._alpha + 1e-8))
         #
-        factorV = tf.tensordot(V, beta * self._W, [[-1], [0]])  # shape = [..., dimH]
+        factorV = beta * tf.tensordot(V, self._W, [[-1], [0]])  # shape = [..., dimH]
         sqr_term_h = (0.5 * factorV ** 2) / (self._alpha + 1e-8)
         lin_term_h = factorV * self._mu
         splus_term = tf.reduce_sum(tf.nn.softplus(sqr_term_h + lin_term_h + self._bh),
@@ -896,16 +1173,27 @@ class bin_ssRBM(_RBM, object):
                 the proposal. We should define the lower bound outer the class.
     input: V - the latent state, could be [..., dimV].
            samplesteps - the number of sample to be drawn. Default is 1.
+           mask - the mask of valid frames [batch, steps] (None for all valid).
+           persistent - if True, the negative samples are drawn from the
+                        persistent chains (PCD) instead of the data (CD). Only
+                        for the unconditional RBM.
+           tempering - the inverse temperatures of parallel tempering, starting
+                       from 1.0 (None for plain Gibbs sampling).
     output: the average loss per frame in tensor.
     #########################################################################"""
-    def ComputeLoss(self, V, samplesteps=10):
+    def ComputeLoss(self, V, samplesteps=10, mask=None, persistent=False, tempering=None):
         # samples.shape = [..., dimV].
-        samples, _, _, _, _, _ = self.GibbsSampling(V=V, k=samplesteps)
+        if persistent:
+            samples = self.PersistentChain(V=V, k=samplesteps, betas=tempering)
+        elif tempering is not None:
+            samples = self.ParallelTempering(V=V, betas=tempering, k=samplesteps)
+        else:
+            samples, _, _, _, _, _ = self.GibbsSampling(V=V, k=samplesteps)
         samples = tf.stop_gradient(samples)
         # negative phase with shape [samples].
-        negPhase = tf.reduce_mean(self.FreeEnergy(samples))
+        negPhase = MaskedMean(self.FreeEnergy(samples), mask)
         # positive phase with shape [batch].
-        posPhase = tf.reduce_mean(self.FreeEnergy(V))
+        posPhase = MaskedMean(self.FreeEnergy(V), mask)
         return posPhase - negPhase
 
     """#########################################################################
@@ -915,48 +1203,20 @@ class bin_ssRBM(_RBM, object):
            samplesteps - the number of sample to be drawn. Default is 1.
            Batch - indicate whether the parameter is batch.
            Seq - indicate whether the parameter is batch.
+           chunk - the number of runs annealed at a time (None for all at once).
+           schedule - the annealing schedule (see _ais_term).
+           targetESS - the target fraction of effective runs (adaptive only).
     output: the log partition function logZB in tensor.
     #########################################################################"""
-    def AIS(self, run=10, levels=10, Batch=None, Seq=None):
+    def AIS(self, run=10, levels=10, Batch=None, Seq=None, chunk=None, schedule='linear', targetESS=0.9):
         # proposal partition function with shape []/[...].
         logZA_term1 = tf.reduce_sum(tf.nn.softplus(self._bv), axis=-1)
         logZA_term2 = tf.reduce_sum(tf.nn.softplus(self._bh), axis=-1)
         logZA_term3 = 0.5 * tf.reduce_sum(tf.log(2*np.pi) - tf.log(self._alpha + 1e-38))
         logZA = logZA_term1 + logZA_term2 + logZA_term3
-
-        if Batch is not None and Seq is None:
-            sample = tf.zeros(shape=[run, Batch, self._dimV])
-        elif Batch is None and Seq is not None:
-            sample = tf.zeros(shape=[run, Seq, self._dimV])
-        elif Batch is not None and Seq is not None:
-            sample = tf.zeros(shape=[run, Batch, Seq, self._dimV])
-        else:
-            sample = tf.zeros(shape=[run, self._dimV])
-
-        beta = tf.constant(value=1.0)
-        # logwk is the weighted matrix.
-        logWk = tf.zeros(shape=tf.shape(sample)[0:-1], dtype=tf.float32)
-        sample = self.GibbsSampling(V=sample, beta=0.0)[0]
-        # the cond and body for tf.while_loop
-        def cond(sample, beta, logWk):
-            return beta <= levels
-        #
-        def body(sample, beta, logWk):
-            newsample = self.GibbsSampling(V=sample, beta=beta/levels)[0]
-            logp_k = -self.FreeEnergy(V=newsample, beta=beta/levels)
-            logp_km1 = -self.FreeEnergy(V=newsample, beta=(beta-1)/levels)
-            logWk += logp_k - logp_km1
-            return newsample, beta + 1, logWk
-
-        _, beta, logWk = tf.while_loop(cond=cond, body=body, loop_vars=[sample, beta, logWk])
-
-        # compute the average weight. [...]
-        # logWk = tf.minimum(logWk, 2000)
-        logWk = logWk / 1000
-        log_wk_mean = tf.reduce_mean(logWk, axis=0)
-        r_ais = tf.reduce_mean(tf.exp(logWk - log_wk_mean), axis=0)
-        return logZA + 1000 * (tf.log(r_ais) + log_wk_mean)
-        #return sample
+        # the log-weights of ss-RBMs are large, so they are averaged in the scale of 1000.
+        return logZA + self._ais_term(run, levels, Batch, Seq, scale=1000., chunk=chunk,
+                                      schedule=schedule, targetESS=targetESS)
 
     """#########################################################################
     add_constraint: compute the partition function by annealed importance sampling.
@@ -8,6 +8,8 @@ from dl4s.TRBM import configRNNRBM, configssRNNRBM
 from dl4s.SeqVAE.utility import buildRec, MLP
 from dl4s.TRBM.RBM import binRBM, gaussRBM, mu_ssRBM, bin_ssRBM
 from dl4s.cores.model import _model
+from dl4s.cores.evaluation import shardedLogZ
+from dl4s.cores.tools import feedable_state, MaskedMean, BernoulliNLL
 import tensorflow as tf
 import numpy as np
 
@@ -33,8 +35,24 @@ class _RnnRBM(_model, object):
             self._aisRun = config.aisRun
             # <scalar> the number of intermediate proposal distributions of AIS.
             self._aisLevel = config.aisLevel
-            # <scalar> the steps of Gibbs sampling.
-            self._gibbs = config.Gibbs
+            # <scalar> the number of AIS runs annealed at a time (None for all at once).
+            self._aisChunk = config.aisChunk
+            # <string> the annealing schedule of AIS.
+            self._aisSchedule = config.aisSchedule
+            # <scalar> the target fraction of effective runs of the adaptive schedule.
+            self._aisTargetESS = config.aisTargetESS
+            # <scalar> the number of processes that share the AIS runs.
+            self._numThreads = config.numThreads
+            # <dict/None> the pool of processes of the sharded AIS (started on the first use).
+            self._aisPool = None
+            # <bool> whether to import the VAE into the graph of the model for NVIL.
+            self._fuseVAE = config.fuseVAE
+            # <tensor scalar> the steps of Gibbs sampling, which could be fed at run time.
+            self.gibbs = tf.placeholder_with_default(config.Gibbs, shape=(), name='gibbs')
+            # <list> the inverse temperatures of parallel tempering (None for plain Gibbs sampling).
+            self._tempering = config.Tempering
+            # <scalar> the sweeps of parallel tempering per generated frame.
+            self._genSweeps = config.genSweeps
             # <scalar> the size of frame of the input.
             self._dimInput = config.dimIN
             # <scalar> the size of frame of the state.
@@ -44,11 +62,58 @@ class _RnnRBM(_model, object):
             # <list> the RNN components.
             self._rnnCell = buildRec(dimLayer=config.dimRec, unitType=config.recType,
                                      init_scale=config.init_scale)
+            # <string> the type of recurrent units.
+            self._recType = config.recType
             #
             #
             self._rbm = None
             self._nll = None
 
+    """#########################################################################
+    _recurrence: run the RNN over the input features and compute the feedback
+                 of the previous step for each frame.
+    input: input - the input features with shape [batch, steps, frame].
+    output: d - the hidden output of the RNN [batch, steps, hidden].
+            dt - the hidden output of the previous step [batch, steps, hidden],
+                 the first step uses the output carried by the initial state.
+    #########################################################################"""
+    def _recurrence(self, input):
+        self._initState = feedable_state(self._rnnCell.zero_state(tf.shape(input)[0], dtype=tf.float32))
+        d, self._finalState = tf.nn.dynamic_rnn(self._rnnCell, input, sequence_length=self.seqLen,
+                                                initial_state=self._initState)
+        if self._recType == 'LSTM' or self._recType == 'BlockLSTM':
+            d0 = self._initState[-1][1]
+        else:
+            d0 = self._initState[-1]
+        dt = tf.concat(axis=1, values=(tf.expand_dims(d0, 1), d[:, 0:-1, :]))
+        return d, dt
+
+    """#########################################################################
+    _binaryNVIL: estimate the log partition function by NVIL with a binary VAE.
+                 The batch is replicated for the VAE so that the proposals of a
+                 chunk of runs are drawn in one call, and the free energies of
+                 the chunks are merged by a streaming log-mean-exp.
+    input: input - numerical input.
+    output: the log partition function with shape [batch, steps].
+    #########################################################################"""
+    def _binaryNVIL(self, input):
+        runs = self._aisRun
+        chunk = runs if self._aisChunk is None else min(self._aisChunk, runs)
+        logMax, sumExp = -np.inf, 0.0
+        for start in range(0, runs, chunk):
+            size = min(chunk, runs - start)
+            X, logPz_X, logPx_Z, logPz = self.VAE._sess.run(
+                self._logZ[0:-1], feed_dict={self._logZ[-1]: np.tile(input, [size, 1, 1])})
+            # shape = [runs, batch, steps, ...]
+            X, logPz_X, logPx_Z, logPz = [np.reshape(value, (size, input.shape[0]) + value.shape[1:])
+                                          for value in (X, logPz_X, np.nan_to_num(logPx_Z), logPz)]
+            FEofSample = self._sess.run(self.FEofSample, feed_dict={self.xx: X, self.x: input})
+            logTerm = 2 * (-FEofSample + logPz_X - logPx_Z - logPz)
+            newMax = np.maximum(logMax, np.max(logTerm, axis=0))
+            sumExp = sumExp * np.exp(logMax - newMax) + np.sum(np.exp(logTerm - newMax), axis=0)
+            logMax = newMax
+        return 0.5 * (np.log(sumExp / runs + 1e-38) + logMax)
+
 """#########################################################################
 Class: binRnnRBM - the RNNRBM model for stochastic binary inputs.
 #########################################################################"""
@@ -70,10 +135,7 @@ class binRnnRBM(_RnnRBM, object):
         with self._graph.as_default():
             # d_t = [batch, steps, hidden]
             self._mlp = MLP(config.init_scale, config.dimIN, config.dimMlp, config.mlpType)
-            state = self._rnnCell.zero_state(tf.shape(self.x)[0], dtype=tf.float32)
-            d, _ = tf.nn.dynamic_rnn(self._rnnCell, self._mlp(self.x), initial_state=state)
-            paddings = tf.constant([[0, 0], [1, 0], [0, 0]])
-            dt = tf.pad(d[:, 0:-1, :], paddings)
+            d, dt = self._recurrence(self._mlp(self.x))
             initializer = tf.random_uniform_initializer(-config.init_scale, config.init_scale)
             with tf.variable_scope("RBM", initializer=initializer):
                 bv = tf.get_variable('bv', shape=config.dimIN, initializer=tf.zeros_initializer)
@@ -83,49 +145,70 @@ class binRnnRBM(_RnnRBM, object):
                 bvt = tf.tensordot(dt, Wdv, [[-1], [0]]) + bv
                 bht = tf.tensordot(dt, Wdh, [[-1], [0]]) + bh
             self._rbm = binRBM(dimV=config.dimIN, dimH=config.dimState, init_scale=config.init_scale,
-                               x=self.x, bv=bvt, bh=bht, k=self._gibbs)
+                               x=self.x, bv=bvt, bh=bht, k=self.gibbs)
             # the training loss is per frame.
-            Loss = self._rbm.ComputeLoss(V=self.x, samplesteps=self._gibbs)
-            if VAE is None:
-                # The component for computing AIS.
-                self._logZ = self._rbm.AIS(self._aisRun, self._aisLevel,
-                                           tf.shape(self.x)[0], tf.shape(self.x)[1])
-                self._nll = tf.reduce_mean(self._rbm.FreeEnergy(self.x) + self._logZ)
-                self.VAE = VAE
-            else:
-                # The component for computing NVIL.
-                self._logZ = self._NVIL_VAE(VAE)  # X, logPz_X, logPx_Z, logPz, VAE.x
-                self.xx = tf.placeholder(dtype='float32', shape=[None, None, None, config.dimIN])
-                self.FEofSample = self._rbm.FreeEnergy(self.xx)
-                self.FEofInput = self._rbm.FreeEnergy(self.x)
-                self.VAE = VAE
+            Loss = self._rbm.ComputeLoss(V=self.x, samplesteps=self.gibbs, mask=self._mask,
+                                         tempering=self._tempering)
+            self.VAE = VAE
+            # the components to compute the AIS/NVIL are built on the first use.
+            def build_ais():
+                if VAE is None:
+                    # The component for computing AIS.
+                    self._logZ = self._rbm.AIS(self._aisRun, self._aisLevel,
+                                               tf.shape(self.x)[0], tf.shape(self.x)[1], chunk=self._aisChunk,
+                                               schedule=self._aisSchedule, targetESS=self._aisTargetESS)
+                    self._nll = MaskedMean(self._rbm.FreeEnergy(self.x) + self._logZ, self._mask)
+                    # the moments of the AIS weights and the effective sample size.
+                    self._aisMoments = self._rbm.aisMoments
+                    self._ess = self._rbm.aisESS
+                elif self._fuseVAE:
+                    # The VAE is frozen into this graph so that NVIL runs in one session call.
+                    self._logZ = self._fusedNVIL(VAE, self._NVIL_VAE(VAE)[0:-1],
+                                                 self._rbm.FreeEnergy, runs=self._aisRun)
+                    self._nll = tf.reduce_mean(self._rbm.FreeEnergy(self.x) + self._logZ)
+                else:
+                    # The component for computing NVIL.
+                    self._logZ = self._NVIL_VAE(VAE)  # X, logPz_X, logPx_Z, logPz, VAE.x
+                    self.xx = tf.placeholder(dtype='float32', shape=[None, None, None, config.dimIN])
+                    self.FEofSample = self._rbm.FreeEnergy(self.xx)
+                    self.FEofInput = self._rbm.FreeEnergy(self.x)
+            self._lazy('ais', build_ais)
             #
-            self._loss = self._rbm._monitor
+            self._loss = BernoulliNLL(self.x, self._rbm.muV, self._mask)
             self._params = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES)
-            self._train_step = self._optimizer.minimize(Loss)
+            self._lazy('train', lambda: self._minimize(Loss))
             # Define the reconstruction of input.
             self._outputs = self._rbm.muV0
             # Define the feature of input.
             self._feature = self._rbm.muH0
             """define the process to generate samples."""
-            state = self._rnnCell.zero_state(1, dtype=tf.float32)
-            x_ = tf.zeros((1, self._dimInput), dtype='float32')
-            # TensorArray to save the output of the generating.
-            gen_operator = tf.TensorArray(tf.float32, self.sampleLen)
-            # condition and body of while loop (input: i-iteration, xx-RNN input, ss-RNN state)
-            i = tf.constant(0)
-            cond = lambda i, xx, ss, array: tf.less(i, self.sampleLen)
-            #
-            def body(i, xx, ss, array):
-                ii = i + 1
-                hidde_, new_ss = self._rnnCell(self._mlp(xx), ss)
-                bvt = tf.tensordot(hidde_, Wdv, [[-1], [0]]) + bv
-                bht = tf.tensordot(hidde_, Wdh, [[-1], [0]]) + bh
-                new_xx = self._rbm(xx, bvt, bht, k=1)[0]
-                new_array = array.write(i, new_xx)
-                return ii, new_xx, new_ss, new_array
-            gen_operator = tf.while_loop(cond, body, [i, x_, state, gen_operator])[-1]
-            self._gen_operator = gen_operator.concat()
+            def build_gen():
+                # the state and the first input are fed to continue a primed prefix.
+                state = feedable_state(self._rnnCell.zero_state(self.sampleNum, dtype=tf.float32))
+                x_ = tf.placeholder_with_default(tf.zeros((self.sampleNum, self._dimInput), dtype='float32'),
+                                                 shape=[None, self._dimInput])
+                self._genSeed = (x_, state)
+                # TensorArray to save the output of the generating.
+                gen_operator = tf.TensorArray(tf.float32, self.sampleLen)
+                # condition and body of while loop (input: i-iteration, xx-RNN input, ss-RNN state)
+                i = tf.constant(0)
+                cond = lambda i, xx, ss, array: tf.less(i, self.sampleLen)
+                #
+                def body(i, xx, ss, array):
+                    ii = i + 1
+                    hidde_, new_ss = self._rnnCell(self._mlp(xx), ss)
+                    bvt = tf.tensordot(hidde_, Wdv, [[-1], [0]]) + bv
+                    bht = tf.tensordot(hidde_, Wdh, [[-1], [0]]) + bh
+                    if self._tempering is None:
+                        new_xx = self._rbm(xx, bvt, bht, k=1)[0]
+                    else:
+                        self._rbm._bv, self._rbm._bh = bvt, bht
+                        new_xx = self._rbm.ParallelTempering(xx, self._tempering, k=self._genSweeps)
+                    new_array = array.write(i, new_xx)
+                    return ii, new_xx, new_ss, new_array
+                gen_operator = tf.while_loop(cond, body, [i, x_, state, gen_operator])[-1]
+                return tf.transpose(gen_operator.stack(), [1, 0, 2])
+            self._lazy('gen', self._rbm.preserve(build_gen))
             self._runSession()
 
     """#########################################################################
@@ -157,38 +240,32 @@ class binRnnRBM(_RnnRBM, object):
                   function computed by annealed importance sampling or
                   NVIL with given VAE.
     input: input - numerical input.
-    output: the negative log-likelihood value.
+           seqLen - the valid length of each sequence (AIS only).
+           ess - if True, also return the effective sample size of AIS.
+    output: the negative log-likelihood value (and the ESS with shape
+            [batch, steps], None for NVIL).
     #########################################################################"""
-    def ais_function(self, input):
+    def ais_function(self, input, seqLen=None, ess=False):
         with self._graph.as_default():
+            self._build('ais')
+            ess_value = None
             if self.VAE is None:
+                feed = {self.x: input}
+                if seqLen is not None:
+                    feed[self.seqLen] = seqLen
+                if self._numThreads > 1:
+                    # the AIS runs are shared by several processes.
+                    feed[self._logZ], ess_value = shardedLogZ(self, input, seqLen, self._numThreads)
+                    loss_value = self._sess.run(self._nll, feed_dict=feed)
+                else:
+                    loss_value, ess_value = self._sess.run([self._nll, self._ess], feed_dict=feed)
+            elif self._fuseVAE:
                 loss_value = self._sess.run(self._nll, feed_dict={self.x: input})
             else:
-                loss_value = []
-                X = []
-                logPz_X = []
-                logPx_Z = []
-                logPz = []
-                for i in range(self._aisRun):
-                    Xi, logPz_Xi, logPx_Zi, logPzi = self.VAE._sess.run(self._logZ[0:-1], feed_dict={self._logZ[-1]: input})
-                    X.append(Xi)
-                    logPz_X.append(logPz_Xi)
-                    logPx_Z.append(np.nan_to_num(logPx_Zi))
-                    logPz.append(logPzi)
-                    # shape = [runs, batch, steps]
-                X = np.asarray(X)
-                logPz_X = np.asarray(logPz_X)
-                logPx_Z = np.asarray(logPx_Z)
-                logPz = np.asarray(logPz)
-                FEofSample = self._sess.run(self.FEofSample, feed_dict={self.xx: X, self.x: input})
-                logTerm = 2 * (-FEofSample + logPz_X - logPx_Z - logPz)
-                logTerm_max = np.max(logTerm, axis=0)
-                r_ais = np.mean(np.exp(logTerm - logTerm_max), axis=0)
-                logZ = 0.5 * (np.log(r_ais+1e-38) + logTerm_max)
+                logZ = self._binaryNVIL(input)
                 FEofInput = self._sess.run(self.FEofInput, feed_dict={self.x: input})
-                loss_value.append(np.mean(FEofInput + logZ))
-                loss_value = np.asarray(loss_value).mean()
-        return loss_value
+                loss_value = np.mean(FEofInput + logZ)
+        return (loss_value, ess_value) if ess else loss_value
 
 """#########################################################################
 Class: gaussRnnRBM - the RNNRBM model for stochastic continuous inputs
@@ -211,10 +288,7 @@ class gaussRnnRBM(_RnnRBM, object):
         with self._graph.as_default():
             # d_t = [batch, steps, hidden]
             self._mlp = MLP(config.init_scale, config.dimIN, config.dimMlp, config.mlpType)
-            state = self._rnnCell.zero_state(tf.shape(self.x)[0], dtype=tf.float32)
-            d, _ = tf.nn.dynamic_rnn(self._rnnCell, self._mlp(self.x), initial_state=state)
-            paddings = tf.constant([[0, 0], [1, 0], [0, 0]])
-            dt = tf.pad(d[:, 0:-1, :], paddings)
+            d, dt = self._recurrence(self._mlp(self.x))
             initializer = tf.random_uniform_initializer(-config.init_scale, config.init_scale)
             with tf.variable_scope("RBM", initializer=initializer):
                 bv = tf.get_variable('bv', shape=config.dimIN, initializer=tf.zeros_initializer)
@@ -229,47 +303,69 @@ class gaussRnnRBM(_RnnRBM, object):
                 # stdt = tf.tensordot(dt, Wstd, [[-1], [0]]) + bstd
                 stdt = 0.5 * tf.ones(shape=config.dimIN)
                 self._rbm = gaussRBM(dimV=config.dimIN, dimH=config.dimState, init_scale=config.init_scale,
-                                   x=self.x, bv=bvt, bh=bht, std=stdt, k=self._gibbs)
+                                   x=self.x, bv=bvt, bh=bht, std=stdt, k=self.gibbs)
             # the training loss is per frame.
-            Loss = self._rbm.ComputeLoss(V=self.x, samplesteps=self._gibbs)
-            if VAE is None:
-                self._logZ = self._rbm.AIS(self._aisRun, self._aisLevel,
-                                           tf.shape(self.x)[0], tf.shape(self.x)[1])
-                self._nll = tf.reduce_mean(self._rbm.FreeEnergy(self.x) + self._logZ)
-                self.VAE = VAE
-            else:
-                self._logZ = self._NVIL_VAE(VAE, self._aisRun)  # X, logPz_X, logPx_Z, logPz, VAE.x
-                self.xx = tf.placeholder(dtype='float32', shape=[None, None, None, config.dimIN])
-                self.FEofSample = self._rbm.FreeEnergy(self.xx)
-                self.FEofInput = self._rbm.FreeEnergy(self.x)
-                self.VAE = VAE
-            self._loss = self._rbm._monitor / self._dimInput        # define the monitor as RMSE/bits.
+            Loss = self._rbm.ComputeLoss(V=self.x, samplesteps=self.gibbs, mask=self._mask,
+                                         tempering=self._tempering)
+            self.VAE = VAE
+            # the components to compute the AIS/NVIL are built on the first use.
+            def build_ais():
+                if VAE is None:
+                    self._logZ = self._rbm.AIS(self._aisRun, self._aisLevel,
+                                               tf.shape(self.x)[0], tf.shape(self.x)[1], chunk=self._aisChunk,
+                                               schedule=self._aisSchedule, targetESS=self._aisTargetESS)
+                    self._nll = MaskedMean(self._rbm.FreeEnergy(self.x) + self._logZ, self._mask)
+                    # the moments of the AIS weights and the effective sample size.
+                    self._aisMoments = self._rbm.aisMoments
+                    self._ess = self._rbm.aisESS
+                elif self._fuseVAE:
+                    # The VAE is frozen into this graph so that NVIL runs in one session call.
+                    self._logZ = self._fusedNVIL(VAE, self._NVIL_VAE(VAE, self._aisRun)[0:-1],
+                                                 self._rbm.FreeEnergy)
+                    self._nll = tf.reduce_mean(self._rbm.FreeEnergy(self.x) + self._logZ)
+                else:
+                    self._logZ = self._NVIL_VAE(VAE, self._aisRun)  # X, logPz_X, logPx_Z, logPz, VAE.x
+                    self.xx = tf.placeholder(dtype='float32', shape=[None, None, None, config.dimIN])
+                    self.FEofSample = self._rbm.FreeEnergy(self.xx)
+                    self.FEofInput = self._rbm.FreeEnergy(self.x)
+            self._lazy('ais', build_ais)
+            # define the monitor as RMSE/bits.
+            self._loss = MaskedMean(tf.reduce_sum((self.x - self._rbm.muV) ** 2, axis=-1), self._mask) / self._dimInput
             self._params = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES)
-            self._train_step = self._optimizer.minimize(Loss)
+            self._lazy('train', lambda: self._minimize(Loss))
             # Define the reconstruction of input.
             self._outputs = self._rbm.muV0
             # Define the feature of input.
             self._feature = self._rbm.muH0
             """define the process to generate samples."""
-            state = self._rnnCell.zero_state(1, dtype=tf.float32)
-            x_ = tf.zeros((1, self._dimInput), dtype='float32')
-            # TensorArray to save the output of the generating.
-            gen_operator = tf.TensorArray(tf.float32, self.sampleLen)
-            # condition and body of while loop (input: i-iteration, xx-RNN input, ss-RNN state)
-            i = tf.constant(0)
-            cond = lambda i, xx, ss, array: tf.less(i, self.sampleLen)
-            #
-            def body(i, xx, ss, array):
-                ii = i + 1
-                hidde_, new_ss = self._rnnCell(self._mlp(xx), ss)
-                bvt = tf.tensordot(hidde_, Wdv, [[-1], [0]]) + bv
-                bht = tf.tensordot(hidde_, Wdh, [[-1], [0]]) + bh
-                new_xx = self._rbm(xx, bvt=bvt, bht=bht, k=1)[0]
-                new_array = array.write(i, new_xx)
-                return ii, new_xx, new_ss, new_array
+            def build_gen():
+                # the state and the first input are fed to continue a primed prefix.
+                state = feedable_state(self._rnnCell.zero_state(self.sampleNum, dtype=tf.float32))
+                x_ = tf.placeholder_with_default(tf.zeros((self.sampleNum, self._dimInput), dtype='float32'),
+                                                 shape=[None, self._dimInput])
+                self._genSeed = (x_, state)
+                # TensorArray to save the output of the generating.
+                gen_operator = tf.TensorArray(tf.float32, self.sampleLen)
+                # condition and body of while loop (input: i-iteration, xx-RNN input, ss-RNN state)
+                i = tf.constant(0)
+                cond = lambda i, xx, ss, array: tf.less(i, self.sampleLen)
+                #
+                def body(i, xx, ss, array):
+                    ii = i + 1
+                    hidde_, new_ss = self._rnnCell(self._mlp(xx), ss)
+                    bvt = tf.tensordot(hidde_, Wdv, [[-1], [0]]) + bv
+                    bht = tf.tensordot(hidde_, Wdh, [[-1], [0]]) + bh
+                    if self._tempering is None:
+                        new_xx = self._rbm(xx, bvt=bvt, bht=bht, k=1)[0]
+                    else:
+                        self._rbm._bv, self._rbm._bh = bvt, bht
+                        new_xx = self._rbm.ParallelTempering(xx, self._tempering, k=self._genSweeps)
+                    new_array = array.write(i, new_xx)
+                    return ii, new_xx, new_ss, new_array
 
-            gen_operator = tf.while_loop(cond, body, [i, x_, state, gen_operator])[-1]
-            self._gen_operator = gen_operator.concat()
+                gen_operator = tf.while_loop(cond, body, [i, x_, state, gen_operator])[-1]
+                return tf.transpose(gen_operator.stack(), [1, 0, 2])
+            self._lazy('gen', self._rbm.preserve(build_gen))
             self._runSession()
 
 
@@ -299,11 +395,26 @@ class gaussRnnRBM(_RnnRBM, object):
     ais_function: compute the approximated negative log-likelihood with partition
                   function computed by annealed importance sampling.
     input: input - numerical input.
-    output: the negative log-likelihood value.
+           seqLen - the valid length of each sequence (AIS only).
+           ess - if True, also return the effective sample size of AIS.
+    output: the negative log-likelihood value (and the ESS with shape
+            [batch, steps], None for NVIL).
     #########################################################################"""
-    def ais_function(self, input):
+    def ais_function(self, input, seqLen=None, ess=False):
         with self._graph.as_default():
+            self._build('ais')
+            ess_value = None
             if self.VAE is None:
+                feed = {self.x: input}
+                if seqLen is not None:
+                    feed[self.seqLen] = seqLen
+                if self._numThreads > 1:
+                    # the AIS runs are shared by several processes.
+                    feed[self._logZ], ess_value = shardedLogZ(self, input, seqLen, self._numThreads)
+                    loss_value = self._sess.run(self._nll, feed_dict=feed)
+                else:
+                    loss_value, ess_value = self._sess.run([self._nll, self._ess], feed_dict=feed)
+            elif self._fuseVAE:
                 loss_value = self._sess.run(self._nll, feed_dict={self.x: input})
             else:
                 X, logPz_X, logPx_Z, logPz = self.VAE._sess.run(self._logZ[0:-1], feed_dict={self._logZ[-1]: input})
@@ -315,7 +426,7 @@ class gaussRnnRBM(_RnnRBM, object):
                 logZ = 0.5 * (np.log(r_ais) + logTerm_max)
                 FEofInput = self._sess.run(self.FEofInput, feed_dict={self.x: input})
                 loss_value = np.mean(FEofInput + logZ)
-        return loss_value
+        return (loss_value, ess_value) if ess else loss_value
 
 
 """#########################################################################
@@ -340,10 +451,7 @@ class ssRNNRBM(_RnnRBM, object):
         with self._graph.as_default():
             # d_t = [batch, steps, hidden]
             self._mlp = MLP(config.init_scale, config.dimIN, config.dimMlp, config.mlpType)
-            state = self._rnnCell.zero_state(tf.shape(self.x)[0], dtype=tf.float32)
-            d, _ = tf.nn.dynamic_rnn(self._rnnCell, self._mlp(self.x), initial_state=state)
-            paddings = tf.constant([[0, 0], [1, 0], [0, 0]])
-            dt = tf.pad(d[:, 0:-1, :], paddings)
+            d, dt = self._recurrence(self._mlp(self.x))
             initializer = tf.random_uniform_initializer(-config.init_scale, config.init_scale)
             with tf.variable_scope("ssRBM", initializer=initializer):
                 # in ssRNNRBM, the feedback influences only the bias of H.
@@ -357,57 +465,77 @@ class ssRNNRBM(_RnnRBM, object):
                                      alphaTrain=config.alphaTrain,
                                      muTrain=config.muTrain,
                                      phiTrain=config.phiTrain,
-                                     k=self._gibbs)
-            Loss = self._rbm.ComputeLoss(V=self.x, samplesteps=self._gibbs)
-            if VAE is None:
-                self._logZ = self._rbm.AIS(self._aisRun, self._aisLevel,
-                                           tf.shape(self.x)[0], tf.shape(self.x)[1])
-                self._nll = tf.reduce_mean(self._rbm.FreeEnergy(self.x) + self._logZ)
-                self.VAE = VAE
-            else:
-                self._logZ = self._NVIL_VAE(VAE, self._aisRun)  # X, logPz_X, logPx_Z, logPz, VAE.x
-                self.xx = tf.placeholder(dtype='float32', shape=[None, None, None, config.dimIN])
-                self.FEofSample = self._rbm.FreeEnergy(self.xx)
-                self.FEofInput = self._rbm.FreeEnergy(self.x)
-                self.VAE = VAE
+                                     k=self.gibbs)
+            Loss = self._rbm.ComputeLoss(V=self.x, samplesteps=self.gibbs, mask=self._mask,
+                                         tempering=self._tempering)
+            self.VAE = VAE
+            # the components to compute the AIS/NVIL are built on the first use.
+            def build_ais():
+                if VAE is None:
+                    self._logZ = self._rbm.AIS(self._aisRun, self._aisLevel,
+                                               tf.shape(self.x)[0], tf.shape(self.x)[1], chunk=self._aisChunk,
+                                               schedule=self._aisSchedule, targetESS=self._aisTargetESS)
+                    self._nll = MaskedMean(self._rbm.FreeEnergy(self.x) + self._logZ, self._mask)
+                    # the moments of the AIS weights and the effective sample size.
+                    self._aisMoments = self._rbm.aisMoments
+                    self._ess = self._rbm.aisESS
+                elif self._fuseVAE:
+                    # The VAE is frozen into this graph so that NVIL runs in one session call.
+                    self._logZ = self._fusedNVIL(VAE, self._NVIL_VAE(VAE, self._aisRun)[0:-1],
+                                                 self._rbm.FreeEnergy)
+                    self._nll = tf.reduce_mean(self._rbm.FreeEnergy(self.x) + self._logZ)
+                else:
+                    self._logZ = self._NVIL_VAE(VAE, self._aisRun)  # X, logPz_X, logPx_Z, logPz, VAE.x
+                    self.xx = tf.placeholder(dtype='float32', shape=[None, None, None, config.dimIN])
+                    self.FEofSample = self._rbm.FreeEnergy(self.xx)
+                    self.FEofInput = self._rbm.FreeEnergy(self.x)
+            self._lazy('ais', build_ais)
             #
             self._params = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES)
-            self._train_step = self._optimizer.minimize(Loss)
+            self._lazy('train', lambda: self._minimize(Loss))
             # add the computation of precision and covariance matrix of ssRBM.
-            self.PreV_h = self._rbm.PreV_h
-            self.CovV_h = self._rbm.CovV_h
+            self._lazy('cov', self._rbm.Precision)
             # add the tensor computation of reconstruction output.
             self._outputs = self._rbm.muV0
             # add the tensor computation of extracted feature.
             self._feature = self._rbm.muH0
             self._sparse_feature = self._rbm.muH0 * self._rbm.muS0
             # add the monitor
-            self._loss = self._rbm._monitor / config.dimIN
+            self._loss = tf.sqrt(MaskedMean(tf.reduce_sum((self.x - self._rbm.muV) ** 2, axis=-1), self._mask)) / config.dimIN
             # add the scaling operation of W.
             if config.W_Norm:
                 self._scaleW = self._rbm.add_constraint()
             else:
                 self._scaleW = None
             """define the process to generate samples."""
-            state = self._rnnCell.zero_state(1, dtype=tf.float32)
-            x_ = tf.zeros((1, self._dimInput), dtype='float32')
-            # TensorArray to save the output of the generating.
-            gen_operator = tf.TensorArray(tf.float32, self.sampleLen)
-            # condition and body of while loop (input: i-iteration, xx-RNN input, ss-RNN state)
-            i = tf.constant(0)
-            cond = lambda i, xx, ss, array: tf.less(i, self.sampleLen)
+            def build_gen():
+                # the state and the first input are fed to continue a primed prefix.
+                state = feedable_state(self._rnnCell.zero_state(self.sampleNum, dtype=tf.float32))
+                x_ = tf.placeholder_with_default(tf.zeros((self.sampleNum, self._dimInput), dtype='float32'),
+                                                 shape=[None, self._dimInput])
+                self._genSeed = (x_, state)
+                # TensorArray to save the output of the generating.
+                gen_operator = tf.TensorArray(tf.float32, self.sampleLen)
+                # condition and body of while loop (input: i-iteration, xx-RNN input, ss-RNN state)
+                i = tf.constant(0)
+                cond = lambda i, xx, ss, array: tf.less(i, self.sampleLen)
 
-            #
-            def body(i, xx, ss, array):
-                ii = i + 1
-                hidde_, new_ss = self._rnnCell(self._mlp(xx), ss)
-                bht = tf.tensordot(hidde_, Wdh, [[-1], [0]]) + bh
-                new_xx = self._rbm(xx, bht=bht, k=1)[0]
-                new_array = array.write(i, new_xx)
-                return ii, new_xx, new_ss, new_array
+                #
+                def body(i, xx, ss, array):
+                    ii = i + 1
+                    hidde_, new_ss = self._rnnCell(self._mlp(xx), ss)
+                    bht = tf.tensordot(hidde_, Wdh, [[-1], [0]]) + bh
+                    if self._tempering is None:
+                        new_xx = self._rbm(xx, bht=bht, k=1)[0]
+                    else:
+                        self._rbm._bh = bht
+                        new_xx = self._rbm.ParallelTempering(xx, self._tempering, k=self._genSweeps)
+                    new_array = array.write(i, new_xx)
+                    return ii, new_xx, new_ss, new_array
 
-            gen_operator = tf.while_loop(cond, body, [i, x_, state, gen_operator])[-1]
-            self._gen_operator = gen_operator.concat()
+                gen_operator = tf.while_loop(cond, body, [i, x_, state, gen_operator])[-1]
+                return tf.transpose(gen_operator.stack(), [1, 0, 2])
+            self._lazy('gen', self._rbm.preserve(build_gen))
             self._runSession()
 
     """#########################################################################
@@ -417,7 +545,7 @@ class ssRNNRBM(_RnnRBM, object):
     #########################################################################"""
     def convariance(self, input):
         with self._graph.as_default():
-            return self._sess.run(self.CovV_h, feed_dict={self.x: input})
+            return self._sess.run(self._build('cov')[1], feed_dict={self.x: input})
 
     """#########################################################################
     precision: compute the precision matrix Cv_h^{-1}.
@@ -426,7 +554,7 @@ class ssRNNRBM(_RnnRBM, object):
     #########################################################################"""
     def precision(self, input):
         with self._graph.as_default():
-            return self._sess.run(self.PreV_h, feed_dict={self.x: input})
+            return self._sess.run(self._build('cov')[0], feed_dict={self.x: input})
 
     """#########################################################################
     _NVIL_VAE: generate the graph to compute the NVIL upper bound of log Partition
@@ -454,11 +582,26 @@ class ssRNNRBM(_RnnRBM, object):
     ais_function: compute the approximated negative log-likelihood with partition
                   function computed by annealed importance sampling.
     input: input - numerical input.
-    output: the negative log-likelihood value.
+           seqLen - the valid length of each sequence (AIS only).
+           ess - if True, also return the effective sample size of AIS.
+    output: the negative log-likelihood value (and the ESS with shape
+            [batch, steps], None for NVIL).
     #########################################################################"""
-    def ais_function(self, input):
+    def ais_function(self, input, seqLen=None, ess=False):
         with self._graph.as_default():
+            self._build('ais')
+            ess_value = None
             if self.VAE is None:
+                feed = {self.x: input}
+                if seqLen is not None:
+                    feed[self.seqLen] = seqLen
+                if self._numThreads > 1:
+                    # the AIS runs are shared by several processes.
+                    feed[self._logZ], ess_value = shardedLogZ(self, input, seqLen, self._numThreads, scale=1000.)
+                    loss_value = self._sess.run(self._nll, feed_dict=feed)
+                else:
+                    loss_value, ess_value = self._sess.run([self._nll, self._ess], feed_dict=feed)
+            elif self._fuseVAE:
                 loss_value = self._sess.run(self._nll, feed_dict={self.x: input})
             else:
                 X, logPz_X, logPx_Z, logPz = self.VAE._sess.run(self._logZ[0:-1], feed_dict={self._logZ[-1]: input})
@@ -470,7 +613,7 @@ class ssRNNRBM(_RnnRBM, object):
                 logZ = 0.5 * (np.log(r_ais) + logTerm_max)
                 FEofInput = self._sess.run(self.FEofInput, feed_dict={self.x: input})
                 loss_value = np.mean(FEofInput + logZ)
-        return loss_value
+        return (loss_value, ess_value) if ess else loss_value
 
 """#########################################################################
 Class: binssRNNRBM - the RNNRBM model for stochastic binary inputs
@@ -495,10 +638,7 @@ class binssRNNRBM(_RnnRBM, object):
         with self._graph.as_default():
             # d_t = [batch, steps, hidden]
             self._mlp = MLP(config.init_scale, config.dimIN, config.dimMlp, config.mlpType)
-            state = self._rnnCell.zero_state(tf.shape(self.x)[0], dtype=tf.float32)
-            d, _ = tf.nn.dynamic_rnn(self._rnnCell, self._mlp(self.x), initial_state=state)
-            paddings = tf.constant([[0, 0], [1, 0], [0, 0]])
-            dt = tf.pad(d[:, 0:-1, :], paddings)
+            d, dt = self._recurrence(self._mlp(self.x))
             initializer = tf.random_uniform_initializer(-config.init_scale, config.init_scale)
             with tf.variable_scope("ssRBM", initializer=initializer):
                 # in ssRNNRBM, the feedback influences only the bias of H.
@@ -511,54 +651,75 @@ class binssRNNRBM(_RnnRBM, object):
                                      x=self.x, bv=bvt, bh=bht,
                                      alphaTrain=config.alphaTrain,
                                      muTrain=config.muTrain,
-                                     k=self._gibbs)
-            Loss = self._rbm.ComputeLoss(V=self.x, samplesteps=self._gibbs)
-            if VAE is None:
-                self._logZ = self._rbm.AIS(self._aisRun, self._aisLevel,
-                                           tf.shape(self.x)[0], tf.shape(self.x)[1])
-                self._nll = tf.reduce_mean(self._rbm.FreeEnergy(self.x) + self._logZ)
-                self.VAE = VAE
-            else:
-                self._logZ = self._NVIL_VAE(VAE)  # X, logPz_X, logPx_Z, logPz, VAE.x
-                self.xx = tf.placeholder(dtype='float32', shape=[None, None, None, config.dimIN])
-                self.FEofSample = self._rbm.FreeEnergy(self.xx)
-                self.FEofInput = self._rbm.FreeEnergy(self.x)
-                self.VAE = VAE
+                                     k=self.gibbs)
+            Loss = self._rbm.ComputeLoss(V=self.x, samplesteps=self.gibbs, mask=self._mask,
+                                         tempering=self._tempering)
+            self.VAE = VAE
+            # the components to compute the AIS/NVIL are built on the first use.
+            def build_ais():
+                if VAE is None:
+                    self._logZ = self._rbm.AIS(self._aisRun, self._aisLevel,
+                                               tf.shape(self.x)[0], tf.shape(self.x)[1], chunk=self._aisChunk,
+                                               schedule=self._aisSchedule, targetESS=self._aisTargetESS)
+                    self._nll = MaskedMean(self._rbm.FreeEnergy(self.x) + self._logZ, self._mask)
+                    # the moments of the AIS weights and the effective sample size.
+                    self._aisMoments = self._rbm.aisMoments
+                    self._ess = self._rbm.aisESS
+                elif self._fuseVAE:
+                    # The VAE is frozen into this graph so that NVIL runs in one session call.
+                    self._logZ = self._fusedNVIL(VAE, self._NVIL_VAE(VAE)[0:-1],
+                                                 self._rbm.FreeEnergy, runs=self._aisRun)
+                    self._nll = tf.reduce_mean(self._rbm.FreeEnergy(self.x) + self._logZ)
+                else:
+                    self._logZ = self._NVIL_VAE(VAE)  # X, logPz_X, logPx_Z, logPz, VAE.x
+                    self.xx = tf.placeholder(dtype='float32', shape=[None, None, None, config.dimIN])
+                    self.FEofSample = self._rbm.FreeEnergy(self.xx)
+                    self.FEofInput = self._rbm.FreeEnergy(self.x)
+            self._lazy('ais', build_ais)
             #
             self._params = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES)
-            self._train_step = self._optimizer.minimize(Loss)
+            self._lazy('train', lambda: self._minimize(Loss))
             # add the tensor computation of reconstruction output.
             self._outputs = self._rbm.muV0
             # add the tensor computation of extracted feature.
             self._feature = self._rbm.muH0
             self._sparse_feature = self._rbm.muH0 * self._rbm.muS0
             # add the monitor
-            self._loss = self._rbm._monitor
+            self._loss = BernoulliNLL(self.x, self._rbm.muV, self._mask)
             # add the scaling operation of W.
             if config.W_Norm:
                 self._scaleW = self._rbm.add_constraint()
             else:
                 self._scaleW = None
             """define the process to generate samples."""
-            state = self._rnnCell.zero_state(1, dtype=tf.float32)
-            x_ = tf.zeros((1, self._dimInput), dtype='float32')
-            # TensorArray to save the output of the generating.
-            gen_operator = tf.TensorArray(tf.float32, self.sampleLen)
-            # condition and body of while loop (input: i-iteration, xx-RNN input, ss-RNN state)
-            i = tf.constant(0)
-            cond = lambda i, xx, ss, array: tf.less(i, self.sampleLen)
+            def build_gen():
+                # the state and the first input are fed to continue a primed prefix.
+                state = feedable_state(self._rnnCell.zero_state(self.sampleNum, dtype=tf.float32))
+                x_ = tf.placeholder_with_default(tf.zeros((self.sampleNum, self._dimInput), dtype='float32'),
+                                                 shape=[None, self._dimInput])
+                self._genSeed = (x_, state)
+                # TensorArray to save the output of the generating.
+                gen_operator = tf.TensorArray(tf.float32, self.sampleLen)
+                # condition and body of while loop (input: i-iteration, xx-RNN input, ss-RNN state)
+                i = tf.constant(0)
+                cond = lambda i, xx, ss, array: tf.less(i, self.sampleLen)
 
-            #
-            def body(i, xx, ss, array):
-                ii = i + 1
-                hidde_, new_ss = self._rnnCell(self._mlp(xx), ss)
-                bht = tf.tensordot(hidde_, Wdh, [[-1], [0]]) + bh
-                new_xx = self._rbm(xx, bht=bht, k=1)[0]
-                new_array = array.write(i, new_xx)
-                return ii, new_xx, new_ss, new_array
+                #
+                def body(i, xx, ss, array):
+                    ii = i + 1
+                    hidde_, new_ss = self._rnnCell(self._mlp(xx), ss)
+                    bht = tf.tensordot(hidde_, Wdh, [[-1], [0]]) + bh
+                    if self._tempering is None:
+                        new_xx = self._rbm(xx, bht=bht, k=1)[0]
+                    else:
+                        self._rbm._bh = bht
+                        new_xx = self._rbm.ParallelTempering(xx, self._tempering, k=self._genSweeps)
+                    new_array = array.write(i, new_xx)
+                    return ii, new_xx, new_ss, new_array
 
-            gen_operator = tf.while_loop(cond, body, [i, x_, state, gen_operator])[-1]
-            self._gen_operator = gen_operator.concat()
+                gen_operator = tf.while_loop(cond, body, [i, x_, state, gen_operator])[-1]
+                return tf.transpose(gen_operator.stack(), [1, 0, 2])
+            self._lazy('gen', self._rbm.preserve(build_gen))
             self._runSession()
 
     """#########################################################################
@@ -590,35 +751,29 @@ class binssRNNRBM(_RnnRBM, object):
     ais_function: compute the approximated negative log-likelihood with partition
                   function computed by annealed importance sampling.
     input: input - numerical input.
-    output: the negative log-likelihood value.
+           seqLen - the valid length of each sequence (AIS only).
+           ess - if True, also return the effective sample size of AIS.
+    output: the negative log-likelihood value (and the ESS with shape
+            [batch, steps], None for NVIL).
     #########################################################################"""
-    def ais_function(self, input):
+    def ais_function(self, input, seqLen=None, ess=False):
         with self._graph.as_default():
+            self._build('ais')
+            ess_value = None
             if self.VAE is None:
+                feed = {self.x: input}
+                if seqLen is not None:
+                    feed[self.seqLen] = seqLen
+                if self._numThreads > 1:
+                    # the AIS runs are shared by several processes.
+                    feed[self._logZ], ess_value = shardedLogZ(self, input, seqLen, self._numThreads, scale=1000.)
+                    loss_value = self._sess.run(self._nll, feed_dict=feed)
+                else:
+                    loss_value, ess_value = self._sess.run([self._nll, self._ess], feed_dict=feed)
+            elif self._fuseVAE:
                 loss_value = self._sess.run(self._nll, feed_dict={self.x: input})
             else:
-                loss_value = []
-                X = []
-                logPz_X = []
-                logPx_Z = []
-                logPz = []
-                for i in range(self._aisRun):
-                    Xi, logPz_Xi, logPx_Zi, logPzi = self.VAE._sess.run(self._logZ[0:-1], feed_dict={self._logZ[-1]: input})
-                    X.append(Xi)
-                    logPz_X.append(logPz_Xi)
-                    logPx_Z.append(np.nan_to_num(logPx_Zi))
-                    logPz.append(logPzi)
-                    # shape = [runs, batch, steps]
-                X = np.asarray(X)
-                logPz_X = np.asarray(logPz_X)
-                logPx_Z = np.asarray(logPx_Z)
-                logPz = np.asarray(logPz)
-                FEofSample = self._sess.run(self.FEofSample, feed_dict={self.xx: X, self.x: input})
-                logTerm = 2 * (-FEofSample + logPz_X - logPx_Z - logPz)
-                logTerm_max = np.max(logTerm, axis=0)
-                r_ais = np.mean(np.exp(logTerm - logTerm_max), axis=0)
-                logZ = 0.5 * (np.log(r_ais+1e-38) + logTerm_max)
+                logZ = self._binaryNVIL(input)
                 FEofInput = self._sess.run(self.FEofInput, feed_dict={self.x: input})
-                loss_value.append(np.mean(FEofInput + logZ))
-                loss_value = np.asarray(loss_value).mean()
-        return loss_value
+                loss_value = np.mean(FEofInput + logZ)
+        return (loss_value, ess_value) if ess else loss_value
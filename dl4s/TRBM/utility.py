@@ -13,8 +13,15 @@ Class: configRNNRBM - Basic setting of the RNN-RBM models.
 class configRNNRBM(_config):
     aisRun = 100        # <scalar> the number of samples of AIS.
     aisLevel = 10       # <scalar> the number of intermediate proposal distributions of AIS.
+    aisChunk = None     # <scalar> the number of AIS/NVIL runs evaluated at a time (None for all at once).
+    aisSchedule = 'linear'  # <string> the annealing schedule of AIS: 'linear', 'geometric', 'sigmoid' or 'adaptive'.
+    aisTargetESS = 0.9  # <scalar> the fraction of runs kept effective at each level by the adaptive schedule.
+    numThreads = 1      # <scalar> the number of processes that share the AIS runs.
+    fuseVAE = False     # <bool> whether to import the VAE into the graph of the model for NVIL.
     Gibbs = 15          # <scalar> the steps of Gibbs sampling.
-    recType = 'LSTM'
+    Tempering = None    # <list> the inverse temperatures of parallel tempering, e.g. [1.0, 0.8, 0.6].
+    genSweeps = 1       # <scalar> the sweeps of parallel tempering per generated frame.
+    recType = 'LSTM'    # <string> the type of recurrent hidden units(LSTM/GRU/BlockLSTM/BlockGRU/Tanh).
     mlpType = 'relu'
     dimMlp = []
     dimRec = []
@@ -1,5 +1,6 @@
 from dl4s.cores.tools import get_batches_idx
 #--from dl4s.cores.model import _config, _model
+from dl4s.cores.model import frozenModel
 # RNN models.
 from dl4s.autoregRnn.AutoRegressiveRNN import binRNN, gaussRNN
 from dl4s.autoregRnn.utility import config as configRNN
@@ -8,7 +8,7 @@ Descriptions: This file contains the Autoregressive RNN with arbitrary
 
 import tensorflow as tf
 from .utility import hidden_net
-from dl4s.cores.tools import GaussNLL
+from dl4s.cores.tools import GaussNLL, feedable_state
 from dl4s.cores.model import _model
 import numpy as np
 
@@ -44,8 +44,9 @@ class _arRNN(_model, object):
             # self._cell: the mutil - layer hidden cells.
             # self._hiddenOutput - the output with shape [batch_size, max_time, cell.output_size].
             # self._initializer - Initializer.
-            self._cell, self._hiddenOutput, self._initializer = hidden_net(
-                self.x, self._graph, config)
+            # self._initState/self._finalState - the initial/final state of the cells.
+            self._cell, self._hiddenOutput, self._initializer, self._initState, self._finalState = \
+                hidden_net(self.x, self._graph, config, self.seqLen)
             #
             self._feature = self._hiddenOutput
         return
@@ -76,28 +77,34 @@ class binRNN(_arRNN, object):
                 logits = tf.tensordot(self._hiddenOutput, W, [[-1], [0]]) + b
                 self._outputs = tf.nn.sigmoid(logits)
                 """define the loss and train_step."""
-                self._loss = tf.losses.sigmoid_cross_entropy(self.x[:, 1:, :], logits[:, 0:-1, :])
+                self._loss = tf.losses.sigmoid_cross_entropy(self.x[:, 1:, :], logits[:, 0:-1, :],
+                                                             weights=tf.expand_dims(self._mask[:, 0:-1], axis=-1))
                 self._params = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES)
-                self._train_step = self._optimizer.minimize(tf.cast(tf.shape(self.x), tf.float32)[-1]*self._loss)
+                Loss = tf.cast(tf.shape(self.x), tf.float32)[-1]*self._loss
+                self._lazy('train', lambda: self._minimize(Loss))
                 """define the process to generate samples."""
-                # the initial state and initial input of the RNN.
-                state = self._cell.zero_state(1, dtype=tf.float32)
-                x_ = tf.zeros((1, self._dimLayer[0]), dtype='float32')
-                # TensorArray to save the output of the generating.
-                gen_operator = tf.TensorArray(tf.float32, self.sampleLen)
-                # condition and body of while loop (input: i-iteration, xx-RNN input, ss-RNN state)
-                i = tf.constant(0)
-                cond = lambda i, xx, ss, array: tf.less(i, self.sampleLen)
-                #
-                def body(i, xx, ss, array):
-                    ii = i + 1
-                    hidde_, new_ss = self._cell(xx, ss)
-                    probs = tf.nn.sigmoid(tf.nn.xw_plus_b(hidde_, W, b))
-                    new_xx = tf.distributions.Bernoulli(probs=probs, dtype=tf.float32).sample()
-                    new_array = array.write(i, new_xx)
-                    return ii, new_xx, new_ss, new_array
-                gen_operator = tf.while_loop(cond, body, [i, x_, state, gen_operator])[-1]
-                self._gen_operator = gen_operator.concat()
+                def build_gen():
+                    # the initial state and initial input of the RNN (fed to continue a primed prefix).
+                    state = feedable_state(self._cell.zero_state(self.sampleNum, dtype=tf.float32))
+                    x_ = tf.placeholder_with_default(tf.zeros((self.sampleNum, self._dimLayer[0]), dtype='float32'),
+                                                     shape=[None, self._dimLayer[0]])
+                    self._genSeed = (x_, state)
+                    # TensorArray to save the output of the generating.
+                    gen_operator = tf.TensorArray(tf.float32, self.sampleLen)
+                    # condition and body of while loop (input: i-iteration, xx-RNN input, ss-RNN state)
+                    i = tf.constant(0)
+                    cond = lambda i, xx, ss, array: tf.less(i, self.sampleLen)
+                    #
+                    def body(i, xx, ss, array):
+                        ii = i + 1
+                        hidde_, new_ss = self._cell(xx, ss)
+                        probs = tf.nn.sigmoid(tf.nn.xw_plus_b(hidde_, W, b))
+                        new_xx = tf.distributions.Bernoulli(probs=probs, dtype=tf.float32).sample()
+                        new_array = array.write(i, new_xx)
+                        return ii, new_xx, new_ss, new_array
+                    gen_operator = tf.while_loop(cond, body, [i, x_, state, gen_operator])[-1]
+                    return tf.transpose(gen_operator.stack(), [1, 0, 2])
+                self._lazy('gen', build_gen)
                 #
                 self._runSession()
 
@@ -135,30 +142,36 @@ class gaussRNN(_arRNN, object):
                 self._prob = [mu, sig]
                 self._outputs = mu
                 """define the loss function as negative log-likelihood."""
-                self._loss = GaussNLL(x=self.x[:, 1:, :], mean=mu[:, 0:-1, :], sigma=sig[:, 0:-1, :])
+                self._loss = GaussNLL(x=self.x[:, 1:, :], mean=mu[:, 0:-1, :], sigma=sig[:, 0:-1, :],
+                                      mask=self._mask[:, 0:-1])
                 self._params = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES)
-                self._train_step = self._optimizer.minimize(tf.cast(tf.shape(self.x), tf.float32)[-1]*self._loss)
+                Loss = tf.cast(tf.shape(self.x), tf.float32)[-1]*self._loss
+                self._lazy('train', lambda: self._minimize(Loss))
                 """define the process to generate samples."""
-                # the initial state and initial input of the RNN.
-                state = self._cell.zero_state(1, dtype=tf.float32)
-                x_ = tf.zeros((1, self._dimLayer[0]), dtype='float32')
-                # TensorArray to save the output of the generating.
-                gen_operator = tf.TensorArray(tf.float32, self.sampleLen)
-                # condition and body of while loop (input: i-iteration, xx-RNN input, ss-RNN state)
-                i = tf.constant(0)
-                cond = lambda i, xx, ss, array: tf.less(i, self.sampleLen)
-                #
-                def body(i, xx, ss, array):
-                    ii = i + 1
-                    hidde_, new_ss = self._cell(xx, ss)
-                    mu = tf.nn.xw_plus_b(hidde_, W_mu, b_mu)
-                    sig = tf.nn.softplus(tf.nn.xw_plus_b(hidde_, W_sig, b_sig)) + 1e-8
-                    new_xx = tf.distributions.Normal(loc=mu, scale=tf.sqrt(sig)).sample()
-                    new_array = array.write(i, new_xx)
-                    return ii, new_xx, new_ss, new_array
+                def build_gen():
+                    # the initial state and initial input of the RNN (fed to continue a primed prefix).
+                    state = feedable_state(self._cell.zero_state(self.sampleNum, dtype=tf.float32))
+                    x_ = tf.placeholder_with_default(tf.zeros((self.sampleNum, self._dimLayer[0]), dtype='float32'),
+                                                     shape=[None, self._dimLayer[0]])
+                    self._genSeed = (x_, state)
+                    # TensorArray to save the output of the generating.
+                    gen_operator = tf.TensorArray(tf.float32, self.sampleLen)
+                    # condition and body of while loop (input: i-iteration, xx-RNN input, ss-RNN state)
+                    i = tf.constant(0)
+                    cond = lambda i, xx, ss, array: tf.less(i, self.sampleLen)
+                    #
+                    def body(i, xx, ss, array):
+                        ii = i + 1
+                        hidde_, new_ss = self._cell(xx, ss)
+                        mu = tf.nn.xw_plus_b(hidde_, W_mu, b_mu)
+                        sig = tf.nn.softplus(tf.nn.xw_plus_b(hidde_, W_sig, b_sig)) + 1e-8
+                        new_xx = tf.distributions.Normal(loc=mu, scale=tf.sqrt(sig)).sample()
+                        new_array = array.write(i, new_xx)
+                        return ii, new_xx, new_ss, new_array
 
-                gen_operator = tf.while_loop(cond, body, [i, x_, state, gen_operator])[-1]
-                self._gen_operator = gen_operator.concat()
+                    gen_operator = tf.while_loop(cond, body, [i, x_, state, gen_operator])[-1]
+                    return tf.transpose(gen_operator.stack(), [1, 0, 2])
+                self._lazy('gen', build_gen)
                 #
                 self._runSession()
 
@@ -7,6 +7,7 @@ Descriptions: Tools to build an RNN.
 
 import tensorflow as tf
 from dl4s.cores.model import _config
+from dl4s.cores.tools import feedable_state
 import numpy as np
 
 """#########################################################################
@@ -18,7 +19,7 @@ class config(_config, object):
     Elements inside the __init__ method are elements of the object.
     ----from Stackoverflow(https://stackoverflow.com/questions/9056957/correct-way-to-define-class-variables-in-python).
     """
-    unitType = 'LSTM'           # <string> the type of hidden units(LSTM/GRU/Tanh).
+    unitType = 'LSTM'           # <string> the type of hidden units(LSTM/GRU/BlockLSTM/BlockGRU/Tanh).
     dimLayer = []               # <scalar list> the size of each layers [input, hiddens, output].
 
 #
@@ -26,14 +27,18 @@ class config(_config, object):
 hidden_net: function to build the hidden layers of the RNN
 input: x - network input indicated by <tensor placeholder>. 
        Config - configuration class.
+       seqLen - the valid length of each sequence.
 output: cells - tensorflow symbol for the hidden layers of the multi-layer RNN.
         outputs.reshape - the output of last hidden layer.
         initializer - the initializer that may be used later.
+        state - the (feedable) initial state of the cells.
+        finalState - the final state of the cells.
 #########################################################################"""
 def hidden_net(
         x,
         graph,
         Config=config(),
+        seqLen=None,
 ):
     # get the number of hidden layers.
     numLayer = len(Config.dimLayer) - 2
@@ -48,11 +53,16 @@ def hidden_net(
                 layers.append(tf.nn.rnn_cell.LSTMCell(num_units=Config.dimLayer[i + 1]))
             elif Config.unitType == 'GRU':
                 layers.append(tf.nn.rnn_cell.GRUCell(num_units=Config.dimLayer[i + 1]))
+            # the fused kernels compute all the gates of a step in one op (one matmul).
+            elif Config.unitType == 'BlockLSTM':
+                layers.append(tf.contrib.rnn.LSTMBlockCell(Config.dimLayer[i + 1]))
+            elif Config.unitType == 'BlockGRU':
+                layers.append(tf.contrib.rnn.GRUBlockCell(Config.dimLayer[i + 1]))
             else:
                 layers.append(tf.nn.rnn_cell.BasicRNNCell(num_units=Config.dimLayer[i + 1]))
         cells = tf.contrib.rnn.MultiRNNCell(layers, state_is_tuple=True)
-        state = cells.zero_state(tf.shape(x)[0], Config.float)
+        state = feedable_state(cells.zero_state(tf.shape(x)[0], Config.float))
 
         #output: [batch_size, max_time, cell.output_size]
-        outputs, _ = tf.nn.dynamic_rnn(cells, x, initial_state=state)
-    return cells, outputs, initializer
+        outputs, finalState = tf.nn.dynamic_rnn(cells, x, sequence_length=seqLen, initial_state=state)
+    return cells, outputs, initializer, state, finalState
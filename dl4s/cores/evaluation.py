@@ -0,0 +1,141 @@
+"""#########################################################################
+Author: Yingru Liu
+Institute: Stony Brook University
+Descriptions: This file contains the drivers that share the evaluation of a
+              model across several CPU processes.
+#########################################################################"""
+import os
+import copy
+import shutil
+import weakref
+import tempfile
+import multiprocessing
+import numpy as np
+
+# <dict> the state of a worker process, i.e. the class and configuration of the
+#        model and, for each shard size, the model restored from the checkpoint
+#        with the version of the parameters that it holds.
+_worker = dict()
+
+"""#########################################################################
+_init_worker: the initializer of the workers, which run on CPUs only.
+input: modelClass - the class of the model.
+       config - the configuration with the checkpoint as the load path.
+output: None.
+#########################################################################"""
+def _init_worker(modelClass, config):
+    os.environ['CUDA_VISIBLE_DEVICES'] = ''
+    _worker['modelClass'] = modelClass
+    _worker['config'] = config
+    _worker['models'] = dict()
+    return
+
+"""#########################################################################
+_ais_shard: estimate the log partition function with a shard of the AIS runs.
+            The model of each shard size is rebuilt from the checkpoint once
+            per worker, and its parameters are restored again only if the
+            checkpoint has been updated since its last call.
+input: size - the number of AIS runs of the shard.
+       version - the version of the checkpoint.
+       checkpoint - the path of the checkpoint.
+       input - numerical input.
+       seqLen - the valid length of each sequence.
+output: the log partition function of the shard with shape [batch, steps] and
+        the log of the first two moments of its AIS weights.
+#########################################################################"""
+def _ais_shard(size, version, checkpoint, input, seqLen):
+    if size not in _worker['models']:
+        config = copy.copy(_worker['config'])
+        config.aisRun = size
+        model = _worker['modelClass'](config)
+        with model._graph.as_default():
+            model._build('ais')
+        _worker['models'][size] = [model, version]
+    model, restored = _worker['models'][size]
+    if restored != version:
+        model.loadModel(checkpoint)
+        _worker['models'][size][1] = version
+    with model._graph.as_default():
+        feed = {model.x: input}
+        if seqLen is not None:
+            feed[model.seqLen] = seqLen
+        return model._sess.run([model._logZ, model._aisMoments], feed_dict=feed)
+
+"""#########################################################################
+_close_pool: stop the workers and remove the checkpoint of a pool.
+input: workers - the pool of processes.
+       folder - the folder of the checkpoint.
+output: None.
+#########################################################################"""
+def _close_pool(workers, folder):
+    workers.terminate()
+    workers.join()
+    shutil.rmtree(folder, ignore_errors=True)
+    return
+
+"""#########################################################################
+_log_mean_exp: merge the log-means of the shards into the log-mean of all.
+input: values - the log-means of the shards with shape [shards, ...].
+       sizes - the number of runs of each shard.
+       scale - the values are merged as scale * logmeanexp(values / scale).
+output: the merged value with shape [...].
+#########################################################################"""
+def _log_mean_exp(values, sizes, scale=1.):
+    values = np.asarray(values) / scale
+    weights = np.reshape(np.asarray(sizes, dtype=values.dtype), [-1] + [1] * (values.ndim - 1))
+    values_max = np.max(values, axis=0)
+    r_ais = np.sum(weights * np.exp(values - values_max), axis=0) / np.sum(sizes)
+    return scale * (np.log(r_ais) + values_max)
+
+"""#########################################################################
+shardedLogZ: estimate the log partition function of the RNN-RBM/CGRNN models
+             by AIS with the runs shared by a pool of processes. The pool is
+             kept by the model and reused across batches. The runs are split
+             into one shard per process (aisRun // numThreads runs, plus one
+             for the first aisRun % numThreads shards), each worker restores
+             the checkpoint once, and the shards are merged by a weighted
+             log-mean-exp. The checkpoint is saved again only after the
+             parameters change.
+input: model - the RNN-RBM/CGRNN model.
+       input - numerical input.
+       seqLen - the valid length of each sequence.
+       numThreads - the number of processes.
+       scale - the scale of the average of AIS weights (1000 for ss-RBMs).
+output: the log partition function and the effective sample size of the AIS
+        estimate, both with shape [batch, steps].
+#########################################################################"""
+def shardedLogZ(model, input, seqLen=None, numThreads=2, scale=1.):
+    pool = model._aisPool
+    if pool is not None and pool['threads'] != numThreads:
+        pool['close']()
+        pool = None
+    if pool is None:
+        folder = tempfile.mkdtemp()
+        checkpoint = os.path.join(folder, 'model')
+        model.saveModel(checkpoint)
+        config = copy.copy(model._config)
+        config.numThreads = 1
+        config.loadPath = checkpoint
+        config.savePath = None
+        config.eventPath = None
+        # the workers are spawned so that they do not inherit the session of the model.
+        workers = multiprocessing.get_context('spawn').Pool(numThreads, initializer=_init_worker,
+                                                             initargs=(model.__class__, config))
+        pool = {'workers': workers, 'checkpoint': checkpoint, 'threads': numThreads, 'version': 0,
+                'close': weakref.finalize(model, _close_pool, workers, folder)}
+        model._aisPool = pool
+        model._evalCache['shardedLogZ'] = pool['version']
+    elif 'shardedLogZ' not in model._evalCache:
+        # the parameters have been trained or loaded since the last save.
+        pool['version'] += 1
+        model.saveModel(pool['checkpoint'])
+        model._evalCache['shardedLogZ'] = pool['version']
+    base, extra = divmod(model._aisRun, numThreads)
+    sizes = [size for size in [base + 1] * extra + [base] * (numThreads - extra) if size > 0]
+    shards = pool['workers'].starmap(_ais_shard, [(size, pool['version'], pool['checkpoint'], input, seqLen)
+                                                  for size in sizes], chunksize=1)
+    logZ = _log_mean_exp([shard[0] for shard in shards], sizes, scale)
+    logW1 = _log_mean_exp([shard[1][0] for shard in shards], sizes)
+    logW2 = _log_mean_exp([shard[1][1] for shard in shards], sizes)
+    # ESS = (sum w)^2 / sum w^2.
+    return logZ, np.sum(sizes) * np.exp(2 * logW1 - logW2)
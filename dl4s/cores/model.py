@@ -7,6 +7,8 @@ Descriptions: This file contains the abstract of configuration and model for
 import numpy as np
 import tensorflow as tf
 import time
+import json
+from dl4s.cores.tools import chunk_generator, sequence_generator
 
 """#########################################################################
 Class: _config - the hyper abstraction of model configuration.
@@ -36,31 +38,67 @@ class _model(object):
         # <tensor graph> define a default graph.
         self._graph = tf.Graph()
         with self._graph.as_default():
-            # <tensor placeholder> input.
-            self.x = tf.placeholder(dtype='float32', shape=[None, None, config.dimIN])
+            # <tf.data Iterator> reinitializable iterator that feeds the input
+            #                    inside the graph (used by the fused training).
+            self._iterator = tf.data.Iterator.from_structure(
+                tf.float32, tf.TensorShape([None, None, config.dimIN]))
+            batch = self._iterator.get_next()
+            # the auto-regressive models require a zero frame in front of the sequence.
+            class_type = self.__class__.__name__
+            if class_type == "binRNN" or class_type == "gaussRNN" or \
+                    class_type == "binSTORN" or class_type == "gaussSTORN":
+                batch = tf.pad(batch, [[0, 0], [1, 0], [0, 0]])
+            # <tensor placeholder> input (take the batch of the iterator if not fed).
+            self.x = tf.placeholder_with_default(batch, shape=[None, None, config.dimIN], name='x')
+            # <tensor> the size of the current batch.
+            self._batchSize = tf.shape(self.x)[0]
+            # <tensor placeholder> the valid length of each sequence (full length if not fed).
+            self.seqLen = tf.placeholder_with_default(tf.fill([self._batchSize], tf.shape(self.x)[1]),
+                                                      shape=[None], name='seqLen')
+            # <tensor> the mask of the valid steps with shape [batch, steps].
+            self._mask = tf.sequence_mask(self.seqLen, tf.shape(self.x)[1], dtype=tf.float32)
             # <tensor placeholder> learning rate.
             self.lr = tf.placeholder(dtype='float32', shape=(), name='learningRate')
             # <tensor placeholder> the length of generated samples.
             self.sampleLen = tf.placeholder(dtype='int32', shape=(), name='sampleLen')
+            # <tensor placeholder> the number of sequences generated in parallel.
+            self.sampleNum = tf.placeholder_with_default(1, shape=(), name='sampleNum')
 
+            # <config> the configuration to rebuild the model (e.g. in other processes).
+            self._config = config
             # <string/None> path to save the model.
             self._savePath = config.savePath
             # <string/None> path to save the events.
             self._eventPath = config.eventPath
             # <string/None> path to load the events.
             self._loadPath = config.loadPath
+            # <string/None> the checkpoint that the variables of the lazy sub-graphs are
+            #               restored from (the last one loaded by loadModel).
+            self._restorePath = config.loadPath
             # <list> collection of trainable parameters.
             self._params = []
             # <pass> will be define in the children classes.
-            self._train_step = None
-            # <pass> will be define in the children classes.
             self._loss = None
             # <pass> will be define in the children classes.
             self._outputs = None
             # <pass> will be define in the children classes.
-            self._gen_operator = None
-            # <pass> will be define in the children classes.
             self._feature = None
+            # <pass> the (feedable) initial state and the final state of the recurrent
+            #        components, will be define in the children classes.
+            self._initState = None
+            self._finalState = None
+            # <pass> the (feedable) first input and initial state of the generation,
+            #        will be define in the children classes.
+            self._genSeed = None
+            # <dict> the builders of the sub-graphs that are constructed on the first use
+            #        (e.g. 'train', 'gen', 'ais'), registered by the children classes.
+            self._builders = dict()
+            # <dict> the outputs of the sub-graphs that have been built.
+            self._built = dict()
+            # <dict> the values for evaluation that depend only on the parameters (e.g. the
+            #        checkpoint of the sharded AIS), which are kept until the parameters are
+            #        trained or loaded.
+            self._evalCache = dict()
 
             # <Tensorflow Optimizer>.
             if config.Opt == 'Adadelta':
@@ -88,8 +126,137 @@ class _model(object):
         else:
             saver = tf.train.Saver()
             saver.restore(self._sess, self._loadPath)
+        # local variables (e.g. gradient accumulators) are never saved.
+        self._sess.run(tf.local_variables_initializer())
         return
 
+    """#########################################################################
+    _lazy: register the builder of a sub-graph, which is constructed only when
+           it is used for the first time.
+    input: name - the name of the sub-graph.
+           builder - the function without input that builds the sub-graph.
+    output: None.
+    #########################################################################"""
+    def _lazy(self, name, builder):
+        self._builders[name] = builder
+        return
+
+    """#########################################################################
+    _build: construct the registered sub-graph if it has not been built. The
+            variables created by the sub-graph are restored from the last
+            loaded checkpoint if they are saved there and are initialized
+            otherwise.
+    input: name - the name of the sub-graph.
+    output: the output of the builder.
+    #########################################################################"""
+    def _build(self, name):
+        if name not in self._builders:
+            raise ValueError("The model does not support the sub-graph '%s'!" % name)
+        if name not in self._built:
+            with self._graph.as_default():
+                existing = set(var.name for var in tf.global_variables() + tf.local_variables())
+                self._built[name] = self._builders[name]()
+                newVars = [var for var in tf.global_variables() if var.name not in existing]
+                newLocals = [var for var in tf.local_variables() if var.name not in existing]
+                restoreVars = []
+                if self._restorePath is not None and newVars:
+                    reader = tf.train.NewCheckpointReader(self._restorePath)
+                    restoreVars = [var for var in newVars if reader.has_tensor(var.op.name)]
+                    newVars = [var for var in newVars if not reader.has_tensor(var.op.name)]
+                if restoreVars:
+                    tf.train.Saver(restoreVars).restore(self._sess, self._restorePath)
+                self._sess.run(tf.variables_initializer(newVars + newLocals))
+        return self._built[name]
+
+    """#########################################################################
+    _fusedNVIL: import a well-trained VAE into the graph of the model and build
+                the NVIL upper bound of the log partition function of an RBM.
+                The VAE is frozen with its current parameters and its input is
+                mapped to the input of the model, so that the proposals, their
+                free energies and the log-mean-exp are evaluated by one run.
+    input: VAE - the well-trained VAE(SRNN/VRNN).
+           outputs - the samples X, logPz_X, logPx_Z, logPz built in the VAE.
+           freeEnergy - the free energy function of the RBM.
+           runs - if given, the input is replicated for the runs (for VAEs that
+                  draw one sample per sequence).
+           scale - the runs are merged as scale * logmeanexp(logTerm / scale).
+    output: the upper bound of logZ with shape [batch, steps].
+    #########################################################################"""
+    def _fusedNVIL(self, VAE, outputs, freeEnergy, runs=None, scale=1.):
+        graph_def = tf.graph_util.convert_variables_to_constants(
+            VAE._sess, VAE._graph.as_graph_def(), [tensor.op.name for tensor in outputs])
+        input = self.x if runs is None else tf.tile(self.x, [runs, 1, 1])
+        outputs = tf.import_graph_def(graph_def, input_map={VAE.x.name: input},
+                                      return_elements=[tensor.name for tensor in outputs], name='VAE')
+        if runs is not None:
+            # shape = [runs, batch, ...]
+            outputs = [tf.reshape(tensor, tf.concat([[runs, -1], tf.shape(tensor)[1:]], axis=0))
+                       for tensor in outputs]
+        # the same as np.nan_to_num, i.e. NaN -> 0 and +/-inf -> the finite float32 bounds.
+        X, logPz_X, logPx_Z, logPz = [outputs[0]] + [
+            tf.where(tf.is_nan(tensor), tf.zeros_like(tensor),
+                     tf.clip_by_value(tensor, np.finfo(np.float32).min, np.finfo(np.float32).max))
+            for tensor in outputs[1:]]
+        logTerm = tf.cast(2 * (-freeEnergy(X) + logPz_X - logPx_Z - logPz), tf.float64) / scale
+        numRuns = tf.cast(tf.shape(logTerm)[0], tf.float64)
+        logZ = 0.5 * scale * (tf.reduce_logsumexp(logTerm, axis=0) - tf.log(numRuns))
+        return tf.cast(logZ, tf.float32)
+
+    """#########################################################################
+    _iwae: build the importance-weighted bound of the log-likelihood. The K
+           posterior samples of each sequence are drawn as an extra batch
+           dimension, i.e. the input is replicated K times along the batch.
+    input: logW - the log importance weights of the steps with shape
+                  [K * batch, steps].
+           mask - the mask of the valid steps with shape [K * batch, steps].
+    output: the log-sum-exp of the weights over the samples with shape [batch]
+            and the number of valid steps of the batch.
+    #########################################################################"""
+    def _iwae(self, logW, mask):
+        # <tensor placeholder> the number of samples replicated in the batch.
+        self.iwaeK = tf.placeholder(dtype='int32', shape=(), name='iwaeK')
+        logW = tf.reshape(tf.reduce_sum(logW * mask, axis=-1), [self.iwaeK, -1])
+        return tf.reduce_logsumexp(logW, axis=0), tf.reduce_sum(mask) / tf.cast(self.iwaeK, tf.float32)
+
+    """#########################################################################
+    _minimize: build the update operator of the loss. The operators to
+               accumulate the gradients over several micro-batches and to
+               apply them once are registered as the sub-graph 'accumulate',
+               which is built only when it is used.
+    input: Loss - the loss to be minimized.
+    output: train_step - the operator to update the parameters.
+    #########################################################################"""
+    def _minimize(self, Loss):
+        gradsVars = [(grad, var) for grad, var in self._optimizer.compute_gradients(Loss) if grad is not None]
+        train_step = self._optimizer.apply_gradients(gradsVars)
+        self._lazy('accumulate', lambda: self._accumulation(gradsVars))
+        return train_step
+
+    """#########################################################################
+    _accumulation: build the operators of the gradient accumulation.
+    input: gradsVars - the list of (gradient, variable) of the loss.
+    output: accum_step - the operator to add the gradients of the current
+                         micro-batch.
+            apply_step - the operator to apply the averaged gradients once.
+            zero_step - the operator to reset the accumulators.
+    #########################################################################"""
+    def _accumulation(self, gradsVars):
+        with tf.name_scope('accumulation'):
+            # the gradients of each micro-batch are weighted by its batch size.
+            weight = tf.cast(self._batchSize, tf.float32)
+            counter = tf.Variable(0.0, trainable=False, name='counter',
+                                  collections=[tf.GraphKeys.LOCAL_VARIABLES])
+            accums = [tf.Variable(tf.zeros(var.shape, dtype=var.dtype.base_dtype), trainable=False,
+                                  collections=[tf.GraphKeys.LOCAL_VARIABLES]) for _, var in gradsVars]
+            accum_step = tf.group(
+                [tf.assign_add(acc, weight * tf.convert_to_tensor(grad)) for acc, (grad, _) in zip(accums, gradsVars)]
+                + [tf.assign_add(counter, weight)])
+            apply_step = self._optimizer.apply_gradients(
+                [(acc / tf.maximum(counter, 1.0), var) for acc, (_, var) in zip(accums, gradsVars)])
+            zero_step = tf.group([tf.assign(acc, tf.zeros_like(acc)) for acc in accums]
+                                 + [tf.assign(counter, 0.0)])
+        return accum_step, apply_step, zero_step
+
     """#########################################################################
     saveModel:save the trained model into disk.
     input: model - the model.
@@ -108,25 +275,35 @@ class _model(object):
         return
 
     """#########################################################################
-    loadModel:load the model from disk.
+    loadModel:load the model from disk. The variables that are not saved in the
+              checkpoint keep their values and are reported.
     input: model - the model.
            loadPath - another loading path, if not provide, use the default path.
     output: None
     #########################################################################"""
     def loadModel(self, loadPath=None):
-        try:
-            with self._graph.as_default():
-                # Create a saver.
-                saver = tf.train.Saver()
-                if loadPath is None:
-                    if self._loadPath is not None:
-                        saver.restore(self._sess, self._loadPath)
-                    else:
-                        raise (ValueError("No loadPath is given!"))
-                else:
-                    saver.restore(self._sess, loadPath)
-        except:
+        # the cached values of the old parameters are out of date.
+        self._evalCache.clear()
+        if loadPath is None:
+            loadPath = self._loadPath
+        if loadPath is None:
             print("\x1b[1;91mNo saved model is given. Initiate the model randomly...\x1b[0m")
+            return
+        with self._graph.as_default():
+            try:
+                reader = tf.train.NewCheckpointReader(loadPath)
+            except tf.errors.NotFoundError:
+                print("\x1b[1;91mNo saved model is found in %s. Keep the current model...\x1b[0m" % loadPath)
+                return
+            restoreVars = [var for var in tf.global_variables() if reader.has_tensor(var.op.name)]
+            missing = [var.op.name for var in tf.global_variables() if not reader.has_tensor(var.op.name)]
+            if restoreVars:
+                tf.train.Saver(restoreVars).restore(self._sess, loadPath)
+            if missing:
+                print("\x1b[1;91mThe variables are not saved in %s and keep their values: %s\x1b[0m"
+                      % (loadPath, ', '.join(missing)))
+        # the sub-graphs built later are restored from the same checkpoint.
+        self._restorePath = loadPath
         return
 
     """#########################################################################
@@ -167,6 +344,40 @@ class _model(object):
             print("\x1b[1;91mNo path is provided to save events. continue the program...\x1b[0m")
         return
 
+    """#########################################################################
+    freezeModel: export the inference part of the model (reconstruction,
+                 feature extraction and generation) with its current weights
+                 as a frozen graph. The graph is saved as freezePath.pb and
+                 the names of the tensors are saved as freezePath.json. The
+                 artifact is loaded by frozenModel without rebuilding the
+                 training graph.
+    input: freezePath - the path (without extension) of the frozen model.
+    output: None
+    #########################################################################"""
+    def freezeModel(self, freezePath):
+        with self._graph.as_default():
+            class_type = self.__class__.__name__
+            tensors = {'x': self.x, 'seqLen': self.seqLen, 'sampleLen': self.sampleLen, 'sampleNum': self.sampleNum,
+                       'outputs': self._outputs, 'feature': self._feature}
+            if 'gen' in self._builders:
+                tensors['gen'] = self._build('gen')
+            if hasattr(self, '_sparse_feature'):
+                tensors['sparse_feature'] = self._sparse_feature
+            tensors = {key: value for key, value in tensors.items() if isinstance(value, tf.Tensor)}
+            outputNodes = [tensors[key].op.name for key in tensors
+                           if key not in ['x', 'seqLen', 'sampleLen', 'sampleNum']]
+            graph_def = tf.graph_util.convert_variables_to_constants(
+                self._sess, self._graph.as_graph_def(), outputNodes)
+            with tf.gfile.GFile(freezePath + '.pb', 'wb') as f:
+                f.write(graph_def.SerializeToString())
+            meta = {'class': class_type, 'dimIN': int(self.x.shape[-1]),
+                    'padding': class_type == "binRNN" or class_type == "gaussRNN" or
+                               class_type == "binSTORN" or class_type == "gaussSTORN",
+                    'tensors': {key: value.name for key, value in tensors.items()}}
+            with open(freezePath + '.json', 'w') as f:
+                json.dump(meta, f, indent=2)
+        return
+
     # TODO: I don't test the impaint function exactly.
     # TODO: Also, both impaint() and reconstruct() use noise-free output.
     """#########################################################################
@@ -221,17 +432,78 @@ class _model(object):
                 return self._sess.run(self._feature, feed_dict={self.x: input})
 
     # TODO: define a Gibbs_generate() for RNN-RBM and CGRNN.
+    """#########################################################################
+    prime: encode the prefixes once to continue them by generate(). The
+           recurrent state is computed over all but the last frame, which is
+           the first input of the generation.
+    input: prefix - the prefix with shape [steps, dimIN] or [batch, steps, dimIN].
+    output: primer - the last frames and the recurrent state of the prefixes.
+    #########################################################################"""
+    def prime(self, prefix):
+        if len(prefix.shape) == 2:
+            prefix = prefix.reshape([-1, prefix.shape[0], prefix.shape[1]])
+        with self._graph.as_default():
+            if 'gen' in self._builders:
+                self._build('gen')
+            if self._finalState is None or self._genSeed is None:
+                raise ValueError("The model does not support the primed generation!")
+            class_type = self.__class__.__name__
+            input = prefix[:, 0:-1, :]
+            if class_type == "binRNN" or class_type == "gaussRNN" or \
+                class_type == "binSTORN" or class_type == "gaussSTORN":
+                zero_padd = np.zeros(shape=(input.shape[0], 1, input.shape[2]), dtype='float32')
+                input = np.concatenate((zero_padd, input), axis=1)
+            # a prefix of a single frame starts from the zero state.
+            state = self._finalState if input.shape[1] > 0 else self._initState
+            state = self._sess.run(state, feed_dict={self.x: input})
+        return prefix[:, -1, :], state
+
     """#########################################################################
     generate: generate sample sequence with the length as numSteps.
+    input: numSteps - the length of the sequences.
+           numSamples - the number of independent sequences sampled in parallel.
+                        With a primer, each prefix is continued numSamples times.
+           primer - the output of prime() to continue the prefixes.
+    output: the samples with shape [numSteps, dimIN] for a single sequence if
+            numSamples is None, otherwise [numSamples(*batch), numSteps, dimIN].
     #########################################################################"""
-    def generate(self, numSteps):
+    def generate(self, numSteps, numSamples=None, primer=None):
+        nest = tf.contrib.framework.nest
         with self._graph.as_default():
-            return self._sess.run(self._gen_operator, feed_dict={self.sampleLen: numSteps})
+            gen_operator = self._build('gen')
+            feed_dict = {self.sampleLen: numSteps}
+            if numSamples is not None:
+                feed_dict[self.sampleNum] = numSamples
+            if primer is not None:
+                if self._genSeed is None:
+                    raise ValueError("The model does not support the primed generation!")
+                # the encoded prefixes are repeated instead of running them again.
+                repeat = 1 if numSamples is None else numSamples
+                frame, state = primer
+                feed_dict[self.sampleNum] = frame.shape[0] * repeat
+                feed_dict[self._genSeed[0]] = np.repeat(frame, repeat, axis=0)
+                feed_dict.update(zip(nest.flatten(self._genSeed[1]),
+                                     [np.repeat(s, repeat, axis=0) for s in nest.flatten(state)]))
+            samples = self._sess.run(gen_operator, feed_dict=feed_dict)
+        if numSamples is None and samples.shape[0] == 1:
+            return samples[0]
+        return samples
+
+    """#########################################################################
+    stream: open a stateful session to infer the frames one by one.
+    input: None.
+    output: the streamSession of the model.
+    #########################################################################"""
+    def stream(self):
+        return streamSession(self)
 
     """#########################################################################
     train_function: compute the loss and update the tensor variables.
     input: input - numerical input.
            lrate - <scalar> learning rate.
+           seqLen - (kwargs) the valid length of each sequence in the batch
+                    (the padded steps are masked out of the loss).
+           gibbs - (kwargs) the steps of Gibbs sampling (RNN-RBM/CGRNN only).
     output: the loss value.
     #########################################################################"""
     def train_function(self, input, lrate, *args, **kwargs):
@@ -242,13 +514,20 @@ class _model(object):
                 zero_padd = np.zeros(shape=(input.shape[0], 1, input.shape[2]), dtype='float32')
                 input = np.concatenate((zero_padd, input), axis=1)
             #
-            _, loss_value = self._sess.run([self._train_step, self._loss],
-                                           feed_dict={self.x: input, self.lr: lrate})
+            feed_dict = {self.x: input, self.lr: lrate}
+            if kwargs.get('seqLen') is not None:
+                feed_dict[self.seqLen] = kwargs['seqLen']
+            if kwargs.get('gibbs') is not None:
+                feed_dict[self.gibbs] = kwargs['gibbs']
+            self._evalCache.clear()
+            _, loss_value = self._sess.run([self._build('train'), self._loss], feed_dict=feed_dict)
         return loss_value * input.shape[-1]
 
     """#########################################################################
     val_function: compute the loss with given input.
     input: input - numerical input.
+           seqLen - (kwargs) the valid length of each sequence in the batch.
+           gibbs - (kwargs) the steps of Gibbs sampling (RNN-RBM/CGRNN only).
     output: the loss value.
     #########################################################################"""
     def val_function(self, input, *args, **kwargs):
@@ -258,9 +537,235 @@ class _model(object):
                 class_type == "binSTORN" or class_type == "gaussSTORN":
                 zero_padd = np.zeros(shape=(input.shape[0], 1, input.shape[2]), dtype='float32')
                 input = np.concatenate((zero_padd, input), axis=1)
-            loss_value = self._sess.run(self._loss, feed_dict={self.x: input})
+            feed_dict = {self.x: input}
+            if kwargs.get('seqLen') is not None:
+                feed_dict[self.seqLen] = kwargs['seqLen']
+            if kwargs.get('gibbs') is not None:
+                feed_dict[self.gibbs] = kwargs['gibbs']
+            loss_value = self._sess.run(self._loss, feed_dict=feed_dict)
+        return loss_value * input.shape[-1]
+
+    """#########################################################################
+    iwae_function: compute the importance-weighted bound of the negative
+                   log-likelihood (per frame) with K posterior samples of each
+                   sequence (SeqVAE only). The samples are drawn in one run as
+                   an extra batch dimension, in chunks of samples if the memory
+                   is limited, and merged by log-mean-exp.
+    input: input - numerical input.
+           K - the number of posterior samples of each sequence.
+           chunk - the number of samples drawn per run (None for all K).
+           seqLen - (kwargs) the valid length of each sequence in the batch.
+    output: the bound of the negative log-likelihood.
+    #########################################################################"""
+    def iwae_function(self, input, K, chunk=None, *args, **kwargs):
+        with self._graph.as_default():
+            logSum, frames = self._build('iwae')
+            class_type = self.__class__.__name__
+            if class_type == "binSTORN" or class_type == "gaussSTORN":
+                zero_padd = np.zeros(shape=(input.shape[0], 1, input.shape[2]), dtype='float32')
+                input = np.concatenate((zero_padd, input), axis=1)
+            chunk = K if chunk is None else min(chunk, K)
+            logLike = -np.inf
+            for start in range(0, K, chunk):
+                size = min(chunk, K - start)
+                feed_dict = {self.x: np.tile(input, [size, 1, 1]), self.iwaeK: size}
+                if kwargs.get('seqLen') is not None:
+                    feed_dict[self.seqLen] = np.tile(kwargs['seqLen'], size)
+                logSum_value, frames_value = self._sess.run([logSum, frames], feed_dict=feed_dict)
+                logLike = np.logaddexp(logLike, logSum_value)
+        return -np.sum(logLike - np.log(K)) / frames_value
+
+    """#########################################################################
+    tbptt_function: truncated back-propagation through time. The long sequences
+                    are split into consecutive windows and the state of the
+                    recurrent components is carried from one window to the next.
+    input: input - numerical input with long sequences [batch, steps, frame].
+           lrate - <scalar> learning rate.
+           window - the number of steps per window.
+    output: the loss value.
+    #########################################################################"""
+    def tbptt_function(self, input, lrate, window, *args, **kwargs):
+        if self._initState is None:
+            raise ValueError("The model does not support the stateful training!")
+        nest = tf.contrib.framework.nest
+        with self._graph.as_default():
+            class_type = self.__class__.__name__
+            padding = class_type == "binRNN" or class_type == "gaussRNN" or \
+                class_type == "binSTORN" or class_type == "gaussSTORN"
+            seqLen = kwargs.get('seqLen')
+            if seqLen is None:
+                seqLen = np.full(input.shape[0], input.shape[1], dtype='int32')
+            loss_value = 0.0
+            state = None
+            self._evalCache.clear()
+            last = np.zeros(shape=(input.shape[0], 1, input.shape[2]), dtype='float32')
+            for start in range(0, input.shape[1], window):
+                x = input[:, start:start + window, :]
+                feed_dict = {self.lr: lrate, self.seqLen: np.clip(seqLen - start, 0, x.shape[1])}
+                if padding:
+                    # the last frame of the previous window is the first input of the current window.
+                    feed_dict[self.x] = np.concatenate((last, x), axis=1)
+                    last = x[:, -1:, :]
+                else:
+                    feed_dict[self.x] = x
+                if state is not None:
+                    feed_dict.update(zip(nest.flatten(self._initState), nest.flatten(state)))
+                _, loss_window, state = self._sess.run([self._build('train'), self._loss, self._finalState],
+                                                       feed_dict=feed_dict)
+                loss_value += loss_window * x.shape[1] / input.shape[1]
+        return loss_value * input.shape[-1]
+
+    """#########################################################################
+    accumulate_function: split a large batch into micro-batches, accumulate
+                         their gradients and update the variables once.
+    input: input - numerical input.
+           lrate - <scalar> learning rate.
+           numMicro - the number of micro-batches.
+    output: the loss value.
+    #########################################################################"""
+    def accumulate_function(self, input, lrate, numMicro, *args, **kwargs):
+        with self._graph.as_default():
+            class_type = self.__class__.__name__
+            if class_type == "binRNN" or class_type == "gaussRNN" or \
+                class_type == "binSTORN" or class_type == "gaussSTORN":
+                zero_padd = np.zeros(shape=(input.shape[0], 1, input.shape[2]), dtype='float32')
+                input = np.concatenate((zero_padd, input), axis=1)
+            #
+            seqLen = kwargs.get('seqLen')
+            loss_value = 0.0
+            # the accumulation is registered together with the update operator.
+            self._build('train')
+            accum_step, apply_step, zero_step = self._build('accumulate')
+            self._sess.run(zero_step)
+            for micro in np.array_split(np.arange(input.shape[0]), numMicro):
+                if len(micro) == 0:
+                    continue
+                feed_dict = {self.x: input[micro]}
+                if seqLen is not None:
+                    feed_dict[self.seqLen] = seqLen[micro]
+                _, loss_micro = self._sess.run([accum_step, self._loss], feed_dict=feed_dict)
+                loss_value += loss_micro * len(micro) / input.shape[0]
+            self._sess.run(apply_step, feed_dict={self.lr: lrate})
+            self._evalCache.clear()
         return loss_value * input.shape[-1]
 
+    """#########################################################################
+    fused_train_function: update the tensor variables with the batch drawn
+                          from the in-graph iterator (no feeding of input).
+    input: lrate - <scalar> learning rate.
+    output: the loss value and the size of the batch.
+    #########################################################################"""
+    def fused_train_function(self, lrate, *args, **kwargs):
+        with self._graph.as_default():
+            self._evalCache.clear()
+            _, loss_value, batchSize = self._sess.run([self._build('train'), self._loss, self._batchSize],
+                                                      feed_dict={self.lr: lrate})
+        return loss_value * int(self.x.shape[-1]), batchSize
+
+    """#########################################################################
+    fused_val_function: compute the loss with the batch drawn from the in-graph
+                        iterator.
+    input: None.
+    output: the loss value and the size of the batch.
+    #########################################################################"""
+    def fused_val_function(self, *args, **kwargs):
+        with self._graph.as_default():
+            loss_value, batchSize = self._sess.run([self._loss, self._batchSize])
+        return loss_value * int(self.x.shape[-1]), batchSize
+
+    """#########################################################################
+    _input_pipeline: build the tf.data pipeline to iterate one data split.
+    input: data - the numerical data or h5py dataset with shape [N, T, dimIN].
+           batchSize - the batch size.
+           shuffle - bool indicating whether shuffle the data.
+           streaming - if True, the samples are read chunk by chunk from the
+                       data (e.g. h5py dataset) with a bounded buffer instead
+                       of loading the whole split into the graph.
+           bufferSize - the size of the shuffle buffer (and of the chunks read
+                        from the disk) in streaming mode.
+           fused - if True, the pipeline is bound to the in-graph iterator of
+                   the model so that the batches feed self.x directly.
+           buckets - the boundaries of the sequence lengths used to bucket the
+                     sequences when the data is a list of sequences with various
+                     lengths. If None, the deciles of the lengths are used.
+    output: initializer - the operator to initialize the iterator.
+            next_batch - the tensor of the next batch (None if fused). For the
+                         bucketed data, it's the tuple (batch, lengths).
+            feed - the feed dict used to initialize the iterator.
+    #########################################################################"""
+    def _input_pipeline(self, data, batchSize, shuffle=False, streaming=False, bufferSize=10000, fused=False,
+                        buckets=None):
+        with self._graph.as_default():
+            if isinstance(data, (list, tuple)):
+                if fused:
+                    raise ValueError("The sequences with various lengths are not supported in the fused mode!")
+                if buckets is None:
+                    lengths = [len(seq) for seq in data]
+                    buckets = np.unique(np.percentile(lengths, np.arange(10, 100, 10)).astype('int64')).tolist()
+                Data = tf.data.Dataset.from_generator(sequence_generator(data, shuffle), (tf.float32, tf.int32),
+                                                      (tf.TensorShape([None, self.x.shape[-1]]), tf.TensorShape([])))
+                Data = Data.apply(tf.contrib.data.bucket_by_sequence_length(
+                    element_length_func=lambda seq, length: length,
+                    bucket_boundaries=[b + 1 for b in buckets],
+                    bucket_batch_sizes=[batchSize] * (len(buckets) + 1))).prefetch(1)
+                feed = {}
+            elif streaming:
+                generator = chunk_generator(data, chunkSize=bufferSize, shuffle=shuffle)
+                Data = tf.data.Dataset.from_generator(generator, tf.float32, tf.TensorShape(data.shape[1:]))
+                if shuffle:
+                    Data = Data.shuffle(bufferSize)
+                Data = Data.batch(batchSize).prefetch(1)
+                feed = {}
+            else:
+                data_placeholder = tf.placeholder(data.dtype, data.shape)
+                Data = tf.data.Dataset.from_tensor_slices(data_placeholder)
+                if shuffle:
+                    Data = Data.shuffle(10000).batch(batchSize).shuffle(10000)
+                else:
+                    Data = Data.batch(batchSize)
+                if data.dtype != np.float32:
+                    Data = Data.map(lambda x: tf.cast(x, tf.float32))
+                feed = {data_placeholder: data}
+            if fused:
+                initializer = self._iterator.make_initializer(Data.prefetch(1))
+                next_batch = None
+            else:
+                iterator = Data.make_initializable_iterator()
+                initializer = iterator.initializer
+                next_batch = iterator.get_next()
+        return initializer, next_batch, feed
+
+    """#########################################################################
+    _run_epoch: run the function over all the batches of a data split.
+    input: initializer - the operator to initialize the iterator.
+           next_batch - the tensor of the next batch. If None, the function
+                        draws the batch from the in-graph iterator itself and
+                        returns the loss with the batch size (fused mode).
+           feed - the feed dict used to initialize the iterator.
+           function - the function applied to each batch (train/val function).
+           args - the additional arguments of the function.
+    output: the average loss over the split.
+    #########################################################################"""
+    def _run_epoch(self, initializer, next_batch, feed, function, *args):
+        Loss = []
+        numSample = 0
+        self._sess.run(initializer, feed_dict=feed)
+        while True:
+            try:
+                if next_batch is None:
+                    loss_value, batchSize = function(*args)
+                elif isinstance(next_batch, tuple):
+                    x, length = self._sess.run(next_batch)
+                    loss_value, batchSize = function(x, *args, seqLen=length), x.shape[0]
+                else:
+                    x = self._sess.run(next_batch)
+                    loss_value, batchSize = function(x, *args), x.shape[0]
+                Loss.append(batchSize * loss_value)
+                numSample += batchSize
+            except tf.errors.OutOfRangeError:
+                break
+        return np.asarray(Loss).sum() / numSample
+
     """#########################################################################
     full_train: define to fully train a model given the dataset.
     input: model - the model.
@@ -273,62 +778,58 @@ class _model(object):
            saveto - the additional save path that may be different from
                     the default to save the history loss during training.
            valid_batchSize - the batch size for validation and testing.
+           streaming - (kwargs) if True, stream the splits from the disk
+                       (e.g. the h5py datasets) chunk by chunk.
+           bufferSize - (kwargs) the shuffle/prefetch buffer in streaming mode.
+           fused - (kwargs) if True, the batches feed the graph through the
+                   in-graph iterator and each step is one session call.
+           numMicro - (kwargs) if given, each training batch is split into
+                      numMicro micro-batches whose gradients are accumulated
+                      before one update (large-batch mode).
+           window - (kwargs) if given, the sequences are trained by truncated
+                    BPTT with windows of this length (see tbptt_function).
+           buckets - (kwargs) the boundaries of lengths to bucket the splits
+                     given as lists of sequences with various lengths.
     output: None.
     #########################################################################"""
     def full_train(self, dataset, maxEpoch, batchSize, earlyStop,
                    learning_rate, saveto, valid_batchSize=1, *args, **kwargs):
-        with self._graph.as_default():
-            # define the tf.data.Dataset object.
-            trainData_placeholder = tf.placeholder(dataset['train'].dtype, dataset['train'].shape)
-            trainData = tf.data.Dataset.from_tensor_slices(trainData_placeholder).shuffle(10000)
-            trainData = trainData.batch(batchSize).shuffle(10000)
-            train_iterator = trainData.make_initializable_iterator()
-            next_train_batch = train_iterator.get_next()
-            #
-            validData_placeholder = tf.placeholder(dataset['valid'].dtype, dataset['valid'].shape)
-            validData = tf.data.Dataset.from_tensor_slices(validData_placeholder)
-            validData = validData.batch(valid_batchSize)
-            valid_iterator = validData.make_initializable_iterator()
-            next_valid_batch = valid_iterator.get_next()
-            #
-            testData_placeholder = tf.placeholder(dataset['test'].dtype, dataset['test'].shape)
-            testData = tf.data.Dataset.from_tensor_slices(testData_placeholder)
-            testData = testData.batch(valid_batchSize)
-            test_iterator = testData.make_initializable_iterator()
-            next_test_batch = test_iterator.get_next()
+        streaming = kwargs.get('streaming', False)
+        bufferSize = kwargs.get('bufferSize', 10000)
+        fused = kwargs.get('fused', False)
+        numMicro = kwargs.get('numMicro', None)
+        train_function = self.fused_train_function if fused else self.train_function
+        if numMicro is not None:
+            if fused:
+                raise ValueError("The gradient accumulation (numMicro) is not supported in the fused mode!")
+            train_function = lambda x, lrate, **kw: self.accumulate_function(x, lrate, numMicro, **kw)
+        window = kwargs.get('window', None)
+        if window is not None:
+            if fused or numMicro is not None:
+                raise ValueError("The truncated BPTT (window) is not supported with fused/numMicro!")
+            train_function = lambda x, lrate, **kw: self.tbptt_function(x, lrate, window, **kw)
+        val_function = self.fused_val_function if fused else self.val_function
+        # define the tf.data.Dataset object.
+        buckets = kwargs.get('buckets', None)
+        trainPipe = self._input_pipeline(dataset['train'], batchSize, True, streaming, bufferSize, fused, buckets)
+        validPipe = self._input_pipeline(dataset['valid'], valid_batchSize, False, streaming, bufferSize, fused, buckets)
+        testPipe = self._input_pipeline(dataset['test'], valid_batchSize, False, streaming, bufferSize, fused, buckets)
 
         historyLoss = []  # <list> record the training process.
         durations = []  # <list> record the training duration.
         worseCase = 0  # indicate the worse cases for early stopping
         bestEpoch = -1
 
-        # Issue: the idx should be a list. Hence, .tolist() is required.
         for epoch in range(maxEpoch):
             start_time = time.time()  # the start time of epoch.
             # update the model w.r.t the training set and record the average loss.
-            trainLoss = []
-            self._sess.run(train_iterator.initializer, feed_dict={trainData_placeholder: dataset['train']})
-            while True:
-                try:
-                    x = self._sess.run(next_train_batch)
-                    trainLoss.append(x.shape[0] * self.train_function(x, learning_rate))
-                except tf.errors.OutOfRangeError:
-                    break
-            trainLoss_avg = np.asarray(trainLoss).sum() / len(dataset['train'])
+            trainLoss_avg = self._run_epoch(*trainPipe, train_function, learning_rate)
 
             duration = time.time() - start_time  # the duration of one epoch.
             durations.append(duration)
 
             # evaluate the model w.r.t the valid set and record the average loss.
-            validLoss = []
-            self._sess.run(valid_iterator.initializer, feed_dict={validData_placeholder: dataset['valid']})
-            while True:
-                try:
-                    x = self._sess.run(next_valid_batch)
-                    validLoss.append(x.shape[0] * self.val_function(x))
-                except tf.errors.OutOfRangeError:
-                    break
-            validLoss_avg = np.asarray(validLoss).sum() / len(dataset['valid'])
+            validLoss_avg = self._run_epoch(*validPipe, val_function)
             print("In epoch \x1b[1;32m%4d\x1b[0m: the training loss is "
                   "\x1b[1;32m%10.4f\x1b[0m; the valid loss is \x1b[1;32m%10.4f\x1b[0m." % (
                       epoch, trainLoss_avg, validLoss_avg))
@@ -353,35 +854,9 @@ class _model(object):
         if self._savePath is not None:
             self.loadModel(self._savePath)
             #
-            trainLoss = []
-            self._sess.run(train_iterator.initializer, feed_dict={trainData_placeholder: dataset['train']})
-            while True:
-                try:
-                    x = self._sess.run(next_train_batch)
-                    trainLoss.append(x.shape[0] * self.val_function(x))
-                except tf.errors.OutOfRangeError:
-                    break
-            trainLoss_avg = np.asarray(trainLoss).sum() / len(dataset['train'])
-            #
-            validLoss = []
-            self._sess.run(valid_iterator.initializer, feed_dict={validData_placeholder: dataset['valid']})
-            while True:
-                try:
-                    x = self._sess.run(next_valid_batch)
-                    validLoss.append(x.shape[0] * self.val_function(x))
-                except tf.errors.OutOfRangeError:
-                    break
-            validLoss_avg = np.asarray(validLoss).sum() / len(dataset['valid'])
-
-            testLoss = []
-            self._sess.run(test_iterator.initializer, feed_dict={testData_placeholder: dataset['test']})
-            while True:
-                try:
-                    x = self._sess.run(next_test_batch)
-                    testLoss.append(x.shape[0] * self.val_function(x))
-                except tf.errors.OutOfRangeError:
-                    break
-            testLoss_avg = np.asarray(testLoss).sum() / len(dataset['test'])
+            trainLoss_avg = self._run_epoch(*trainPipe, val_function)
+            validLoss_avg = self._run_epoch(*validPipe, val_function)
+            testLoss_avg = self._run_epoch(*testPipe, val_function)
 
             # evaluate the model w.r.t the valid set and record the average loss.
             print("BEST MODEL from epoch \x1b[1;91m%4d\x1b[0m with training loss"
@@ -398,24 +873,164 @@ class _model(object):
     input: model - the model.
            testSet - the test set.
            test_batchSize - batch size for test.
+           streaming - (kwargs) if True, stream the test set from the disk.
     output: testLoss_avg - the average loss under the test set.
     #########################################################################"""
     def full_evaluate(self, testSet, test_batchSize=125, *args, **kwargs):
         # define the tf.dataset to iterate the data.
-        with self._graph.as_default():
-            testData_placeholder = tf.placeholder(testSet.dtype, testSet.shape)
-            testData = tf.data.Dataset.from_tensor_slices(testData_placeholder)
-            testData = testData.batch(test_batchSize)
-            test_iterator = testData.make_initializable_iterator()
-            next_test_batch = test_iterator.get_next()
+        testPipe = self._input_pipeline(testSet, test_batchSize, False,
+                                        kwargs.get('streaming', False), kwargs.get('bufferSize', 10000))
         # compute the average loss on test set.
-        testLoss = []
-        self._sess.run(test_iterator.initializer, feed_dict={testData_placeholder: testSet})
-        while True:
-            try:
-                x = self._sess.run(next_test_batch)
-                testLoss.append(x.shape[0] * self.val_function(x))
-            except tf.errors.OutOfRangeError:
-                break
-        testLoss_avg = np.asarray(testLoss).sum() / len(testSet)
-        return testLoss_avg
\ No newline at end of file
+        testLoss_avg = self._run_epoch(*testPipe, self.val_function)
+        return testLoss_avg
+
+"""#########################################################################
+Class: streamSession - the stateful inference that consumes one frame per
+                       call. The state of the recurrent components is kept
+                       between the calls, so each frame runs a single step of
+                       the cells instead of the whole history. For the auto-
+                       regressive models, the outputs are the prediction of
+                       the next frame.
+#########################################################################"""
+class streamSession(object):
+    """#########################################################################
+    __init__:the initialization function.
+    input: model - the model built by the children classes of _model.
+    output: None.
+    #########################################################################"""
+    def __init__(self, model):
+        class_type = model.__class__.__name__
+        # the outputs of STORN are defined only up to the second-to-last frame.
+        if model._initState is None or class_type == "binSTORN" or class_type == "gaussSTORN":
+            raise ValueError("The model does not support the streaming inference!")
+        nest = tf.contrib.framework.nest
+        self._model = model
+        self._padding = class_type == "binRNN" or class_type == "gaussRNN"
+        # <list> the flatten feedable initial state of the model.
+        self._initState = nest.flatten(model._initState)
+        # <dict> the tensors to be evaluated per frame.
+        self._fetches = {'state': model._finalState}
+        if isinstance(model._outputs, tf.Tensor):
+            self._fetches['outputs'] = model._outputs
+        if isinstance(model._feature, tf.Tensor):
+            self._fetches['feature'] = model._feature
+        self.reset()
+
+    """#########################################################################
+    reset: start a new stream from the zero state.
+    input: None.
+    output: None.
+    #########################################################################"""
+    def reset(self):
+        self._state = None
+        return
+
+    """#########################################################################
+    step: infer the current frame.
+    input: frame - the current frame with shape [dimIN] or [batch, dimIN].
+    output: results - the dict of the outputs and feature of the frame.
+    #########################################################################"""
+    def step(self, frame):
+        nest = tf.contrib.framework.nest
+        frame = np.asarray(frame, dtype='float32')
+        single = len(frame.shape) == 1
+        if single:
+            frame = frame.reshape([1, -1])
+        input = frame[:, None, :]
+        if self._state is None and self._padding:
+            zero_padd = np.zeros(shape=(input.shape[0], 1, input.shape[2]), dtype='float32')
+            input = np.concatenate((zero_padd, input), axis=1)
+        feed_dict = {self._model.x: input}
+        if self._state is not None:
+            feed_dict.update(zip(self._initState, nest.flatten(self._state)))
+        with self._model._graph.as_default():
+            results = self._model._sess.run(self._fetches, feed_dict=feed_dict)
+        self._state = results.pop('state')
+        results = {key: value[:, -1] for key, value in results.items()}
+        if single:
+            results = {key: value[0] for key, value in results.items()}
+        return results
+
+"""#########################################################################
+Class: frozenModel - the inference-only model loaded from the artifact
+                     exported by _model.freezeModel(). No training graph
+                     is rebuilt, so it is suitable for the generation and
+                     reconstruction jobs.
+#########################################################################"""
+class frozenModel(object):
+    """#########################################################################
+    __init__:the initialization function.
+    input: freezePath - the path (without extension) of the frozen model.
+    output: None.
+    #########################################################################"""
+    def __init__(self, freezePath):
+        with open(freezePath + '.json', 'r') as f:
+            self._meta = json.load(f)
+        graph_def = tf.GraphDef()
+        with tf.gfile.GFile(freezePath + '.pb', 'rb') as f:
+            graph_def.ParseFromString(f.read())
+        # <tensor graph> the imported frozen graph.
+        self._graph = tf.Graph()
+        with self._graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+            # <dict> the tensors of the inference part.
+            self._tensors = {key: self._graph.get_tensor_by_name(name)
+                             for key, name in self._meta['tensors'].items()}
+            self.x = self._tensors['x']
+            self.seqLen = self._tensors['seqLen']
+            self.sampleLen = self._tensors['sampleLen']
+            self.sampleNum = self._tensors['sampleNum']
+            # <Tensorflow Session>.
+            self._sess = tf.Session(graph=self._graph)
+
+    """#########################################################################
+    impaint: impaint time series with missing data.
+    #########################################################################"""
+    def impaint(self, input, *args, **kwargs):
+        return _model.impaint(self, input, *args, **kwargs)
+
+    """#########################################################################
+    reconstruct: reconstruction the noise-free version of data.
+    #########################################################################"""
+    def reconstruct(self, input):
+        if 'outputs' not in self._tensors:
+            raise ValueError("The frozen model does not contain the reconstruction!")
+        if self._meta['padding']:
+            zero_padd = np.zeros(shape=(input.shape[0], 1, input.shape[2]), dtype='float32')
+            con_input = np.concatenate((zero_padd, input), axis=1)
+            output = self._sess.run(self._tensors['outputs'], feed_dict={self.x: con_input})
+            return output[:, 0:-1, :]
+        else:
+            return self._sess.run(self._tensors['outputs'], feed_dict={self.x: input})
+
+    """#########################################################################
+    embed: return extracted feature/descriptor/representation of data.
+    #########################################################################"""
+    def embed(self, input, *args, **kwargs):
+        # if the input is not in batch format, reshape it.
+        if len(input.shape) == 2:
+            input = input.reshape([-1, input.shape[0], input.shape[1]])
+        elif len(input.shape) == 1:
+            input = input.reshape([-1, 1, input.shape[0]])
+        #
+        if ('sparse' in args or 'sparse' in kwargs) and 'sparse_feature' in self._tensors:
+            return self._sess.run(self._tensors['sparse_feature'], feed_dict={self.x: input})
+        elif 'feature' in self._tensors:
+            return self._sess.run(self._tensors['feature'], feed_dict={self.x: input})
+        else:
+            raise ValueError("The frozen model does not contain the feature extraction!")
+
+    """#########################################################################
+    generate: generate sample sequence with the length as numSteps.
+    input: numSteps - the length of the sequences.
+           numSamples - the number of independent sequences sampled in parallel.
+    output: the samples with shape [numSteps, dimIN] if numSamples is None,
+            otherwise [numSamples, numSteps, dimIN].
+    #########################################################################"""
+    def generate(self, numSteps, numSamples=None):
+        if 'gen' not in self._tensors:
+            raise ValueError("The frozen model does not contain the generation!")
+        if numSamples is None:
+            return self._sess.run(self._tensors['gen'], feed_dict={self.sampleLen: numSteps})[0]
+        return self._sess.run(self._tensors['gen'], feed_dict={self.sampleLen: numSteps,
+                                                               self.sampleNum: numSamples})
@@ -13,16 +13,33 @@ import time
 """#########################MATH TOOLS##############################"""
 """#########################MATH TOOLS##############################"""
 
+"""#########################################################################
+MaskedMean: function to compute the mean of the valid steps of sequences.
+input: value - the tensor with shape [batch, steps, ...].
+       mask - the mask of valid steps with shape [batch, steps]. If None, all
+              the steps are valid.
+output: the mean of the valid entries.
+#########################################################################"""
+def MaskedMean(value, mask=None):
+    if mask is None:
+        return tf.reduce_mean(value)
+    mask = tf.cast(mask, value.dtype)
+    for i in range(value.shape.ndims - mask.shape.ndims):
+        mask = tf.expand_dims(mask, axis=-1)
+    mask = mask * tf.ones_like(value)
+    return tf.reduce_sum(value * mask) / tf.maximum(tf.reduce_sum(mask), 1.0)
+
 """#########################################################################
 BernoulliNLL: function to compute the negative log-likelihood of Bernoulli
               distribution.
 input: x - network input indicated by <tensor placeholder>. 
        P - the probability of 1.
+       mask - the mask of valid steps [batch, steps] (None for all valid).
 output: nll - a tensor representing the NLL per bit.
 #########################################################################"""
-def BernoulliNLL(x, P):
+def BernoulliNLL(x, P, mask=None):
     nll = x * tf.log(P+1e-8) + (1 - x) * tf.log(1-P+1e-8)
-    return -tf.reduce_mean(nll)
+    return -MaskedMean(nll, mask)
 
 """#########################################################################
 GaussNLL: function to compute the negative log-likelihood of Gaussian 
@@ -30,10 +47,11 @@ GaussNLL: function to compute the negative log-likelihood of Gaussian
 input: x - network input indicated by <tensor placeholder>. 
        mean - mean of the Gaussian distribution computed by the graph.
        sigma - variance of the Gaussian distribution computed by the graph.
+       mask - the mask of valid steps [batch, steps] (None for all valid).
 output: nll - a tensor representing the NLL per bit.
 #########################################################################"""
-def GaussNLL(x, mean, sigma):
-    nll = 0.5*tf.reduce_mean(tf.div(tf.square(x-mean), sigma) + tf.log(sigma)) + 0.5*tf.log(2*np.pi)
+def GaussNLL(x, mean, sigma, mask=None):
+    nll = 0.5*MaskedMean(tf.div(tf.square(x-mean), sigma) + tf.log(sigma), mask) + 0.5*tf.log(2*np.pi)
     return nll
 
 """#########################################################################
@@ -43,12 +61,62 @@ input: meanP - mean of the Gaussian distribution "P"
        sigmaP - variance of the Gaussian distribution "P".
        meanQ - mean of the Gaussian distribution "P"
        sigmaQ - variance of the Gaussian distribution "P".
+       mask - the mask of valid steps [batch, steps] (None for all valid).
 output: kl - a tensor representing the KL divergence per bit.
 #########################################################################"""
-def GaussKL(meanP, sigmaP, meanQ, sigmaQ):
+def GaussKL(meanP, sigmaP, meanQ, sigmaQ, mask=None):
     term1 = tf.log(sigmaQ + 1e-8) - tf.log(sigmaP + 1e-8)
     term2 = tf.div(sigmaP + (meanP - meanQ)**2, sigmaQ + 1e-8)
-    return 0.5 * tf.reduce_mean(term1 + term2) - 0.5
+    return 0.5 * MaskedMean(term1 + term2, mask) - 0.5
+
+"""#########################################################################
+BernoulliLL: function to compute the log-likelihood of each frame under the
+             Bernoulli distribution.
+input: x - the binary frames with shape [batch, steps, frame].
+       P - the probability of 1.
+output: the log-likelihood with shape [batch, steps].
+#########################################################################"""
+def BernoulliLL(x, P):
+    return tf.reduce_sum(x * tf.log(P+1e-8) + (1 - x) * tf.log(1-P+1e-8), axis=-1)
+
+"""#########################################################################
+GaussLL: function to compute the log-likelihood of each frame under the
+         Gaussian distribution with a diagonal covariance matrix.
+input: x - the frames with shape [batch, steps, frame].
+       mean - mean of the Gaussian distribution.
+       sigma - variance of the Gaussian distribution.
+output: the log-likelihood with shape [batch, steps].
+#########################################################################"""
+def GaussLL(x, mean, sigma):
+    return -0.5 * tf.reduce_sum(tf.div(tf.square(x-mean), sigma) + tf.log(sigma) + np.log(2*np.pi), axis=-1)
+
+"""#########################################################################
+sequence_generator: build a generator over the sequences with various lengths.
+input: data - the list of sequences with shape [steps, frame].
+       shuffle - bool indicating whether shuffle the sequences.
+output: generator - a callable that returns the iterator of (sequence, length).
+#########################################################################"""
+def sequence_generator(data, shuffle=True):
+    def generator():
+        idx = np.arange(len(data), dtype="int64")
+        if shuffle:
+            np.random.shuffle(idx)
+        for i in idx:
+            sample = np.asarray(data[i], dtype='float32')
+            yield sample, sample.shape[0]
+    return generator
+
+"""#########################################################################
+feedable_state: make the (nested) initial state of a recurrent cell feedable
+                so that the state can be carried across session calls.
+input: state - the (nested) initial state, e.g. cells.zero_state(...).
+output: state - the same structure whose tensors can be fed (the default
+                values are the given state).
+#########################################################################"""
+def feedable_state(state):
+    return tf.contrib.framework.nest.map_structure(
+        lambda s: tf.placeholder_with_default(s, shape=[None] + s.shape.as_list()[1:]), state)
+
 
 
 """#########################MODEL TRAINING##############################"""
@@ -82,5 +150,27 @@ def get_batches_idx(len, batch_size, shuffle=True):
         minibatches.append(batch)
     return minibatches
 
-
-
+"""#########################################################################
+chunk_generator: build a generator that streams samples from a large (HDF5)
+                 array chunk by chunk. Only one chunk is loaded into memory
+                 at a time, so the memory does not depend on the data size.
+input: data - the array-like data (e.g. h5py dataset) with shape [N, ...].
+       chunkSize - the number of samples loaded per chunk.
+       shuffle - bool indicating whether shuffle the chunks and the samples
+                 inside each chunk.
+output: generator - a callable that returns the sample iterator (used by
+                    tf.data.Dataset.from_generator).
+#########################################################################"""
+def chunk_generator(data, chunkSize=1000, shuffle=True):
+    def generator():
+        starts = np.arange(0, len(data), chunkSize, dtype="int64")
+        if shuffle:
+            np.random.shuffle(starts)
+        for start in starts:
+            # contiguous slices are cheap to read from HDF5.
+            chunk = np.asarray(data[start:start + chunkSize], dtype='float32')
+            if shuffle:
+                np.random.shuffle(chunk)
+            for sample in chunk:
+                yield sample
+    return generator
@@ -0,0 +1,57 @@
+"""#########################################################################
+Author: Yingru Liu
+Institute: Stony Brook University
+Descriptions: Benchmark of the VRNN with the MLP of X computed inside the
+              recurrence and hoisted out of it (Config.hoistMLP), using the
+              configuration of Projects/LakhMidi/midiVRNN.py.
+#########################################################################"""
+from dl4s.SeqVAE.VRNN import binVRNN
+from dl4s.SeqVAE import configVRNN
+import numpy as np
+import tempfile
+import os
+import time
+
+if __name__ == '__main__':
+    X = np.random.binomial(1, 0.1, size=(128, 100, 128))
+    Config = configVRNN()
+    Config.Opt = 'SGD'
+    Config.recType = 'GRU'
+    Config.dimRec = [500]
+    Config.dimForX = [400]
+    Config.dimForZ = [400]
+    Config.dimIN = 128
+    Config.dimState = 500
+    Config.init_scale = 0.01
+    Config.eventPath = None
+    Config.savePath = None
+    folder = tempfile.mkdtemp()
+
+    """
+    the two paths share the same parameters.
+    """
+    models = dict()
+    for hoist in [False, True]:
+        Config.hoistMLP = hoist
+        models[hoist] = binVRNN(Config)
+        if not hoist:
+            models[hoist].saveModel(os.path.join(folder, 'VRNN'))
+            Config.loadPath = os.path.join(folder, 'VRNN')
+    Config.loadPath = None
+
+    """
+    the ELBO of both paths should agree up to the sampling noise.
+    """
+    for hoist in [False, True]:
+        elbo = np.mean([models[hoist].val_function(input=X) for _ in range(20)])
+        print("hoistMLP = %s: the valid ELBO is %f." % (hoist, elbo))
+
+    """
+    the time of the training step.
+    """
+    for hoist in [False, True]:
+        models[hoist].train_function(input=X, lrate=0.0)
+        start = time.time()
+        for i in range(10):
+            models[hoist].train_function(input=X, lrate=0.0)
+        print("hoistMLP = %s: %f seconds per training step." % (hoist, (time.time() - start) / 10))
@@ -0,0 +1,42 @@
+"""#########################################################################
+Author: Yingru Liu
+Institute: Stony Brook University
+Descriptions: Benchmark of the recurrent units built by buildRec on CPUs,
+              comparing the generic LSTM/GRU cells with the fused block
+              kernels (BlockLSTM/BlockGRU) for the 500-unit configurations.
+#########################################################################"""
+import os
+os.environ['CUDA_VISIBLE_DEVICES'] = ''
+from dl4s.SeqVAE.utility import buildRec
+import tensorflow as tf
+import numpy as np
+import time
+
+if __name__ == '__main__':
+    X = np.random.binomial(1, 0.1, size=(64, 200, 128)).astype('float32')
+    numSteps = 10
+    for unitType in ['LSTM', 'BlockLSTM', 'GRU', 'BlockGRU']:
+        graph = tf.Graph()
+        with graph.as_default():
+            x = tf.placeholder(dtype=tf.float32, shape=[None, None, 128])
+            cells = buildRec([500], unitType, 0.01)
+            outputs, _ = tf.nn.dynamic_rnn(cells, x, dtype=tf.float32)
+            loss = tf.reduce_mean(tf.square(outputs))
+            train = tf.train.GradientDescentOptimizer(0.0).minimize(loss)
+            sess = tf.Session()
+            sess.run(tf.global_variables_initializer())
+            """
+            the forward pass and the training step (the first run includes the warm-up).
+            """
+            sess.run(train, feed_dict={x: X})
+            start = time.time()
+            for i in range(numSteps):
+                sess.run(outputs, feed_dict={x: X})
+            forward = (time.time() - start) / numSteps / X.shape[1]
+            start = time.time()
+            for i in range(numSteps):
+                sess.run(train, feed_dict={x: X})
+            backward = (time.time() - start) / numSteps / X.shape[1]
+            print("%s: %f ms per step (forward), %f ms per step (training)."
+                  % (unitType, forward * 1000, backward * 1000))
+            sess.close()
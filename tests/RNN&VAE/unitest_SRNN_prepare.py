@@ -0,0 +1,55 @@
+"""#########################################################################
+Author: Yingru Liu
+Institute: Stony Brook University
+Descriptions: Test code for the stochastic cell of the SRNN, where the scan
+              over the projections of stoCell.prepare (stoCell.step) and the
+              decoder outside the recurrence (stoCell.decode) should give the
+              same outputs as the step-by-step stoCell.__call__ with the same
+              weights. The samples Z of __call__ are taken as the previous
+              states of step, so the comparison does not depend on sampling.
+#########################################################################"""
+from dl4s.SeqVAE.utility import stoCell
+from dl4s.SeqVAE import configSRNN
+import tensorflow as tf
+import numpy as np
+
+if __name__ == '__main__':
+    batch, steps = 16, 30
+    Config = configSRNN()
+    Config.dimRecD = [64]
+    Config.dimRecA = [48]
+    Config.dimDec = [64]
+    Config.dimIN = 40
+    Config.dimState = 20
+    Config.init_scale = 0.1
+    for dimEnc, Res in [([], False), ([64], False), ([], True), ([64, 32], True)]:
+        Config.dimEnc = dimEnc
+        Config.Res = Res
+        graph = tf.Graph()
+        with graph.as_default():
+            d_t = tf.constant(np.random.randn(batch, steps, Config.dimRecD[-1]).astype('float32'))
+            a_t = tf.constant(np.random.randn(batch, steps, Config.dimRecA[-1]).astype('float32'))
+            state0 = tf.constant(np.random.randn(batch, Config.dimState).astype('float32'))
+            SSM = stoCell(Config)
+            """
+            the step-by-step cell.
+            """
+            outputs, _ = tf.nn.dynamic_rnn(SSM, tf.concat(axis=-1, values=(d_t, a_t)), initial_state=state0)
+            z = outputs[-1]
+            """
+            the prepared projections, with all the steps run as one batch.
+            """
+            z_prev = tf.concat(axis=1, values=(tf.expand_dims(state0, 1), z[:, 0:-1]))
+            x = SSM.prepare(d_t, a_t)
+            outputs2, _ = SSM.step(tf.reshape(x, [batch * steps, -1]),
+                                   tf.reshape(z_prev, [batch * steps, Config.dimState]))
+            outputs2 = [tf.reshape(output, [batch, steps, -1]) for output in outputs2[0:-1]] + \
+                       [SSM.decode(z, d_t)]
+            sess = tf.Session()
+            sess.run(tf.global_variables_initializer())
+            values, values2 = sess.run([outputs[0:-1], outputs2])
+            sess.close()
+        error = max([np.abs(value - value2).max() for value, value2 in zip(values, values2)])
+        print("dimEnc = %s, Res = %s: the max error of (prior_mu, prior_sig, pos_mu, pos_sig, hidden_dec) is %e."
+              % (dimEnc, Res, error))
+        assert error < 1e-4
@@ -0,0 +1,41 @@
+"""#########################################################################
+Author: Yingru Liu
+Institute: Stony Brook University
+Descriptions: Test code for the gradient accumulation, i.e. one update with
+              the gradients accumulated over micro-batches should be the
+              same as one update with the full batch.
+#########################################################################"""
+from dl4s.autoregRnn import binRNN
+from dl4s.autoregRnn import config
+import numpy as np
+import tempfile
+import os
+
+if __name__ == '__main__':
+    X = np.random.binomial(1, 0.5, size=(40, 25, 100))
+    Config = config()
+    Config.Opt = 'SGD'
+    Config.dimLayer = [100, 500, 100]
+    Config.eventPath = None
+    Config.savePath = None
+    folder = tempfile.mkdtemp()
+
+    """
+    the two models share the same parameters.
+    """
+    RNN = binRNN(Config)
+    RNN.saveModel(os.path.join(folder, 'RNN'))
+    Config.loadPath = os.path.join(folder, 'RNN')
+    RNN2 = binRNN(Config)
+    Config.loadPath = None
+
+    """
+    one full-batch step and one accumulated step with 4 micro-batches.
+    """
+    loss = RNN.train_function(input=X, lrate=0.1)
+    loss2 = RNN2.accumulate_function(input=X, lrate=0.1, numMicro=4)
+    print("The training loss is %f (full batch) and %f (accumulated)." % (loss, loss2))
+    val = RNN.val_function(input=X)
+    val2 = RNN2.val_function(input=X)
+    print("The valid loss after the update is %f (full batch) and %f (accumulated)." % (val, val2))
+    assert np.allclose(val, val2, rtol=1e-4)
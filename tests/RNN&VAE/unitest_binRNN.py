@@ -31,6 +31,14 @@ if __name__ == '__main__':
     samples = RNN.generate(numSteps=40)
     imgplot = plt.imshow(samples, cmap='binary')
     plt.show()
+    # test the batched generation.
+    print(RNN.generate(numSteps=40, numSamples=10).shape)
+
+    """
+    test the truncated BPTT over long sequences.
+    """
+    for i in range(10):
+        print("The TBPTT loss is %f." % RNN.tbptt_function(input=X, lrate=0.1, window=10))
 
     """
     test saving and restoring model.
@@ -58,4 +66,18 @@ if __name__ == '__main__':
     X['train'] = np.random.binomial(1, 0.5, size=(130, 25, 100))
     X['valid'] = np.random.binomial(1, 0.5, size=(130, 25, 100))
     X['test'] = np.random.binomial(1, 0.5, size=(130, 25, 100))
-    RNN.full_train(dataset=X, maxEpoch=5, earlyStop=10,  batchSize=125, learning_rate=0.1, saveto=None)
\ No newline at end of file
+    RNN.full_train(dataset=X, maxEpoch=5, earlyStop=10,  batchSize=125, learning_rate=0.1, saveto=None)
+    """
+    test the fused training with the in-graph iterator.
+    """
+    RNN.full_train(dataset=X, maxEpoch=5, earlyStop=10, batchSize=125, learning_rate=0.1, saveto=None,
+                   valid_batchSize=125, fused=True)
+    """
+    test the bucketed training with sequences of various lengths.
+    """
+    X = dict()
+    X['train'] = [np.random.binomial(1, 0.5, size=(np.random.randint(10, 40), 100)) for _ in range(130)]
+    X['valid'] = [np.random.binomial(1, 0.5, size=(np.random.randint(10, 40), 100)) for _ in range(130)]
+    X['test'] = [np.random.binomial(1, 0.5, size=(np.random.randint(10, 40), 100)) for _ in range(130)]
+    RNN.full_train(dataset=X, maxEpoch=5, earlyStop=10, batchSize=25, learning_rate=0.1, saveto=None,
+                   buckets=[15, 20, 25, 30, 35])
\ No newline at end of file
@@ -34,6 +34,8 @@ if __name__ == '__main__':
     test the generating sample.
     """
     print("The valid ELBO is %f." % VRNN.val_function(input=X))
+    # the importance-weighted bound with 50 samples drawn in chunks of 10.
+    print("The valid IWAE bound is %f." % VRNN.iwae_function(input=X, K=50, chunk=10))
     samples = VRNN.generate(numSteps=40)
     plt.figure(1)
     plt.imshow(samples, cmap='binary')
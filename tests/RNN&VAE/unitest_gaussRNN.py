@@ -34,6 +34,23 @@ if __name__ == '__main__':
     feature = RNN.embed(samples)
     imgplot = plt.imshow(samples, cmap='jet')
     plt.show()
+    # test the frame-by-frame streaming inference.
+    Stream = RNN.stream()
+    outputs, features = [], []
+    for t in range(samples.shape[0]):
+        out = Stream.step(samples[t])
+        outputs.append(out['outputs'])
+        features.append(out['feature'])
+    outputs, features = np.stack(outputs), np.stack(features)
+    # the step t predicts the frame t+1, i.e. the step t+1 of the reconstruction.
+    recon = RNN.reconstruct(samples.reshape(1, samples.shape[0], samples.shape[1]))[0]
+    print(np.abs(outputs[0:-1] - recon[1:]).max())
+    assert np.allclose(outputs[0:-1], recon[1:], atol=1e-5)
+    # the feature of the whole sequence behind the zero frame.
+    padded = np.concatenate((np.zeros((1, samples.shape[1])), samples), axis=0)
+    feature = RNN.embed(padded)[0, 1:]
+    print(np.abs(features - feature).max())
+    assert np.allclose(features, feature, atol=1e-5)
 
     """
     test saving and restoring model.
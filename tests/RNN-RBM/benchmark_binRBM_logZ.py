@@ -0,0 +1,48 @@
+"""#########################################################################
+Author: Yingru Liu
+Institute: Stony Brook University
+Descriptions: Benchmark of the exact partition function of the binary RBM
+              against the AIS estimates with various levels.
+#########################################################################"""
+
+
+from dl4s.TRBM.RBM import binRBM
+import tensorflow as tf
+import time
+
+if __name__ == '__main__':
+    graph = tf.Graph()
+    with graph.as_default():
+        RBM = binRBM(dimV=100, dimH=16, init_scale=0.5)
+        exact = RBM.ExactLogZ(chunk=4096)
+        estimates = {levels: RBM.AIS(run=100, levels=levels) for levels in [10, 100, 1000, 5000]}
+        sess = tf.Session()
+        sess.run(tf.global_variables_initializer())
+
+        """
+        the exact partition function (the first run includes the warm-up).
+        """
+        sess.run(exact)
+        start = time.time()
+        logZ = sess.run(exact)
+        print("Exact: logZ = %f in %f seconds." % (logZ, time.time() - start))
+
+        """
+        the AIS estimates with various levels.
+        """
+        for levels in sorted(estimates):
+            sess.run(estimates[levels])
+            start = time.time()
+            logZ_ais = sess.run(estimates[levels])
+            print("AIS with %d levels: logZ = %f (error %f) in %f seconds."
+                  % (levels, logZ_ais, logZ_ais - logZ, time.time() - start))
+
+        """
+        the cost of the exact partition function with different chunks.
+        """
+        for chunk in [256, 4096, 65536]:
+            op = RBM.ExactLogZ(chunk=chunk)
+            sess.run(op)
+            start = time.time()
+            sess.run(op)
+            print("Exact with chunk %d in %f seconds." % (chunk, time.time() - start))
@@ -0,0 +1,55 @@
+"""#########################################################################
+Author: Yingru Liu
+Institute: Stony Brook University
+Descriptions: Benchmark of the AIS of the binary RNNRBM with the runs shared
+              by a pool of processes (Config.numThreads) against one process,
+              over several test batches with the same parameters.
+#########################################################################"""
+
+
+from dl4s.TRBM import configRNNRBM
+from dl4s.TRBM import binRnnRBM
+import numpy as np
+import tempfile
+import os
+import time
+
+if __name__ == '__main__':
+    X = np.random.binomial(1, 0.1, size=(5, 25, 100, 88))
+    Config = configRNNRBM()
+    Config.Opt = 'SGD'
+    Config.dimRec = [200]
+    Config.dimMlp = [200]
+    Config.dimIN = 88
+    Config.dimState = 200
+    Config.init_scale = 0.01
+    Config.aisRun = 100
+    Config.aisLevel = 1000
+    Config.savePath = None
+    Config.eventPath = None
+    folder = tempfile.mkdtemp()
+
+    """
+    the models share the same parameters.
+    """
+    models = dict()
+    for numThreads in [1, 2, 4]:
+        Config.numThreads = numThreads
+        models[numThreads] = binRnnRBM(Config)
+        if numThreads == 1:
+            models[numThreads].saveModel(os.path.join(folder, 'RNNRBM'))
+            Config.loadPath = os.path.join(folder, 'RNNRBM')
+    Config.loadPath = None
+
+    """
+    the time of the AIS per batch (the first batch includes the start of the pool).
+    """
+    for numThreads in sorted(models):
+        start = time.time()
+        nll = [models[numThreads].ais_function(input=X[0])]
+        first = time.time() - start
+        start = time.time()
+        for batch in X[1:]:
+            nll.append(models[numThreads].ais_function(input=batch))
+        print("numThreads = %d: the NLL is %f, %f seconds for the first batch and %f seconds per batch later."
+              % (numThreads, np.mean(nll), first, (time.time() - start) / (X.shape[0] - 1)))
@@ -8,6 +8,7 @@ Descriptions: Test code for the binary RNNRBM.
 
 from dl4s.TRBM import configRNNRBM
 from dl4s.TRBM import binRnnRBM
+from dl4s import frozenModel
 import numpy as np
 import matplotlib.pyplot as plt
 
@@ -29,6 +30,11 @@ if __name__ == '__main__':
     test training and model operation.
     """
     RNNRBM = binRnnRBM(Config)
+    # test the truncated BPTT over long sequences.
+    for i in range(5):
+        print("The TBPTT loss is %f." % RNNRBM.tbptt_function(input=X, lrate=0.01, window=50))
+    # test a longer Gibbs chain at run time.
+    print("The valid loss with 50 Gibbs steps is %f." % RNNRBM.val_function(input=X, gibbs=50))
     """
     test the full training function.
     """
@@ -47,6 +53,9 @@ if __name__ == '__main__':
     samples = RNNRBM.generate(numSteps=40)
     plt.figure(1)
     plt.imshow(samples, cmap='binary')
+    # continue a prefix several times.
+    primer = RNNRBM.prime(X[0, 0:20])
+    print(RNNRBM.generate(numSteps=20, numSamples=5, primer=primer).shape)
 
     """
     test the feature embedding.
@@ -63,3 +72,29 @@ if __name__ == '__main__':
     plt.imshow(re[0], cmap='jet')
     plt.show()
 
+    """
+    test the frozen model for inference.
+    """
+    RNNRBM.freezeModel('./frozenRnnRBM')
+    Frozen = frozenModel('./frozenRnnRBM')
+    print(np.abs(Frozen.reconstruct(X[0:2]) - re).max())
+    print(np.abs(Frozen.embed(X[0]) - feature).max())
+    print(Frozen.generate(numSteps=40).shape)
+
+
+    """
+    test the training and generating with parallel tempering.
+    """
+    Config.Tempering = [1.0, 0.9, 0.8, 0.7]
+    RNNRBM = binRnnRBM(Config)
+    for i in range(5):
+        print("The tempering loss is %f." % RNNRBM.train_function(input=X, lrate=0.01))
+    print(RNNRBM.generate(numSteps=40).shape)
+
+    """
+    test the AIS shared by several processes.
+    """
+    Config.Tempering = None
+    Config.numThreads = 2
+    RNNRBM = binRnnRBM(Config)
+    print(RNNRBM.ais_function(input=X[0:25]))
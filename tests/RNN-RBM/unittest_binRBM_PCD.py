@@ -0,0 +1,45 @@
+"""#########################################################################
+Author: Yingru Liu
+Institute: Stony Brook University
+Descriptions: Test code for the persistent contrastive divergence (PCD) of
+              the unconditional binary RBM against CD with the same Gibbs
+              steps, measured by the exact negative log-likelihood.
+#########################################################################"""
+
+
+from dl4s.TRBM.RBM import binRBM
+import tensorflow as tf
+import numpy as np
+
+if __name__ == '__main__':
+    # the data are noisy copies of a few prototypes.
+    prototypes = np.random.binomial(1, 0.5, size=(5, 64))
+    X = prototypes[np.random.randint(0, 5, size=1000)]
+    X = np.abs(X - np.random.binomial(1, 0.05, size=X.shape)).astype('float32')
+    for persistent in [False, True]:
+        graph = tf.Graph()
+        with graph.as_default():
+            tf.set_random_seed(1234)
+            RBM = binRBM(dimV=64, dimH=16, init_scale=0.01)
+            Loss = RBM.ComputeLoss(V=RBM._V, samplesteps=1, persistent=persistent)
+            train = tf.train.GradientDescentOptimizer(0.05).minimize(Loss)
+            nll = tf.reduce_mean(RBM.FreeEnergy(RBM._V)) + RBM.ExactLogZ()
+            sess = tf.Session()
+            sess.run([tf.global_variables_initializer(), tf.local_variables_initializer()])
+            for epoch in range(20):
+                for start in range(0, X.shape[0], 100):
+                    sess.run(train, feed_dict={RBM._V: X[start:start + 100]})
+            print("persistent = %s: the exact NLL is %f." % (persistent, sess.run(nll, feed_dict={RBM._V: X})))
+            sess.close()
+
+    """
+    the conditional RBM does not support the persistent chains.
+    """
+    graph = tf.Graph()
+    with graph.as_default():
+        V = tf.placeholder(dtype=tf.float32, shape=[None, None, 64])
+        RBM = binRBM(dimV=64, dimH=16, init_scale=0.01, x=V, bv=tf.zeros_like(V))
+        try:
+            RBM.ComputeLoss(V=V, samplesteps=1, persistent=True)
+        except ValueError as error:
+            print(error)
@@ -0,0 +1,68 @@
+"""#########################################################################
+Author: Yingru Liu
+Institute: Stony Brook University
+Descriptions: Test code for the NVIL of the binary RNNRBM with the VAE fused
+              into the graph of the model (Config.fuseVAE), which should give
+              the same loss as the NVIL run through the session of the VAE.
+#########################################################################"""
+
+
+from dl4s.TRBM import configRNNRBM
+from dl4s.TRBM import binRnnRBM
+from dl4s.SeqVAE.SRNN import binSRNN
+from dl4s.SeqVAE import configSRNN
+import numpy as np
+import tempfile
+import os
+
+if __name__ == '__main__':
+    X = np.random.binomial(1, 0.1, size=(10, 50, 88))
+    ConfigVAE = configSRNN()
+    ConfigVAE.Opt = 'SGD'
+    ConfigVAE.dimRecD = [100]
+    ConfigVAE.dimRecA = [100]
+    ConfigVAE.dimEnc = [100]
+    ConfigVAE.dimDec = [100]
+    ConfigVAE.dimIN = 88
+    ConfigVAE.dimState = 50
+    ConfigVAE.init_scale = 0.01
+    ConfigVAE.eventPath = None
+    ConfigVAE.savePath = None
+    SRNN = binSRNN(ConfigVAE)
+    for i in range(10):
+        SRNN.train_function(input=X, lrate=0.01)
+
+    Config = configRNNRBM()
+    Config.Opt = 'SGD'
+    Config.dimRec = [100]
+    Config.dimMlp = [100]
+    Config.dimIN = 88
+    Config.dimState = 100
+    Config.init_scale = 0.01
+    Config.aisRun = 100
+    Config.savePath = None
+    Config.eventPath = None
+    folder = tempfile.mkdtemp()
+
+    """
+    the two models share the same parameters and the same VAE.
+    """
+    models = dict()
+    for fuse in [False, True]:
+        Config.fuseVAE = fuse
+        models[fuse] = binRnnRBM(Config, VAE=SRNN)
+        if not fuse:
+            models[fuse].train_function(input=X, lrate=0.01)
+            models[fuse].saveModel(os.path.join(folder, 'RNNRBM'))
+            Config.loadPath = os.path.join(folder, 'RNNRBM')
+    Config.loadPath = None
+    Config.fuseVAE = False
+
+    """
+    the NVIL losses of the fixed batch should agree up to the sampling noise.
+    """
+    loss = dict()
+    for fuse in [False, True]:
+        loss[fuse] = np.mean([models[fuse].ais_function(input=X) for _ in range(10)])
+        print("fuseVAE = %s: the NVIL loss is %f." % (fuse, loss[fuse]))
+    assert np.abs(loss[True] - loss[False]) < 0.05 * np.abs(loss[False])
@@ -69,3 +69,20 @@ if __name__ == '__main__':
     RNNRBM.full_train(dataset=X, maxEpoch=5, earlyStop=10, batchSize=125, valid_batchSize=25, learning_rate=0.001,
                     saveto=None)
 
+
+    """
+    test the AIS annealed in chunks of runs.
+    """
+    Config.aisChunk = 5
+    RNNRBM = ssRNNRBM(Config)
+    print(RNNRBM.ais_function(X['test'][0:25]))
+
+    """
+    test the AIS schedules and the effective sample size.
+    """
+    Config.aisChunk = None
+    for schedule in ['linear', 'geometric', 'sigmoid', 'adaptive']:
+        Config.aisSchedule = schedule
+        RNNRBM = ssRNNRBM(Config)
+        nll, ess = RNNRBM.ais_function(X['test'][0:25], ess=True)
+        print("%s: NLL = %f, ESS = %f." % (schedule, nll, ess.mean()))
@@ -36,6 +36,15 @@ if __name__ == '__main__':
     """
     print(CGRNN.ais_function(input=X))
 
+    """
+    test the training with the input MLP hoisted out of the recurrence.
+    """
+    Config.hoistMLP = True
+    CGRNN2 = binCGRNN(Config)
+    for i in range(10):
+        print("The training error (hoisted MLP) is %f." % CGRNN2.train_function(input=X, lrate=0.1))
+    Config.hoistMLP = False
+
     """
         test the generating sample.
         """